@@ -0,0 +1 @@
+"""Benchmarks of castep_outputs_tools."""
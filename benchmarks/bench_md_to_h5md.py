@@ -0,0 +1,148 @@
+"""
+Benchmarks of md_to_h5md stages.
+
+Run with pytest-benchmark, saving results to compare between commits:
+
+.. code-block:: sh
+
+   pytest benchmarks/bench_md_to_h5md.py --benchmark-autosave
+   pytest benchmarks/bench_md_to_h5md.py --benchmark-compare
+
+Besides timings, each benchmark records ``frames_per_s``, ``mb_per_s``
+and ``peak_mb`` (peak memory traced while running once) in its
+``extra_info``.
+"""
+from __future__ import annotations
+
+import tracemalloc
+
+import numpy as np
+
+from castep_outputs_tools.h5md_writers import HDF5Writer
+from castep_outputs_tools.md_parser import parse_frames, read_header
+from castep_outputs_tools.md_to_h5md import _create_groups, _write_block, md_to_h5md
+
+
+def _peak_mb(func, *args, **kwargs) -> float:
+    """
+    Get the peak memory traced while calling a function.
+
+    Parameters
+    ----------
+    func : Callable
+        Function to call.
+    *args, **kwargs
+        Arguments of `func`.
+
+    Returns
+    -------
+    float
+        Peak traced memory in MB.
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def _record(benchmark, n_frames: int, n_bytes: int, peak_mb: float):
+    """
+    Record throughput and memory use of a benchmark.
+
+    Parameters
+    ----------
+    benchmark : BenchmarkFixture
+        Completed benchmark.
+    n_frames : int
+        Number of frames processed per round.
+    n_bytes : int
+        Number of bytes of .md processed per round.
+    peak_mb : float
+        Peak memory in MB.
+    """
+    if benchmark.disabled:
+        return
+    mean = benchmark.stats.stats.mean
+    benchmark.extra_info.update(frames_per_s=n_frames / mean, mb_per_s=n_bytes / 1e6 / mean,
+                                peak_mb=peak_mb)
+
+
+def _frames(path) -> tuple[bytes, bytes]:
+    """
+    Read the header and frames of an .md file.
+
+    Parameters
+    ----------
+    path : Path
+        File to read.
+
+    Returns
+    -------
+    header : bytes
+        Header block.
+    frames : bytes
+        Raw frame data.
+    """
+    with path.open("rb") as md_file:
+        return read_header(md_file), md_file.read()
+
+
+def test_parse(benchmark, md_file):
+    """Time the fast parser on a whole trajectory."""
+    path, n_frames = md_file
+    _, data = _frames(path)
+
+    benchmark(parse_frames, data)
+    _record(benchmark, n_frames, len(data), _peak_mb(parse_frames, data))
+
+
+def test_create_groups(benchmark, md_file, tmp_path):
+    """Time creating the h5md layout of a trajectory."""
+    path, n_frames = md_file
+    atoms = parse_frames(_frames(path)[1])["species"]
+
+    def setup():
+        species = list(dict.fromkeys(atoms))
+        return (HDF5Writer(tmp_path / "groups.h5md"), species, atoms, n_frames), {}
+
+    def create(out_file, *args):
+        with out_file:
+            _create_groups(out_file, *args)
+
+    benchmark.pedantic(create, setup=setup, rounds=10)
+    _record(benchmark, n_frames, 0, _peak_mb(create, *setup()[0]))
+
+
+def test_write_frames(benchmark, md_file, tmp_path):
+    """Time writing parsed frames to preallocated datasets."""
+    path, n_frames = md_file
+    block = parse_frames(_frames(path)[1])
+    block["step"] = np.arange(1, n_frames + 1)
+    atoms = block["species"]
+
+    def setup():
+        out_file = HDF5Writer(tmp_path / "frames.h5md")
+        _create_groups(out_file, list(dict.fromkeys(atoms)), atoms, n_frames)
+        return (out_file,), {}
+
+    def write(out_file):
+        with out_file:
+            _write_block(out_file, block, 0)
+
+    benchmark.pedantic(write, setup=setup, rounds=5)
+    _record(benchmark, n_frames, path.stat().st_size, _peak_mb(write, *setup()[0]))
+
+
+def test_convert(benchmark, md_file, tmp_path):
+    """Time converting a trajectory end to end."""
+    path, n_frames = md_file
+    out_path = tmp_path / "convert.h5md"
+
+    def convert():
+        with path.open("rb") as in_file:
+            md_to_h5md(in_file, out_path)
+
+    benchmark.pedantic(convert, rounds=5)
+    _record(benchmark, n_frames, path.stat().st_size, _peak_mb(convert))
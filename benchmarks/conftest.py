@@ -0,0 +1,46 @@
+"""Fixtures providing synthetic trajectories to benchmarks."""
+from __future__ import annotations
+
+import pytest
+
+from .md_generator import parse_species, write_md
+
+#: Default trajectory sizes benchmarked as ``(atoms, frames)``.
+DEFAULT_SIZES = ("64x400", "512x50")
+
+
+def pytest_addoption(parser):
+    """Add options setting the synthetic trajectories benchmarked."""
+    group = parser.getgroup("md trajectories")
+    group.addoption("--md-sizes", default=",".join(DEFAULT_SIZES),
+                    help="Comma-separated <atoms>x<frames> sizes of synthetic trajectories.")
+    group.addoption("--md-species", default="Si:3,O:1",
+                    help="Species mix of synthetic trajectories as species:weight pairs.")
+
+
+def pytest_generate_tests(metafunc):
+    """Benchmark each requested trajectory size."""
+    if "md_file" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("--md-sizes").split(",")
+        metafunc.parametrize("md_file", sizes, indirect=True)
+
+
+@pytest.fixture(scope="session")
+def _md_files(tmp_path_factory, pytestconfig):
+    species = parse_species(pytestconfig.getoption("--md-species"))
+    cache = {}
+
+    def get(size: str):
+        if size not in cache:
+            n_atoms, n_frames = map(int, size.split("x"))
+            path = tmp_path_factory.getbasetemp() / f"bench_{size}.md"
+            cache[size] = (write_md(path, n_atoms, n_frames, species=species), n_frames)
+        return cache[size]
+
+    return get
+
+
+@pytest.fixture
+def md_file(request, _md_files):
+    """Synthetic trajectory as ``(path, number of frames)``."""
+    return _md_files(request.param)
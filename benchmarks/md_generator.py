@@ -0,0 +1,169 @@
+"""
+Generate synthetic CASTEP .md trajectories for benchmarking.
+
+Trajectories follow the layout written by CASTEP, with atoms jittering
+about lattice sites in a cubic box, so files have the size, line count
+and number formatting of real ones.
+
+Examples
+--------
+.. code-block:: sh
+
+   python -m benchmarks.md_generator -n 512 -f 1000 -s Si:3,O:1 -o bench.md
+"""
+from __future__ import annotations
+
+import argparse
+import re
+from pathlib import Path
+
+import numpy as np
+
+#: Width of the label columns (species and index) of per-atom lines.
+_LABEL_WIDTH = 18
+
+#: Width of the value columns of a line.
+_VALUES_WIDTH = 3 * 27
+
+#: Two-digit exponents to widen to the three digits written by Fortran.
+_EXPONENT = re.compile(r"E([+-])(\d\d)(?!\d)")
+
+
+def parse_species(spec: str) -> dict[str, int]:
+    """
+    Parse a species mix.
+
+    Parameters
+    ----------
+    spec : str
+        Comma-separated ``species:weight`` pairs.
+
+    Returns
+    -------
+    dict[str, int]
+        Relative weight of each species.
+
+    Examples
+    --------
+    >>> parse_species("Si:3,O:1")
+    {'Si': 3, 'O': 1}
+    """
+    pairs = (pair.partition(":") for pair in spec.split(","))
+    return {name.strip(): int(weight or 1) for name, _, weight in pairs}
+
+
+def _line(values: np.ndarray, tag: str, label: str = "") -> str:
+    """
+    Format a tagged line of values.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values on line.
+    tag : str
+        Tag of line.
+    label : str
+        Leading species and index label.
+
+    Returns
+    -------
+    str
+        Formatted line (without Fortran exponents).
+    """
+    body = "".join(f"{val:26.16E}" for val in values)
+    return f"{label:<{_LABEL_WIDTH}}{body:<{_VALUES_WIDTH - len(values)}}  <-- {tag}\n"
+
+
+def write_md(
+        path: Path | str,
+        n_atoms: int = 64,
+        n_frames: int = 100,
+        *,
+        species: dict[str, int] | None = None,
+        seed: int = 0,
+) -> Path:
+    """
+    Write a synthetic .md trajectory.
+
+    Parameters
+    ----------
+    path : Path or str
+        File to write.
+    n_atoms : int
+        Number of atoms.
+    n_frames : int
+        Number of frames.
+    species : dict[str, int], optional
+        Relative weight of each species, by default all silicon.
+    seed : int
+        Seed of random number generator.
+
+    Returns
+    -------
+    Path
+        File written.
+    """
+    path = Path(path)
+    rng = np.random.default_rng(seed)
+    species = species or {"Si": 1}
+
+    weights = np.array(list(species.values()), dtype=float)
+    counts = np.floor(n_atoms * weights / weights.sum()).astype(int)
+    counts[0] += n_atoms - counts.sum()
+    atoms = [(name, i + 1) for name, count in zip(species, counts) for i in range(count)]
+
+    side = 5.13 * max(1., np.cbrt(n_atoms / 8))
+    cell = np.eye(3) * side
+    n_side = int(np.ceil(np.cbrt(n_atoms)))
+    sites = np.stack(np.meshgrid(*[np.arange(n_side)] * 3, indexing="ij"), -1).reshape(-1, 3)
+    sites = sites[:n_atoms] * side / n_side
+
+    labels = [f" {name:<3s}{index:>14d}" for name, index in atoms]
+    dt = 82.682746688379041
+
+    with path.open("w") as md_file:
+        md_file.write(" BEGIN header\n\n END header\n\n")
+
+        for frame in range(n_frames):
+            pos = sites + rng.normal(0., 0.05, (n_atoms, 3))
+            vel = rng.normal(0., 2e-4, (n_atoms, 3))
+            force = rng.normal(0., 1e-2, (n_atoms, 3))
+            stress = rng.normal(0., 1e-4, (3, 3))
+            stress = (stress + stress.T) / 2
+            kinetic = 2.5e-2 + rng.normal(0., 1e-3)
+            potential = -31.4 + rng.normal(0., 1e-2)
+
+            lines = [f"{'':<{_LABEL_WIDTH}}{frame * dt:>26.16E}\n",
+                     _line((potential + kinetic, potential, kinetic), "E"),
+                     _line((kinetic / (1.5 * n_atoms),), "T"),
+                     _line((np.trace(stress) / 3,), "P")]
+            lines += [_line(row, "h") for row in cell]
+            lines += [_line(row, "hv") for row in np.zeros((3, 3))]
+            lines += [_line(row, "S") for row in stress]
+            for tag, data in (("R", pos), ("V", vel), ("F", force)):
+                lines += [_line(row, tag, label) for row, label in zip(data, labels)]
+
+            md_file.write(_EXPONENT.sub(r"E\g<1>0\2", "".join(lines)) + "\n")
+
+    return path
+
+
+def cli():
+    """Write a synthetic .md trajectory from the command line."""
+    arg_parser = argparse.ArgumentParser(
+        prog="md_generator",
+        description="Write a synthetic castep .md trajectory.",
+    )
+    arg_parser.add_argument("-o", "--output", type=Path, required=True, help="File to write.")
+    arg_parser.add_argument("-n", "--atoms", type=int, default=64, help="Number of atoms.")
+    arg_parser.add_argument("-f", "--frames", type=int, default=100, help="Number of frames.")
+    arg_parser.add_argument("-s", "--species", type=parse_species, default="Si",
+                            help="Species mix as comma-separated species:weight pairs.")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = arg_parser.parse_args()
+
+    write_md(args.output, args.atoms, args.frames, species=args.species, seed=args.seed)
+
+
+if __name__ == "__main__":
+    cli()
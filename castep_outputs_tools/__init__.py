@@ -1,4 +1,21 @@
 """A set of tools using castep_outputs to post-process data."""
 
+import importlib
+
 __version__ = "0.1"
 __author__ = "Jacob Wilkins"
+
+#: Public names provided by submodules, imported on first use to avoid
+#: loading their optional dependencies with the package.
+_LAZY = {
+    "H5MDTrajectory": "castep_outputs_tools.h5md_trajectory",
+    "Trajectory": "castep_outputs_tools.trajectory",
+    "read_md_arrays": "castep_outputs_tools.trajectory",
+}
+
+
+def __getattr__(name: str):
+    """Import public names of submodules on first use."""
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
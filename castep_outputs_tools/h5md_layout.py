@@ -0,0 +1,150 @@
+"""
+Layout of the h5md output of :mod:`castep_outputs_tools.md_to_h5md`.
+
+Time-dependent data is held in the groups of :data:`SOURCES`, each with
+a ``value`` series sharing one ``step`` and ``time``. Steps and times at
+fixed intervals, and a box which never changes, may instead be stored in
+h5md's fixed forms; :func:`read_series` reads either as a series with a
+leading frame axis.
+
+The functions here only index the groups they are given, so work on
+HDF5 files, Zarr groups and :class:`~castep_outputs_tools.h5md_writers.H5MDWriter`
+outputs alike.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+#: Minimum size of an HDF5 chunk in bytes.
+MIN_CHUNK_BYTES = 1 << 14
+
+#: Time-dependent groups and the .md tag (and column) which fills them.
+SOURCES = {
+    "particles/box/edges": ("h", None),
+    "particles/position": ("R", None),
+    "particles/velocity": ("V", None),
+    "particles/force": ("F", None),
+    "observables/hamiltonian_energy": ("E", 0),
+    "observables/potential_energy": ("E", 1),
+    "observables/kinetic_energy": ("E", 2),
+    "observables/pressure": ("P", None),
+    "observables/temperature": ("T", None),
+    "observables/lattice_velocity": ("hv", None),
+    "observables/stress": ("S", None),
+}
+
+#: Group of the simulation box, stored as a single frame where it never changes.
+BOX = "particles/box/edges"
+
+
+class FixedSeries:
+    """
+    Time-dependent data stored in a fixed h5md form, indexed like a series.
+
+    Scalar datasets hold the interval between values (h5md's fixed ``step``
+    and ``time``), with the first value in their ``offset`` attribute.
+    Other datasets hold a single frame which never changes, and give
+    read-only views.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset or zarr.Array
+        Fixed dataset.
+    n_frames : int
+        Number of frames.
+    """
+
+    def __init__(self, dset: Any, n_frames: int):
+        self._value = dset[()]
+        self._offset = dset.attrs.get("offset", 0) if dset.shape == () else None
+        #: Shape of data with a leading frame axis.
+        self.shape = (n_frames, *dset.shape)
+        #: Type of data.
+        self.dtype = dset.dtype
+        #: Frames to read at once, enough to fill :data:`MIN_CHUNK_BYTES` as for a series.
+        self.chunks = (-(-MIN_CHUNK_BYTES // max(dset.dtype.itemsize * dset.size, 1)),
+                       *dset.shape)
+
+    def __len__(self) -> int:
+        """Get the number of frames."""
+        return self.shape[0]
+
+    def __getitem__(self, index: int | slice | np.ndarray) -> np.ndarray:
+        """
+        Get the data of frames.
+
+        Parameters
+        ----------
+        index : int or slice or np.ndarray
+            Frames to get.
+
+        Returns
+        -------
+        np.ndarray
+            Data of frames.
+        """
+        frames = np.arange(self.shape[0])[index]
+        if self._offset is not None:
+            return self._offset + frames * self._value
+        return np.broadcast_to(self._value, (*np.shape(frames), *self._value.shape))
+
+
+def series_groups(root: Any) -> list[str]:
+    """
+    Get the time-dependent groups stored per frame in a file.
+
+    Parameters
+    ----------
+    root : H5MDWriter or h5py.Group or zarr.Group
+        File to inspect.
+
+    Returns
+    -------
+    list[str]
+        Paths of groups in `root` from ``SOURCES`` holding a ``value``
+        series.
+    """
+    return [path for path in SOURCES if f"{path}/value" in root]
+
+
+def read_series(root: Any, path: str) -> Any:
+    """
+    Get a time-dependent dataset for reading, whether fixed or per frame.
+
+    Parameters
+    ----------
+    root : H5MDWriter or h5py.Group or zarr.Group
+        File to read.
+    path : str
+        Dataset to read, a ``step``, ``time`` or ``value`` series or the
+        fixed box.
+
+    Returns
+    -------
+    h5py.Dataset or zarr.Array or FixedSeries
+        Dataset with a leading frame axis.
+    """
+    dset = root[path]
+    if path == BOX or not dset.shape:
+        return FixedSeries(dset, count_frames(root))
+    return dset
+
+
+def count_frames(root: Any) -> int:
+    """
+    Get the number of frames held in a file.
+
+    Parameters
+    ----------
+    root : H5MDWriter or h5py.Group or zarr.Group
+        File to inspect.
+
+    Returns
+    -------
+    int
+        Number of frames.
+    """
+    series = series_groups(root)
+    return root[f"{series[0]}/value"].shape[0] if series else 0
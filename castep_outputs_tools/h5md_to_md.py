@@ -0,0 +1,485 @@
+"""
+Convert h5md output back to CASTEP .md format.
+
+Blocks of frames are streamed from the h5md output and formatted in bulk:
+each frame shares a byte template of labels and tags, and numbers are
+written straight into it as Fortran-style ``ES27.16E3`` fields (e.g.
+``-3.1438056609022318E+001``) with vectorised integer arithmetic rather
+than a format call per value.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from collections import Counter
+from collections.abc import Collection
+from fractions import Fraction
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+
+from castep_outputs_tools import __version__
+from castep_outputs_tools.h5md_trajectory import H5MDTrajectory
+from castep_outputs_tools.md_parser import FRAME_LAYOUT, _limit_frames
+from castep_outputs_tools.md_pipeline import DEFAULT_BLOCK_FRAMES
+from castep_outputs_tools.trajectory import ARRAYS, Trajectory
+
+#: Header written at the start of .md files, each frame follows a blank line.
+MD_HEADER = b" BEGIN header\n\n END header\n"
+
+#: Size of the output write buffer in bytes.
+WRITE_BUFFER = 1 << 24
+
+#: Largest block of text formatted at once in bytes, where frames are large.
+_BLOCK_BYTES = 1 << 25
+
+#: Width of a formatted number.
+_VALUE_WIDTH = 27
+
+#: Width of the label columns (species and index) of a line.
+_LABEL_WIDTH = 18
+
+#: Width of the value columns of a line, before its tag.
+_VALUES_WIDTH = 3 * _VALUE_WIDTH
+
+#: Number of significant digits written.
+_DIGITS = 17
+
+#: Smallest mantissa of :data:`_DIGITS` digits.
+_MIN_MANTISSA = 10 ** (_DIGITS - 1)
+
+#: ASCII digits of every group of four decimal digits, shape ``(10000, 4)``.
+_DIGIT_GROUPS = np.array([list(f"{i:04d}".encode()) for i in range(10_000)], dtype=np.uint8)
+
+#: Distance from a rounding tie (in units of the last digit) within which
+#: the double-double product may round the wrong way.
+_TIE_TOLERANCE = 1e-9
+
+#: Largest decimal exponent of numbers formatted in bulk, beyond which
+#: scaling them (or splitting them into halves) could overflow.
+_MAX_EXPONENT = 280
+
+#: Veltkamp splitting factor dividing doubles into 26-bit halves.
+_SPLIT = 2. ** 27 + 1
+
+#: Text written for non-finite values, as by gfortran.
+_NON_FINITE = {"nan": b"NaN", "inf": b"Infinity", "-inf": b"-Infinity"}
+
+
+def format_values(values: np.ndarray) -> np.ndarray:
+    """
+    Format numbers as Fortran ``ES27.16E3`` fields in bulk.
+
+    Digits are extracted in bulk from the exact product of each number
+    and a power of ten. Numbers too close to a rounding tie, or too large
+    or small to scale, are formatted individually. All numbers are
+    therefore correctly rounded, as by Fortran, and numbers read from .md
+    files are written back unchanged.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Numbers to format.
+
+    Returns
+    -------
+    np.ndarray
+        ASCII bytes of each number, shape ``(*values.shape, 27)``.
+
+    Examples
+    --------
+    >>> format_values(np.array([-31.438056609022318])).tobytes()
+    b'  -3.1438056609022318E+001'
+    """
+    flat = np.asarray(values, dtype=float).ravel()
+    out = np.full((flat.size, _VALUE_WIDTH), ord(" "), dtype=np.uint8)
+
+    finite = np.isfinite(flat)
+    nonzero = finite & (flat != 0)
+    mag = np.where(nonzero, np.abs(flat), 1.)
+
+    exp = np.floor(np.log10(mag)).astype(np.int64)
+    mantissa, tie = _mantissa(mag, exp)
+
+    # log10 may be off by one near powers of ten.
+    wrong = ~tie & ((mantissa < _MIN_MANTISSA) | (mantissa >= 10 * _MIN_MANTISSA))
+    if wrong.any():
+        exp[wrong] += np.where(mantissa[wrong] < _MIN_MANTISSA, -1, 1)
+        mantissa[wrong], tie[wrong] = _mantissa(mag[wrong], exp[wrong])
+
+    # Rounding may carry into a new digit.
+    carry = mantissa == 10 * _MIN_MANTISSA
+    mantissa[carry] //= 10
+    exp[carry] += 1
+
+    for i in np.flatnonzero(tie & nonzero):
+        digits, _, power = f"{mag[i]:.{_DIGITS - 1}E}".partition("E")
+        mantissa[i], exp[i] = int(digits.replace(".", "")), int(power)
+    mantissa[~nonzero] = 0
+    exp[~nonzero] = 0
+
+    out[:, 3] = np.where(np.signbit(flat), ord("-"), ord(" "))
+    for end in range(22, 6, -4):
+        mantissa, group = np.divmod(mantissa, 10_000)
+        out[:, end - 4:end] = _DIGIT_GROUPS[group]
+    out[:, 4] = mantissa + ord("0")
+    out[:, 5] = ord(".")
+    out[:, 22] = ord("E")
+    out[:, 23] = np.where(exp < 0, ord("-"), ord("+"))
+    out[:, 24:] = _DIGIT_GROUPS[np.abs(exp), 1:]
+
+    for i in np.flatnonzero(~finite):
+        text = _NON_FINITE[str(flat[i])]
+        out[i] = np.frombuffer(text.rjust(_VALUE_WIDTH), dtype=np.uint8)
+
+    return out.reshape(*np.shape(values), _VALUE_WIDTH)
+
+
+def _mantissa(mag: np.ndarray, exp: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the significant digits of numbers as integers.
+
+    Numbers are scaled by powers of ten held as double-doubles, with the
+    product computed exactly by Dekker's algorithm, so the rounding of
+    the last digit is known.
+
+    Parameters
+    ----------
+    mag : np.ndarray
+        Positive numbers.
+    exp : np.ndarray
+        Decimal exponent of each number.
+
+    Returns
+    -------
+    mantissa : np.ndarray
+        Numbers rounded to :data:`_DIGITS` significant digits, scaled to
+        integers.
+    tie : np.ndarray
+        Whether each number is too close to a rounding tie, or out of
+        range, to be sure of its digits.
+    """
+    valid = np.abs(exp) <= _MAX_EXPONENT
+    mag = np.where(valid, mag, 1.)
+    scale_hi, scale_lo, sc_hi, sc_lo = _SCALES[np.where(valid, exp, 0) + _MAX_EXPONENT].T
+
+    # The exact product is prod + err, where prod is an integer as it exceeds 2**53.
+    prod = mag * scale_hi
+    mag_hi, mag_lo = _split(mag)
+    err = ((mag_hi * sc_hi - prod) + mag_hi * sc_lo + mag_lo * sc_hi) + mag_lo * sc_lo
+    err += mag * scale_lo
+
+    rounded = np.rint(err)
+    tie = ~valid | (np.abs(np.abs(err - rounded) - 0.5) < _TIE_TOLERANCE)
+    mantissa = prod.astype(np.int64) + rounded.astype(np.int64)
+    # Numbers just below a power of ten may round up to one, which marks their exponent as too high.
+    mantissa[(mantissa == _MIN_MANTISSA) & (rounded > err)] -= 1
+    return mantissa, tie
+
+
+def _split(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Split doubles into high and low halves whose products are exact.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Numbers to split.
+
+    Returns
+    -------
+    hi, lo : np.ndarray
+        Halves of each number, with ``hi + lo == values``.
+    """
+    scaled = _SPLIT * values
+    hi = scaled - (scaled - values)
+    return hi, values - hi
+
+
+def _scale_table() -> np.ndarray:
+    """
+    Tabulate the powers of ten scaling numbers to :data:`_DIGITS` digits.
+
+    Returns
+    -------
+    np.ndarray
+        For each decimal exponent from ``-_MAX_EXPONENT`` to
+        ``_MAX_EXPONENT``, ``10 ** (_DIGITS - 1 - exp)`` as a double-double
+        (nearest double and nearest double to the remainder) followed by
+        the halves of the nearest double (see :func:`_split`).
+    """
+    table = []
+    for exp in range(-_MAX_EXPONENT, _MAX_EXPONENT + 1):
+        exact = Fraction(10) ** (_DIGITS - 1 - exp)
+        table.append((float(exact), float(exact - Fraction(float(exact)))))
+    table = np.array(table)
+    return np.column_stack((table, *_split(table[:, 0])))
+
+
+#: Powers of ten by decimal exponent, see :func:`_scale_table`.
+_SCALES = _scale_table()
+
+
+def _tags(traj: Trajectory) -> tuple[str, ...]:
+    """
+    Get the .md tags of the lines written for frames.
+
+    Lines are written where all their arrays are present, as CASTEP leaves
+    out lines of data it does not compute.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Frames to write.
+
+    Returns
+    -------
+    tuple[str, ...]
+        Tags in the order of :data:`~castep_outputs_tools.md_parser.FRAME_LAYOUT`.
+
+    Raises
+    ------
+    ValueError
+        Only some arrays of a line are present.
+    """
+    tags = []
+    for tag, *_ in FRAME_LAYOUT:
+        names = [name for name, (src, _) in ARRAYS.items() if src == tag]
+        present = [getattr(traj, name) is not None for name in names]
+        if all(present):
+            tags.append(tag)
+        elif any(present):
+            raise ValueError(f"Cannot write {tag} lines without all of {', '.join(names)}")
+    return tuple(tags)
+
+
+def _frame_template(species: np.ndarray,
+                    tags: Collection[str] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lay out a frame of an .md file with blank values.
+
+    Parameters
+    ----------
+    species : np.ndarray
+        Species of each atom.
+    tags : Collection[str], optional
+        .md tags of lines to write (see :func:`_tags`). Defaults to all.
+
+    Returns
+    -------
+    template : np.ndarray
+        ASCII bytes of a frame, after a blank line, with values left blank.
+    slots : np.ndarray
+        Byte index of each character of each value in `template`, in the
+        order of :func:`_frame_values`, shape ``(n_values, 27)``.
+    """
+    blank = " " * _VALUE_WIDTH
+    lines = ["\n", f"{'':<{_LABEL_WIDTH}}{blank}\n"]
+    starts = [1 + _LABEL_WIDTH]
+    pos = 1 + len(lines[1])
+
+    counts = Counter()
+    labels = []
+    for spec in species:
+        counts[spec] += 1
+        labels.append(f" {spec:<3s}{counts[spec]:>14d}")
+
+    for tag, n_labels, n_values, n_lines in FRAME_LAYOUT:
+        if tags is not None and tag not in tags:
+            continue
+        line_labels = labels if n_labels else [""] * n_lines
+        for label in line_labels:
+            label = f"{label:<{_LABEL_WIDTH}}"
+            lines.append(f"{label}{blank * n_values:<{_VALUES_WIDTH}}  <-- {tag}\n")
+            starts.extend(pos + len(label) + _VALUE_WIDTH * np.arange(n_values))
+            pos += len(lines[-1])
+
+    template = np.frombuffer("".join(lines).encode(), dtype=np.uint8)
+    return template, np.array(starts)[:, None] + np.arange(_VALUE_WIDTH)
+
+
+def _frame_values(traj: Trajectory, tags: Collection[str]) -> np.ndarray:
+    """
+    Gather the values of each frame in the order they are written.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Frames to write.
+    tags : Collection[str]
+        .md tags of lines written.
+
+    Returns
+    -------
+    np.ndarray
+        Values of each frame, shape ``(n_frames, n_values)``.
+    """
+    n_frames = len(traj)
+    columns = [traj.time[:, None]]
+    for tag, *_ in FRAME_LAYOUT:
+        if tag not in tags:
+            continue
+        names = [name for name, (src, _) in ARRAYS.items() if src == tag]
+        data = np.stack([getattr(traj, name) for name in names], -1)
+        columns.append(data.reshape(n_frames, -1))
+
+    return np.concatenate(columns, axis=1)
+
+
+def format_frames(traj: Trajectory, template: tuple[np.ndarray, np.ndarray] | None = None) -> bytes:
+    """
+    Format frames in .md layout.
+
+    Parameters
+    ----------
+    traj : Trajectory
+        Frames to format. Lines of missing arrays are left out.
+    template : tuple[np.ndarray, np.ndarray], optional
+        Frame template of ``traj.species`` and the arrays present to reuse
+        between calls (see :func:`_frame_template`).
+
+    Returns
+    -------
+    bytes
+        Text of frames.
+
+    Raises
+    ------
+    ValueError
+        Only some arrays of a line are present.
+    """
+    tags = _tags(traj)
+    template, slots = template or _frame_template(traj.species, tags)
+    frames = np.tile(template, (len(traj), 1))
+    frames[:, slots] = format_values(_frame_values(traj, tags))
+    return frames.tobytes()
+
+
+def h5md_to_md(
+        source: Path | str,
+        md_file: BinaryIO,
+        *,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        backend: str = "auto",
+) -> int:
+    """
+    Convert h5md output to .md format.
+
+    Blocks of frames are read and formatted in turn, and each is written
+    with a single call, so memory use is bounded by the block size. Blocks
+    of large frames are cut short to about 32 MB of text.
+
+    Parameters
+    ----------
+    source : Path or str
+        h5md output to read (see :class:`.H5MDTrajectory`).
+    md_file : BinaryIO
+        File to write.
+    block_frames : int
+        Number of frames formatted at once.
+    start, stop : int, optional
+        Range of frames to convert, negative values count from the end.
+    stride : int
+        Interval between converted frames.
+    backend : {"auto", "hdf5", "zarr"}
+        Storage backend of `source`.
+
+    Returns
+    -------
+    int
+        Number of frames written.
+
+    Raises
+    ------
+    ValueError
+        `stride` is not positive.
+    """
+    if stride < 1:
+        raise ValueError(f"Stride must be positive, got {stride}")
+
+    with H5MDTrajectory(source, backend=backend) as traj:
+        frames = range(len(traj))[start:stop:stride]
+        template = _frame_template(traj.species, _tags(traj[:0]))
+        block_frames = _limit_frames(block_frames, len(template[0]), _BLOCK_BYTES)
+
+        md_file.write(MD_HEADER)
+        for i in range(0, len(frames), block_frames):
+            block = frames[i:i + block_frames]
+            md_file.write(format_frames(traj[np.asarray(block)], template))
+
+    return len(frames)
+
+
+def main(source: Path | str, output: Path | str | BinaryIO, **opts) -> int:
+    """
+    Convert h5md output to .md format.
+
+    Parameters
+    ----------
+    source : str or Path
+        h5md output to read.
+    output : str or Path or BinaryIO
+        File to write, ``"-"`` for standard output.
+    **opts : dict
+        Options passed to :func:`h5md_to_md`.
+
+    Returns
+    -------
+    int
+        Number of frames written.
+    """
+    if output == "-":
+        return h5md_to_md(source, sys.stdout.buffer, **opts)
+    if not isinstance(output, (str, Path)):
+        return h5md_to_md(source, output, **opts)
+
+    with Path(output).open("wb", buffering=WRITE_BUFFER) as md_file:
+        return h5md_to_md(source, md_file, **opts)
+
+
+def cli():
+    """
+    Run h5md_to_md through command line.
+
+    Examples
+    --------
+    .. code-block:: sh
+
+       h5md_to_md -o my_output.md my_file.h5md
+       h5md_to_md --start -100 -o last_100.md my_file.h5md
+       h5md_to_md -o - my_file.zarr | gzip > my_output.md.gz
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog="h5md_to_md",
+        description="Convert h5md output of md_to_h5md back to castep .md format.",
+    )
+    arg_parser.add_argument("source", type=Path, help="h5md (or .zarr) file to read")
+    arg_parser.add_argument("-o", "--output", required=True,
+                            help="File to write output, - for standard output.")
+    arg_parser.add_argument("-b", "--backend", choices=("auto", "hdf5", "zarr"),
+                            default="auto", help="Storage backend of source "
+                            "(default: zarr for sources ending .zarr, else hdf5).")
+    arg_parser.add_argument("--block-frames", type=int, default=DEFAULT_BLOCK_FRAMES,
+                            help="Number of frames formatted at once.")
+    arg_parser.add_argument("--start", type=int,
+                            help="First frame to convert, negative counts from the end.")
+    arg_parser.add_argument("--stop", type=int,
+                            help="Frame to stop before, negative counts from the end.")
+    arg_parser.add_argument("--stride", type=int, default=1,
+                            help="Interval between converted frames.")
+    arg_parser.add_argument("-V", "--version", action="version", version=f"%(prog)s v{__version__}")
+
+    args = arg_parser.parse_args()
+    if args.stride < 1:
+        arg_parser.error("--stride must be positive")
+
+    main(args.source, args.output, block_frames=args.block_frames, start=args.start,
+         stop=args.stop, stride=args.stride, backend=args.backend)
+
+
+if __name__ == "__main__":
+    cli()
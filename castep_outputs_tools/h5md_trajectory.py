@@ -0,0 +1,520 @@
+"""
+Read h5md trajectories written by :mod:`castep_outputs_tools.md_to_h5md`.
+
+Frames are read lazily in blocks aligned to the chunks of the output, so
+each chunk is decoded once however frames are accessed. Decoded blocks are
+held in a bounded LRU cache, and during sequential playback the next block
+is read in a background thread while the current one is used.
+
+Examples
+--------
+>>> with H5MDTrajectory("my_file.h5md") as traj:
+...     for frame in traj:
+...         print(frame["step"], frame["temperature"])
+...     last_10 = traj[-10:].positions
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import h5py
+import numpy as np
+
+from castep_outputs_tools.h5md_layout import MIN_CHUNK_BYTES, SOURCES, read_series, series_groups
+from castep_outputs_tools.h5md_writers import ZARR_SUFFIX
+from castep_outputs_tools.trajectory import ARRAYS, Trajectory, _parse_arrays
+
+#: Default size of the cache of decoded frames in bytes.
+DEFAULT_CACHE_BYTES = 64 << 20
+
+#: h5md group holding each array of a :class:`~castep_outputs_tools.trajectory.Trajectory`.
+H5MD_GROUPS = {name: next(path for path, src in SOURCES.items() if src == source)
+               for name, source in ARRAYS.items()}
+
+#: Number of spare buffers kept from evicted blocks for reuse.
+_SPARE_BLOCKS = 2
+
+
+class CacheInfo(NamedTuple):
+    """Usage of the frame cache of an :class:`H5MDTrajectory`."""
+
+    #: Number of block reads served from the cache.
+    hits: int
+    #: Number of block reads from the file on request.
+    misses: int
+    #: Number of blocks read ahead of request.
+    prefetched: int
+    #: Number of blocks held.
+    blocks: int
+    #: Maximum number of blocks held.
+    max_blocks: int
+
+
+class H5MDTrajectory:
+    """
+    Lazy reader of an h5md trajectory.
+
+    Indexing with an integer gives a single frame as a dict of arrays
+    keyed by the names of :data:`~castep_outputs_tools.trajectory.ARRAYS`
+    with ``"step"`` and ``"time"``. Indexing with a slice, integer array
+    or mask gives a :class:`~castep_outputs_tools.trajectory.Trajectory`.
+    Iterating gives each frame in turn. Steps, times and boxes stored in
+    h5md's fixed forms are expanded to every frame. Returned arrays are copies, so
+    remain valid after the cache moves on.
+
+    Parameters
+    ----------
+    path : Path or str
+        h5md output to read.
+    fields : Iterable[str], optional
+        Arrays to read (keys of :data:`~castep_outputs_tools.trajectory.ARRAYS`),
+        by default all those present.
+    backend : {"auto", "hdf5", "zarr"}
+        Storage backend of `path`, by default Zarr for paths ending
+        ``.zarr`` and HDF5 otherwise.
+    cache_bytes : int
+        Maximum size of decoded frames held in the cache. At least two
+        blocks are always held.
+    prefetch : bool
+        Whether to read the next block in the background when blocks are
+        accessed in sequence (forwards or backwards).
+    swmr : bool
+        Whether to open HDF5 output in SWMR mode, to read a file still
+        being written by ``md_to_h5md --follow`` (see :meth:`refresh`).
+
+    Raises
+    ------
+    ValueError
+        Requested fields not present in `path`.
+    """
+
+    def __init__(
+            self,
+            path: Path | str,
+            *,
+            fields: Iterable[str] | None = None,
+            backend: str = "auto",
+            cache_bytes: int = DEFAULT_CACHE_BYTES,
+            prefetch: bool = True,
+            swmr: bool = False,
+    ):
+        self.path = Path(path)
+        if backend == "auto":
+            backend = "zarr" if self.path.suffix == ZARR_SUFFIX else "hdf5"
+        self._root = _open_root(self.path, backend, swmr=swmr)
+
+        present = [name for name, group in H5MD_GROUPS.items() if group in self._root]
+        if fields is None:
+            self.fields = tuple(present)
+        else:
+            self.fields = _parse_arrays(fields)
+            if missing := set(self.fields) - set(present):
+                self.close()
+                raise ValueError(f"Arrays {', '.join(sorted(missing))} not in {path}")
+
+        self.species = _species(self._root["particles/species"]) if present else np.array([])
+        self._clock = next(iter(series_groups(self._root)), None)
+        self._datasets = self._open_datasets()
+
+        frame_bytes = {name: dset.dtype.itemsize * int(np.prod(dset.shape[1:]))
+                       for name, dset in self._datasets.items()}
+        largest = max(frame_bytes, key=frame_bytes.get, default=None)
+        #: Number of frames per block, the chunk length of the largest dataset
+        #: (or the length it would be given, for unchunked virtual datasets).
+        self.block_frames = 1
+        if largest:
+            chunks = self._datasets[largest].chunks
+            self.block_frames = (chunks[0] if chunks else
+                                 -(-MIN_CHUNK_BYTES // max(frame_bytes[largest], 1)))
+        self._block_bytes = self.block_frames * sum(frame_bytes.values())
+        self._max_blocks = max(2, cache_bytes // max(self._block_bytes, 1))
+
+        self._prefetch = prefetch
+        self._executor = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._spare = []
+        self._last_block = None
+        self._counts = {"hits": 0, "misses": 0, "prefetched": 0}
+
+    def __enter__(self) -> H5MDTrajectory:
+        """Open the trajectory."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the trajectory."""
+        self.close()
+
+    def _open_datasets(self) -> dict[str, Any]:
+        """
+        Get the datasets read for each frame.
+
+        Returns
+        -------
+        dict[str, Any]
+            Dataset of ``"step"``, ``"time"`` and each field.
+        """
+        if self._clock is None:
+            return {}
+        datasets = {key: read_series(self._root, f"{self._clock}/{key}")
+                    for key in ("step", "time")}
+        for name in self.fields:
+            group = H5MD_GROUPS[name]
+            datasets[name] = read_series(self._root, f"{group}/value" if f"{group}/value"
+                                         in self._root else group)
+        return datasets
+
+    @property
+    def n_frames(self) -> int:
+        """Number of frames."""
+        return self._datasets["step"].shape[0] if self._datasets else 0
+
+    @property
+    def n_atoms(self) -> int:
+        """Number of atoms."""
+        return len(self.species)
+
+    def __len__(self) -> int:
+        """Get the number of frames."""
+        return self.n_frames
+
+    def __getitem__(self, index: int | slice | np.ndarray) -> dict[str, np.ndarray] | Trajectory:
+        """
+        Read frames.
+
+        Parameters
+        ----------
+        index : int or slice or np.ndarray
+            Frame, or slice, integer array or mask of frames.
+
+        Returns
+        -------
+        dict[str, np.ndarray] or Trajectory
+            Frame for an integer index, else trajectory of selected frames.
+
+        Raises
+        ------
+        IndexError
+            Frame out of range.
+        """
+        if isinstance(index, (int, np.integer)):
+            if not -self.n_frames <= index < self.n_frames:
+                raise IndexError(f"Frame {index} out of range for {self.n_frames} frames")
+            frames = self._read(np.array([index % self.n_frames]))
+            return {name: val[0] for name, val in frames.items()}
+
+        return Trajectory(species=self.species, **self._read(np.arange(self.n_frames)[index]))
+
+    def __iter__(self) -> Iterator[dict[str, np.ndarray]]:
+        """
+        Iterate over frames, reading a block at a time.
+
+        Yields
+        ------
+        dict[str, np.ndarray]
+            Each frame.
+        """
+        for start in range(0, self.n_frames, self.block_frames):
+            block = self._read(np.arange(start, min(start + self.block_frames, self.n_frames)))
+            for i in range(len(block["step"])):
+                yield {name: val[i] for name, val in block.items()}
+
+    def _read(self, frames: np.ndarray) -> dict[str, np.ndarray]:
+        """
+        Copy frames from the cache, reading blocks as needed.
+
+        Parameters
+        ----------
+        frames : np.ndarray
+            Indices of frames to read.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Frames of ``"step"``, ``"time"`` and each field.
+        """
+        out = {name: np.empty((len(frames), *dset.shape[1:]), dtype=dset.dtype)
+               for name, dset in self._datasets.items()}
+
+        blocks = frames // self.block_frames
+        for block in dict.fromkeys(blocks.tolist()):
+            pos = np.flatnonzero(blocks == block)
+            rows = frames[pos] - block * self.block_frames
+            self._copy_rows(block, rows, out, pos)
+
+        return out
+
+    def _copy_rows(self, block: int, rows: np.ndarray, out: dict[str, np.ndarray],
+                   pos: np.ndarray):
+        """
+        Copy rows of a block into an output, reading the block if needed.
+
+        Parameters
+        ----------
+        block : int
+            Index of block.
+        rows : np.ndarray
+            Rows of block to copy.
+        out : dict[str, np.ndarray]
+            Arrays to copy to.
+        pos : np.ndarray
+            Positions in `out` of each row.
+        """
+        counted = False
+        while True:
+            with self._lock:
+                data = self._cache.get(block)
+                if data is not None:
+                    self._cache.move_to_end(block)
+                    self._counts["hits"] += not counted
+                    for name, val in data.items():
+                        out[name][pos] = val[rows]
+                    break
+
+                pending = self._pending.get(block)
+                reading = pending is None
+                if reading:
+                    pending = self._pending[block] = Future()
+                    self._counts["misses"] += 1
+                    counted = True
+
+            if reading:
+                self._load(block, pending)
+            else:
+                pending.result()
+
+        self._schedule_prefetch(block)
+
+    def _load(self, block: int, pending: Future):
+        """
+        Read a block into the cache, completing the read registered for it.
+
+        Parameters
+        ----------
+        block : int
+            Index of block.
+        pending : Future
+            Read of block in :attr:`_pending`, which others may be waiting on.
+        """
+        try:
+            self._store(block, self._read_block(block))
+        except BaseException as err:
+            pending.set_exception(err)
+            raise
+        else:
+            pending.set_result(None)
+        finally:
+            with self._lock:
+                self._pending.pop(block, None)
+
+    def _read_block(self, block: int) -> dict[str, np.ndarray]:
+        """
+        Read a block from the file into a spare buffer.
+
+        Parameters
+        ----------
+        block : int
+            Index of block.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Block of ``"step"``, ``"time"`` and each field.
+        """
+        with self._lock:
+            buffers = self._spare.pop() if self._spare else None
+        if buffers is None:
+            buffers = {name: np.empty((self.block_frames, *dset.shape[1:]), dtype=dset.dtype)
+                       for name, dset in self._datasets.items()}
+
+        start = block * self.block_frames
+        stop = min(start + self.block_frames, self.n_frames)
+        for name, dset in self._datasets.items():
+            _read_into(dset, start, stop, buffers[name])
+
+        return {name: buf[:stop - start] for name, buf in buffers.items()}
+
+    def _store(self, block: int, data: dict[str, np.ndarray]):
+        """
+        Add a block to the cache, evicting the least recently used.
+
+        Parameters
+        ----------
+        block : int
+            Index of block.
+        data : dict[str, np.ndarray]
+            Block data.
+        """
+        with self._lock:
+            self._cache[block] = data
+            self._cache.move_to_end(block)
+            while len(self._cache) > self._max_blocks:
+                _, evicted = self._cache.popitem(last=False)
+                if len(self._spare) < _SPARE_BLOCKS:
+                    self._spare.append({name: val.base if val.base is not None else val
+                                        for name, val in evicted.items()})
+
+    def _schedule_prefetch(self, block: int):
+        """
+        Read the next block in the background if blocks are read in sequence.
+
+        Parameters
+        ----------
+        block : int
+            Index of block just read.
+        """
+        last, self._last_block = self._last_block, block
+        if not self._prefetch or last is None or abs(block - last) != 1:
+            return
+
+        ahead = 2 * block - last
+        n_blocks = -(-self.n_frames // self.block_frames)
+        with self._lock:
+            if not 0 <= ahead < n_blocks or ahead in self._cache or ahead in self._pending:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix="h5md-prefetch")
+            self._pending[ahead] = self._executor.submit(self._prefetch_block, ahead)
+
+    def _prefetch_block(self, block: int):
+        """
+        Read a block ahead of request.
+
+        Parameters
+        ----------
+        block : int
+            Index of block.
+        """
+        try:
+            self._store(block, self._read_block(block))
+            with self._lock:
+                self._counts["prefetched"] += 1
+        finally:
+            with self._lock:
+                self._pending.pop(block, None)
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Get the usage of the frame cache.
+
+        Returns
+        -------
+        CacheInfo
+            Cache hits, misses, prefetched blocks and size.
+        """
+        with self._lock:
+            return CacheInfo(blocks=len(self._cache), max_blocks=self._max_blocks,
+                             **self._counts)
+
+    def refresh(self):
+        """Pick up frames written since opening, for files still being written."""
+        self._drain()
+        partial = self.n_frames // self.block_frames
+        if not isinstance(self._root, h5py.File):
+            self._datasets = self._open_datasets()
+        elif self._root.swmr_mode:
+            for dset in self._datasets.values():
+                if isinstance(dset, h5py.Dataset):
+                    dset.refresh()
+
+        with self._lock:
+            for block in [block for block in self._cache if block >= partial]:
+                del self._cache[block]
+
+    def _drain(self):
+        """Wait for background reads to finish."""
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """Stop background reads and close the file."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if isinstance(self._root, h5py.File):
+            self._root.close()
+
+
+def _open_root(path: Path, backend: str, *, swmr: bool = False) -> Any:
+    """
+    Open the root group of an h5md output for reading.
+
+    Parameters
+    ----------
+    path : Path
+        Output to read.
+    backend : {"hdf5", "zarr"}
+        Storage backend of output.
+    swmr : bool
+        Whether to open HDF5 in SWMR mode.
+
+    Returns
+    -------
+    h5py.File or zarr.Group
+        Root group.
+
+    Raises
+    ------
+    ValueError
+        Unknown backend.
+    ImportError
+        Zarr output without zarr installed.
+    """
+    if backend == "hdf5":
+        return h5py.File(path, "r", swmr=swmr)
+    if backend != "zarr":
+        raise ValueError(f"Unknown backend {backend!r} (valid: auto, hdf5, zarr)")
+
+    try:
+        import zarr  # noqa: PLC0415
+    except ImportError as err:
+        raise ImportError("Reading Zarr output requires zarr") from err
+    return zarr.open_group(str(path), mode="r")
+
+
+def _species(dset: Any) -> np.ndarray:
+    """
+    Get the species of each atom from the h5md ``species`` dataset.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset or zarr.Array
+        Species indices, with names in an HDF5 enum type or ``enum`` attribute.
+
+    Returns
+    -------
+    np.ndarray
+        Species name of each atom.
+    """
+    enum = h5py.check_enum_dtype(dset.dtype) if isinstance(dset, h5py.Dataset) else None
+    if enum is None:
+        enum = dict(dset.attrs["enum"])
+    names = {val: key for key, val in enum.items()}
+    return np.array([names[int(val)] for val in dset[()]])
+
+
+def _read_into(dset: Any, start: int, stop: int, buffer: np.ndarray):
+    """
+    Read consecutive frames of a dataset into the start of a buffer.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset or zarr.Array
+        Dataset to read.
+    start, stop : int
+        Range of frames to read.
+    buffer : np.ndarray
+        Buffer to read into.
+    """
+    if isinstance(dset, h5py.Dataset):
+        dset.read_direct(buffer, np.s_[start:stop], np.s_[0:stop - start])
+    else:
+        buffer[:stop - start] = dset[start:stop]
@@ -0,0 +1,512 @@
+"""
+Storage backends for writing h5md trajectories.
+
+Each backend holds the same h5md group layout [1]_ and exposes it
+through :class:`H5MDWriter`, so the converters need not know how data
+is stored. Paths are ``/``-separated from the root of the output.
+
+References
+----------
+.. [1] https://www.nongnu.org/h5md/
+"""
+from __future__ import annotations
+
+import abc
+import math
+from pathlib import Path
+from typing import Any, ClassVar
+
+import h5py
+import numpy as np
+
+#: Suffix of output paths written by the Zarr backend when chosen automatically.
+ZARR_SUFFIX = ".zarr"
+
+#: Lowest HDF5 superblock version which supports SWMR writing.
+_SWMR_SUPERBLOCK = 3
+
+#: Root attribute of Zarr outputs recording linked arrays.
+_LINKS_ATTR = "links"
+
+
+class H5MDWriter(abc.ABC):
+    """
+    Output holding an h5md group hierarchy.
+
+    Writers are context managers which close the output on exit.
+
+    Parameters
+    ----------
+    path : Path or str
+        Output to write.
+    append : bool
+        Whether to open an existing output rather than create a new one.
+    follow : bool
+        Whether the output will be read while it is written (see
+        :meth:`enable_concurrent_reads`).
+    """
+
+    #: Name of backend used to select it.
+    name: ClassVar[str]
+
+    def __init__(self, path: Path | str, *, append: bool = False, follow: bool = False):
+        self.path = Path(path)
+        self.append = append
+        self.follow = follow
+
+    def __enter__(self) -> H5MDWriter:
+        """Enter context."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close output on exiting context."""
+        self.close()
+
+    @abc.abstractmethod
+    def __contains__(self, path: str) -> bool:
+        """Whether a group or dataset exists."""
+
+    @abc.abstractmethod
+    def __getitem__(self, path: str) -> Any:
+        """Get a dataset for reading, supporting ``shape`` and NumPy indexing."""
+
+    @abc.abstractmethod
+    def create_group(self, path: str, attrs: dict | None = None):
+        """
+        Create a group, and any missing parents.
+
+        Parameters
+        ----------
+        path : str
+            Group to create.
+        attrs : dict, optional
+            Attributes of group.
+        """
+
+    @abc.abstractmethod
+    def create_dataset(self, path: str, data: np.ndarray, *, enum: dict[str, int] | None = None,
+                       attrs: dict | None = None):
+        """
+        Create a fixed dataset.
+
+        Parameters
+        ----------
+        path : str
+            Dataset to create.
+        data : np.ndarray
+            Contents of dataset.
+        enum : dict[str, int], optional
+            Names of the integer values in `data`, where the backend supports it.
+        attrs : dict, optional
+            Attributes of dataset.
+        """
+
+    @abc.abstractmethod
+    def create_series(
+            self,
+            path: str,
+            shape: tuple[int, ...],
+            dtype: type,
+            chunks: tuple[int, ...],
+            attrs: dict | None = None,
+            **filters,
+    ):
+        """
+        Create a dataset resizable along its first axis.
+
+        Parameters
+        ----------
+        path : str
+            Dataset to create.
+        shape : tuple[int, ...]
+            Initial shape.
+        dtype : type
+            Type of data.
+        chunks : tuple[int, ...]
+            Shape of storage chunks.
+        attrs : dict, optional
+            Attributes of dataset.
+        **filters : dict
+            Filters as keyword arguments of :meth:`h5py.Group.create_dataset`
+            (``compression``, ``compression_opts``, ``shuffle``,
+            ``fletcher32`` and ``scaleoffset``).
+        """
+
+    @abc.abstractmethod
+    def link(self, source: str, path: str):
+        """
+        Make `path` refer to the existing dataset `source`.
+
+        Parameters
+        ----------
+        source : str
+            Existing dataset.
+        path : str
+            New name for dataset.
+        """
+
+    @abc.abstractmethod
+    def delete(self, path: str):
+        """
+        Remove a dataset, or one name of a linked dataset.
+
+        Parameters
+        ----------
+        path : str
+            Dataset to remove.
+        """
+
+    @abc.abstractmethod
+    def resize(self, path: str, length: int):
+        """
+        Resize a series along its first axis.
+
+        Parameters
+        ----------
+        path : str
+            Series to resize.
+        length : int
+            New length.
+        """
+
+    @abc.abstractmethod
+    def write(self, path: str, start: int, data: np.ndarray):
+        """
+        Write consecutive entries of a series.
+
+        Parameters
+        ----------
+        path : str
+            Series to write.
+        start : int
+            Index of first entry written.
+        data : np.ndarray
+            Data to write.
+        """
+
+    def enable_concurrent_reads(self):  # noqa: B027
+        """Allow the output to be read while writing continues."""
+
+    def flush(self):  # noqa: B027
+        """Make written data visible to readers."""
+
+    @abc.abstractmethod
+    def close(self):
+        """Close the output."""
+
+
+class HDF5Writer(H5MDWriter):
+    """
+    Write h5md to a single HDF5 file.
+
+    Following outputs are opened in SWMR mode once their layout is created.
+
+    Raises
+    ------
+    ValueError
+        Following is requested when appending to a file whose format does
+        not support SWMR, i.e. one which was not written while following.
+    """
+
+    name = "hdf5"
+
+    def __init__(self, path: Path | str, *, append: bool = False, follow: bool = False):
+        super().__init__(path, append=append, follow=follow)
+        self._file = h5py.File(path, "a" if append else "w",
+                               libver="latest" if follow else None)
+
+        if follow and self._file.id.get_create_plist().get_version()[0] < _SWMR_SUPERBLOCK:
+            self._file.close()
+            raise ValueError(f"Cannot follow while appending to {path}, which was not "
+                             "written with --follow (file format does not support SWMR)")
+
+    def __contains__(self, path: str) -> bool:
+        """Whether a group or dataset exists."""
+        return path in self._file
+
+    def __getitem__(self, path: str) -> h5py.Dataset:
+        """Get a dataset for reading."""
+        return self._file[path]
+
+    def create_group(self, path: str, attrs: dict | None = None):
+        """Create a group, and any missing parents."""
+        grp = self._file.require_group(path)
+        grp.attrs.update(attrs or {})
+
+    def create_dataset(self, path: str, data: np.ndarray, *, enum: dict[str, int] | None = None,
+                       attrs: dict | None = None):
+        """Create a fixed dataset."""
+        dtype = h5py.enum_dtype(enum) if enum is not None else None
+        dset = self._file.create_dataset(path, data=data, dtype=dtype)
+        dset.attrs.update(attrs or {})
+
+    def create_series(
+            self,
+            path: str,
+            shape: tuple[int, ...],
+            dtype: type,
+            chunks: tuple[int, ...],
+            attrs: dict | None = None,
+            **filters,
+    ):
+        """Create a dataset resizable along its first axis."""
+        dset = self._file.create_dataset(path, shape, maxshape=(None, *shape[1:]), dtype=dtype,
+                                         chunks=chunks, **filters)
+        dset.attrs.update(attrs or {})
+
+    def link(self, source: str, path: str):
+        """Make `path` refer to the existing dataset `source`."""
+        self._file[path] = self._file[source]
+
+    def delete(self, path: str):
+        """Remove a dataset, or one name of a linked dataset."""
+        del self._file[path]
+
+    def resize(self, path: str, length: int):
+        """Resize a series along its first axis."""
+        self._file[path].resize(length, axis=0)
+
+    def write(self, path: str, start: int, data: np.ndarray):
+        """Write consecutive entries of a series."""
+        self._file[path][start:start+len(data)] = data
+
+    def enable_concurrent_reads(self):
+        """Allow the output to be read while writing continues."""
+        if self.follow and not self._file.swmr_mode:
+            self._file.swmr_mode = True
+
+    def flush(self):
+        """Make written data visible to readers."""
+        self._file.flush()
+
+    def close(self):
+        """Close the output."""
+        self._file.close()
+
+
+class ZarrWriter(H5MDWriter):
+    """
+    Write h5md to a Zarr directory store.
+
+    Each chunk is stored in its own file, so outputs may be read by many
+    processes at once without file locks and are always readable while
+    being written.
+
+    Zarr has no links, so linked datasets are stored as copies which are
+    written along with their source (or any other copy). HDF5 filters are mapped to the
+    nearest Zarr codecs:
+
+    - ``gzip`` compression uses the gzip codec, or Blosc with zlib when
+      shuffled.
+    - ``lzf`` compression uses Blosc with LZ4.
+    - ``fletcher32`` checksums are replaced by CRC32C checksums.
+    - ``scaleoffset`` rounds data to a binary fraction no coarser than the
+      requested decimal places before storing, which compresses well.
+    """
+
+    name = "zarr"
+
+    def __init__(self, path: Path | str, *, append: bool = False, follow: bool = False):
+        super().__init__(path, append=append, follow=follow)
+        try:
+            import zarr  # noqa: PLC0415
+        except ImportError as err:
+            raise ImportError("Writing Zarr output requires zarr>=3 "
+                              "(Python 3.11 or later)") from err
+
+        self._root = zarr.open_group(str(path), mode="a" if append else "w")
+        self._links = {}
+        for path_, source in self._root.attrs.get(_LINKS_ATTR, {}).items():
+            self._links.setdefault(source, []).append(path_)
+        self._scales = {}
+
+    def __contains__(self, path: str) -> bool:
+        """Whether a group or dataset exists."""
+        return path in self._root
+
+    def __getitem__(self, path: str):
+        """Get a dataset for reading."""
+        return self._root[path]
+
+    def create_group(self, path: str, attrs: dict | None = None):
+        """Create a group, and any missing parents."""
+        grp = self._root.require_group(path)
+        if attrs:
+            grp.attrs.update(_json_attrs(attrs))
+
+    def create_dataset(self, path: str, data: np.ndarray, *, enum: dict[str, int] | None = None,
+                       attrs: dict | None = None):
+        """Create a fixed dataset."""
+        data = np.asarray(data)
+        arr = self._root.create_array(path, shape=data.shape, dtype=data.dtype,
+                                      chunks=data.shape or "auto")
+        arr[...] = data
+        attrs = dict(attrs or {})
+        if enum is not None:
+            attrs["enum"] = {key: int(val) for key, val in enum.items()}
+        if attrs:
+            arr.attrs.update(_json_attrs(attrs))
+
+    def create_series(
+            self,
+            path: str,
+            shape: tuple[int, ...],
+            dtype: type,
+            chunks: tuple[int, ...],
+            attrs: dict | None = None,
+            **filters,
+    ):
+        """Create a dataset resizable along its first axis."""
+        from zarr.codecs import BloscCodec, Crc32cCodec, GzipCodec  # noqa: PLC0415
+
+        compression = filters.get("compression")
+        level = filters.get("compression_opts")
+        shuffle = "shuffle" if filters.get("shuffle") else "noshuffle"
+
+        if compression == "gzip" and not filters.get("shuffle"):
+            compressors = [GzipCodec(level=4 if level is None else level)]
+        elif compression == "gzip":
+            compressors = [BloscCodec(cname="zlib", clevel=4 if level is None else level,
+                                      shuffle=shuffle)]
+        elif compression == "lzf":
+            compressors = [BloscCodec(cname="lz4", shuffle=shuffle)]
+        elif compression is None:
+            compressors = []
+        else:
+            raise ValueError(f"Unknown compression {compression!r} (valid: gzip, lzf)")
+
+        if filters.get("fletcher32"):
+            compressors.append(Crc32cCodec())
+
+        arr = self._root.create_array(path, shape=shape, dtype=np.dtype(dtype), chunks=chunks,
+                                      compressors=compressors or None)
+        attrs = dict(attrs or {})
+        if filters.get("scaleoffset") is not None:
+            attrs["scaleoffset"] = filters["scaleoffset"]
+        if attrs:
+            arr.attrs.update(_json_attrs(attrs))
+
+    def link(self, source: str, path: str):
+        """Make `path` refer to the existing dataset `source`."""
+        arr = self._root[source]
+        copy = self._root.create_array(path, shape=arr.shape, dtype=arr.dtype, chunks=arr.chunks,
+                                       compressors=arr.compressors or None)
+        copy[...] = arr[...]
+        copy.attrs.update(arr.attrs.asdict())
+        source = self._copies(source)[0]
+        self._links.setdefault(source, []).append(path)
+        self._root.attrs[_LINKS_ATTR] = {**self._root.attrs.get(_LINKS_ATTR, {}), path: source}
+
+    def _copies(self, path: str) -> tuple[str, ...]:
+        """
+        Get all copies of a linked dataset.
+
+        Parameters
+        ----------
+        path : str
+            Any copy of dataset.
+
+        Returns
+        -------
+        tuple[str, ...]
+            Source of dataset followed by its links.
+        """
+        for source, links in self._links.items():
+            if path == source or path in links:
+                return (source, *links)
+        return (path,)
+
+    def delete(self, path: str):
+        """Remove a dataset, or one name of a linked dataset."""
+        del self._root[path]
+        self._scales.pop(path, None)
+
+        copies = [path_ for path_ in self._copies(path) if path_ != path]
+        self._links = {source: links for source, links in self._links.items()
+                       if path not in (source, *links)}
+        if len(copies) > 1:
+            self._links[copies[0]] = copies[1:]
+        self._root.attrs[_LINKS_ATTR] = {link: source for source, links in self._links.items()
+                                         for link in links}
+
+    def resize(self, path: str, length: int):
+        """Resize a series along its first axis."""
+        for path_ in self._copies(path):
+            arr = self._root[path_]
+            arr.resize((length, *arr.shape[1:]))
+
+    def write(self, path: str, start: int, data: np.ndarray):
+        """Write consecutive entries of a series."""
+        if path not in self._scales:
+            decimals = self._root[path].attrs.get("scaleoffset")
+            self._scales[path] = (None if decimals is None else
+                                  2. ** math.ceil(math.log2(10 ** decimals)))
+        if (scale := self._scales[path]) is not None:
+            data = np.round(np.asarray(data) * scale) / scale
+
+        for path_ in self._copies(path):
+            self._root[path_][start:start+len(data)] = data
+
+    def close(self):
+        """Close the output."""
+
+
+def _json_attrs(attrs: dict) -> dict:
+    """
+    Convert attribute values to JSON types.
+
+    Parameters
+    ----------
+    attrs : dict
+        Attributes possibly holding NumPy values or tuples.
+
+    Returns
+    -------
+    dict
+        Attributes as plain Python types.
+    """
+    return {key: np.asarray(val).tolist() if isinstance(val, (np.generic, np.ndarray, tuple))
+            else val for key, val in attrs.items()}
+
+
+#: Available backends by name.
+WRITERS = {writer.name: writer for writer in (HDF5Writer, ZarrWriter)}
+
+
+def open_writer(
+        path: Path | str,
+        backend: str = "auto",
+        *,
+        append: bool = False,
+        follow: bool = False,
+) -> H5MDWriter:
+    """
+    Open an h5md output with a given backend.
+
+    Parameters
+    ----------
+    path : Path or str
+        Output to write.
+    backend : str
+        Name of backend in :data:`WRITERS`, or ``"auto"`` to write Zarr to
+        paths ending in :data:`ZARR_SUFFIX` and HDF5 otherwise.
+    append : bool
+        Whether to open an existing output rather than create a new one.
+    follow : bool
+        Whether the output will be read while it is written.
+
+    Returns
+    -------
+    H5MDWriter
+        Open output.
+
+    Raises
+    ------
+    ValueError
+        Unknown backend.
+    """
+    if backend == "auto":
+        backend = ZarrWriter.name if Path(path).suffix == ZARR_SUFFIX else HDF5Writer.name
+    if backend not in WRITERS:
+        raise ValueError(f"Unknown backend {backend!r} (valid: auto, {', '.join(WRITERS)})")
+    return WRITERS[backend](path, append=append, follow=follow)
@@ -0,0 +1,697 @@
+"""
+Fast NumPy parser for CASTEP .md files.
+
+Frames in a .md file share a fixed layout of tagged lines::
+
+                      <time>
+                      <H> <PE> <KE>                                     <-- E
+                      <T>                                               <-- T
+                      <P>                                               <-- P
+                      <h_x> <h_y> <h_z>                                 <-- h
+                      ...
+    <species> <index> <x> <y> <z>                                       <-- R
+
+This module reads raw bytes, groups lines by tag and converts each
+group of values in bulk straight into contiguous arrays, rather than
+building per-atom dictionaries.
+
+It also provides a frame index of the byte offset at which each frame
+starts, so that ranges of frames may be read without parsing the
+frames before them, and transparent decompression of compressed files.
+"""
+from __future__ import annotations
+
+import contextlib
+import importlib
+import io
+import mmap
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections.abc import Collection, Iterator
+from pathlib import Path
+from typing import BinaryIO, TextIO
+
+import numpy as np
+
+#: Tagged lines in each frame after the time line as
+#: ``(tag, number of label columns, number of values, number of lines)``,
+#: where ``None`` lines means one line per atom.
+FRAME_LAYOUT = (
+    ("E", 0, 3, 1),
+    ("T", 0, 1, 1),
+    ("P", 0, 1, 1),
+    ("h", 0, 3, 3),
+    ("hv", 0, 3, 3),
+    ("S", 0, 3, 3),
+    ("R", 2, 3, None),
+    ("V", 2, 3, None),
+    ("F", 2, 3, None),
+)
+
+#: Number of lines in a frame excluding per-atom lines.
+_FIXED_LINES = 1 + sum(n_lines for *_, n_lines in FRAME_LAYOUT if n_lines)
+#: Number of per-atom lines per atom in a frame.
+_ATOM_LINES = sum(1 for *_, n_lines in FRAME_LAYOUT if n_lines is None)
+
+#: One or more blank lines separating frames.
+_BLANK_LINES = re.compile(rb"\n(?:[ \t\r]*\n)+")
+
+#: Minimum number of bytes read at once.
+_MIN_READ = 1 << 16
+
+#: Suffix appended to .md file names for their frame index.
+INDEX_SUFFIX = ".idx"
+
+#: Leading bytes of compressed files and the module which reads them.
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "lzma",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstandard",
+}
+
+#: File name suffixes of compressed files.
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".bz2", ".zst")
+
+#: Default number of decompressed blocks buffered ahead of reads.
+DEFAULT_READ_AHEAD = 4
+
+#: Number of bytes decompressed at once when reading ahead.
+_DECOMPRESS_SIZE = 1 << 20
+
+
+class IrregularLayoutError(ValueError):
+    """Data does not follow the regular .md frame layout."""
+
+
+def detect_compression(md_path: Path | str) -> str | None:
+    """
+    Detect the compression of a file from its leading bytes.
+
+    Parameters
+    ----------
+    md_path : Path or str
+        File to check.
+
+    Returns
+    -------
+    str or None
+        Name of module which decompresses the file, or ``None`` if it is not
+        compressed.
+    """
+    with Path(md_path).open("rb") as md_file:
+        head = md_file.read(max(map(len, COMPRESSION_MAGIC)))
+    return next((codec for magic, codec in COMPRESSION_MAGIC.items()
+                 if head.startswith(magic)), None)
+
+
+def open_md(md_path: Path | str, *, read_ahead: int = DEFAULT_READ_AHEAD) -> BinaryIO:
+    """
+    Open an MD file for binary reading, decompressing it if compressed.
+
+    Files compressed with gzip, xz or bzip2 are read through the standard
+    library, and with zstd if :mod:`zstandard` is installed. Compressed
+    files are not seekable, so cannot be used with a frame index.
+
+    Parameters
+    ----------
+    md_path : Path or str
+        File to open.
+    read_ahead : int
+        Number of blocks to decompress ahead of reads in a background thread,
+        so that decompression runs alongside parsing. ``0`` decompresses in
+        the reading thread.
+
+    Returns
+    -------
+    BinaryIO
+        Stream of (decompressed) file contents.
+
+    Raises
+    ------
+    ImportError
+        File is zstd-compressed and :mod:`zstandard` is not installed.
+    """
+    md_path = Path(md_path)
+    codec = detect_compression(md_path)
+
+    if codec is None:
+        return md_path.open("rb")
+
+    if codec == "zstandard":
+        try:
+            import zstandard  # noqa: PLC0415
+        except ImportError as err:
+            raise ImportError(f"Reading zstd-compressed {md_path} requires zstandard") from err
+        stream = zstandard.ZstdDecompressor().stream_reader(md_path.open("rb"), closefd=True)
+    else:
+        stream = importlib.import_module(codec).open(md_path, "rb")
+
+    if read_ahead:
+        return io.BufferedReader(_ReadAhead(stream, read_ahead))
+    return io.BufferedReader(stream) if codec == "zstandard" else stream
+
+
+class _ReadAhead(io.RawIOBase):
+    """
+    Stream read from another in a background thread.
+
+    The codecs of the standard library release the GIL while
+    decompressing, so decompression overlaps with the reader's work.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Stream to read.
+    depth : int
+        Maximum number of blocks read ahead.
+    """
+
+    def __init__(self, stream: BinaryIO, depth: int):
+        super().__init__()
+        self._stream = stream
+        self._queue = queue.Queue(depth)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self) -> None:
+        """Read blocks from the stream into the queue until its end or closing."""
+        try:
+            while not self._stop.is_set():
+                data = self._stream.read(_DECOMPRESS_SIZE)
+                self._queue.put(data)
+                if not data:
+                    break
+        except Exception as err:  # Re-raised in the reading thread
+            self._queue.put(err)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._buffer:
+            if self._eof:
+                return 0
+            data = self._queue.get()
+            if isinstance(data, Exception):
+                self._eof = True
+                raise data
+            if not data:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(data)
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():
+                with contextlib.suppress(queue.Empty):
+                    self._queue.get_nowait()
+                self._thread.join(0.01)
+            self._stream.close()
+        super().close()
+
+
+def read_header(md_file: TextIO | BinaryIO) -> bytes:
+    """
+    Read the header block of an MD file.
+
+    Parameters
+    ----------
+    md_file : TextIO or BinaryIO
+        File to read, positioned at the start.
+
+    Returns
+    -------
+    bytes
+        Header up to and including the ``END header`` line.
+    """
+    header = []
+    while line := md_file.readline():
+        if isinstance(line, str):
+            line = line.encode()
+        header.append(line)
+        if b"END header" in line:
+            break
+    return b"".join(header)
+
+
+def iter_chunks(
+        md_file: TextIO | BinaryIO,
+        block_frames: int,
+        *,
+        follow: bool = False,
+        poll_interval: float = 1.,
+        timeout: float | None = None,
+        start: int = 0,
+        stop: int | None = None,
+        stride: int = 1,
+        block_bytes: int | None = None,
+) -> Iterator[bytes]:
+    """
+    Read whole frames from an MD file in chunks.
+
+    Frames outside the selection given by `start`, `stop` and `stride`
+    are dropped at the byte level without being parsed.
+
+    Parameters
+    ----------
+    md_file : TextIO or BinaryIO
+        File to read, positioned after the header.
+    block_frames : int
+        Maximum number of frames per chunk.
+    follow : bool
+        Whether to keep polling the file for new frames once the end is
+        reached, as for a file still being written. Complete frames are
+        yielded as soon as they are found. The last frame is only yielded
+        once the file stops growing.
+    poll_interval : float
+        Time in seconds between polls when following.
+    timeout : float, optional
+        Time in seconds without new data after which to stop following.
+        By default follow until interrupted.
+    start : int
+        First frame to read.
+    stop : int, optional
+        Frame to stop before, defaults to the end of the file.
+    stride : int
+        Interval between frames read.
+    block_bytes : int, optional
+        Approximate maximum size of a chunk in bytes, estimated from the
+        size of the first frame. Chunks hold at least one frame.
+
+    Yields
+    ------
+    bytes
+        Raw data of up to `block_frames` complete frames.
+    """
+    buffer = b""
+    read_size = _MIN_READ
+    last_data = time.monotonic()
+    finished = False
+    frame = 0
+    selected = []
+
+    while not finished:
+        data = md_file.read(read_size)
+        if isinstance(data, str):
+            data = data.encode()
+
+        at_end = not data
+        if data:
+            last_data = time.monotonic()
+        finished = at_end and (not follow or
+                               (timeout is not None and time.monotonic() - last_data >= timeout))
+        buffer += data
+
+        ends = [match.end() for match in _BLANK_LINES.finditer(buffer)]
+        if finished and buffer.strip():
+            ends.append(len(buffer))
+
+        if ends and frame == 0:
+            block_frames = _limit_frames(block_frames, ends[0], block_bytes)
+            # Skipped frames are dropped as they stream past, so reads need not grow with stride.
+            read_size = max(min(ends[0] * block_frames, block_bytes or np.inf), _MIN_READ)
+
+        begin = 0
+        for end in ends:
+            if frame >= start and (frame - start) % stride == 0:
+                selected.append(buffer[begin:end])
+            frame += 1
+            begin = end
+
+            finished |= stop is not None and frame >= stop
+            if len(selected) == block_frames or (selected and finished):
+                yield b"".join(selected)
+                selected = []
+
+            if finished:
+                return
+
+        buffer = buffer[begin:]
+
+        if at_end and selected:
+            yield b"".join(selected)
+            selected = []
+
+        if at_end and not finished:
+            time.sleep(poll_interval)
+
+
+def iter_indexed_chunks(
+        md_file: BinaryIO,
+        offsets: np.ndarray,
+        block_frames: int,
+        *,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int | None = None,
+        block_bytes: int | None = None,
+) -> Iterator[bytes]:
+    """
+    Read a selection of frames from an MD file in chunks using a frame index.
+
+    Frames outside the selection are never read. Negative `start` and
+    `stop` count from the end of the file, as for slices.
+
+    Parameters
+    ----------
+    md_file : BinaryIO
+        Seekable file to read.
+    offsets : np.ndarray
+        Byte offset of the start of each frame (see :func:`frame_offsets`).
+    block_frames : int
+        Maximum number of frames per chunk.
+    start : int, optional
+        First frame to read.
+    stop : int, optional
+        Frame to stop before, defaults to the end of the file.
+    stride : int, optional
+        Interval between frames read.
+    block_bytes : int, optional
+        Approximate maximum size of a chunk in bytes, estimated from the
+        size of the largest indexed frame. Chunks hold at least one frame.
+
+    Yields
+    ------
+    bytes
+        Raw data of up to `block_frames` complete frames.
+    """
+    frames = range(len(offsets))[start:stop:stride]
+    if len(offsets) > 1:
+        block_frames = _limit_frames(block_frames, int(np.diff(offsets).max()), block_bytes)
+
+    for i in range(0, len(frames), block_frames):
+        block = frames[i:i+block_frames]
+        if block.step == 1:
+            yield _read_frames(md_file, offsets, block.start, block.stop)
+        else:
+            yield b"".join(_read_frames(md_file, offsets, frame, frame + 1) for frame in block)
+
+
+def _limit_frames(block_frames: int, frame_bytes: int, block_bytes: int | None) -> int:
+    """
+    Limit the number of frames per chunk to fit a chunk size.
+
+    Parameters
+    ----------
+    block_frames : int
+        Maximum number of frames per chunk.
+    frame_bytes : int
+        Size of a frame in bytes.
+    block_bytes : int, optional
+        Maximum size of a chunk in bytes.
+
+    Returns
+    -------
+    int
+        Number of frames per chunk, at least one.
+    """
+    if block_bytes is None:
+        return block_frames
+    return max(1, min(block_frames, block_bytes // max(frame_bytes, 1)))
+
+
+def _read_frames(md_file: BinaryIO, offsets: np.ndarray, first: int, last: int) -> bytes:
+    """
+    Read a contiguous range of frames using a frame index.
+
+    Parameters
+    ----------
+    md_file : BinaryIO
+        Seekable file to read.
+    offsets : np.ndarray
+        Byte offset of the start of each frame.
+    first : int
+        First frame to read.
+    last : int
+        Frame to stop before.
+
+    Returns
+    -------
+    bytes
+        Raw data of frames.
+    """
+    md_file.seek(offsets[first])
+    if last < len(offsets):
+        return md_file.read(offsets[last] - offsets[first])
+    return md_file.read()
+
+
+def scan_frame_offsets(data: bytes | mmap.mmap, pos: int = 0) -> np.ndarray:
+    """
+    Find the byte offset of the start of each frame in MD data.
+
+    Parameters
+    ----------
+    data : bytes or mmap.mmap
+        Raw contents of an MD file.
+    pos : int
+        Offset to scan from. If ``0`` the header is skipped,
+        otherwise `pos` must be the start of a frame.
+
+    Returns
+    -------
+    np.ndarray
+        Offsets of frame starts.
+    """
+    offsets = []
+    if pos == 0:
+        pos = data.find(b"END header")
+        pos = data.find(b"\n", pos) if pos >= 0 else 0
+    else:
+        offsets.append(pos)
+
+    size = len(data)
+    offsets.extend(match.end() for match in _BLANK_LINES.finditer(data, pos)
+                   if match.end() < size)
+
+    return np.array(offsets, dtype=np.int64)
+
+
+def index_path(md_path: Path | str) -> Path:
+    """
+    Get the path of the frame index sidecar for an MD file.
+
+    Parameters
+    ----------
+    md_path : Path or str
+        Path of MD file.
+
+    Returns
+    -------
+    Path
+        Path of sidecar index.
+    """
+    md_path = Path(md_path)
+    return md_path.with_name(md_path.name + INDEX_SUFFIX)
+
+
+def frame_offsets(md_path: Path | str, *, cache: bool = True) -> np.ndarray:
+    """
+    Get the byte offset of the start of each frame in an MD file.
+
+    The offsets are stored in a sidecar file next to the MD file
+    (see :func:`index_path`) and reused while the size and
+    modification time of the MD file are unchanged. An unreadable
+    sidecar is rebuilt, and a new sidecar is written to a temporary file
+    which then replaces it, so concurrent readers never see a partial
+    index.
+
+    Parameters
+    ----------
+    md_path : Path or str
+        Path of MD file.
+    cache : bool
+        Whether to read and write the sidecar index.
+
+    Returns
+    -------
+    np.ndarray
+        Offsets of frame starts.
+    """
+    md_path = Path(md_path)
+    stat = md_path.stat()
+    sidecar = index_path(md_path)
+
+    if cache and sidecar.is_file():
+        try:
+            with np.load(sidecar) as index:
+                if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns:
+                    return index["offsets"]
+        except Exception:
+            pass
+
+    if not stat.st_size:
+        return np.empty(0, dtype=np.int64)
+
+    with md_path.open("rb") as md_file, \
+         mmap.mmap(md_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offsets = scan_frame_offsets(data)
+
+    if cache:
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=sidecar.parent, prefix=f".{sidecar.name}.",
+                                             delete=False) as out_file:
+                tmp_path = Path(out_file.name)
+                np.savez(out_file, size=stat.st_size, mtime=stat.st_mtime_ns, offsets=offsets)
+            tmp_path.replace(sidecar)
+        except OSError:
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    tmp_path.unlink()
+
+    return offsets
+
+
+def frame_times(md_file: BinaryIO, offsets: np.ndarray) -> np.ndarray:
+    """
+    Read the time of each frame using a frame index.
+
+    Only the time line of each frame is read.
+
+    Parameters
+    ----------
+    md_file : BinaryIO
+        Seekable file to read.
+    offsets : np.ndarray
+        Byte offset of the start of each frame (see :func:`frame_offsets`).
+
+    Returns
+    -------
+    np.ndarray
+        Time of each frame.
+    """
+    times = np.empty(len(offsets))
+    for i, offset in enumerate(offsets):
+        md_file.seek(offset)
+        times[i] = float(md_file.readline())
+    return times
+
+
+def _columns(lines: np.ndarray, tag: str, n_labels: int, n_values: int) -> np.ndarray:
+    """
+    Split a group of lines with the same tag into tokens in bulk.
+
+    Parameters
+    ----------
+    lines : np.ndarray
+        Lines to convert.
+    tag : str
+        Tag each line must end with.
+    n_labels : int
+        Number of leading label columns.
+    n_values : int
+        Number of values per line.
+
+    Returns
+    -------
+    np.ndarray
+        Token array of shape ``(len(lines), n_labels + n_values + 2)``.
+
+    Raises
+    ------
+    IrregularLayoutError
+        Lines do not match the expected layout.
+    """
+    tokens = np.array(b" ".join(lines.ravel()).split())
+    try:
+        tokens = tokens.reshape(lines.size, n_labels + n_values + 2)
+    except ValueError as err:
+        raise IrregularLayoutError(f"Unexpected number of columns in {tag} lines") from err
+
+    if not ((tokens[:, -2] == b"<--").all() and (tokens[:, -1] == tag.encode()).all()):
+        raise IrregularLayoutError(f"Expected {tag} lines not found")
+
+    return tokens
+
+
+def parse_frames(data: bytes, tags: Collection[str] | None = None) -> dict[str, np.ndarray]:
+    """
+    Parse a chunk of complete frames into arrays.
+
+    Parameters
+    ----------
+    data : bytes
+        Raw data of one or more frames.
+    tags : Collection[str], optional
+        Tags to parse, lines with other tags are skipped without being
+        split or converted. Defaults to all tags in :data:`FRAME_LAYOUT`.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Frame data keyed by .md tag (``"time"`` for the frame time) with
+        leading dimension of the number of frames, and ``"species"``
+        holding the species of each atom.
+
+    Raises
+    ------
+    IrregularLayoutError
+        Data cannot be parsed by the fast path.
+    """
+    lines = _BLANK_LINES.sub(b"\n", data).strip().split(b"\n")
+    if not lines[0]:
+        raise IrregularLayoutError("No frames found")
+
+    frame_len = next((i for i in range(1, len(lines)) if b"<--" not in lines[i]), len(lines))
+    n_atoms, rem = divmod(frame_len - _FIXED_LINES, _ATOM_LINES)
+    n_frames, rem_frames = divmod(len(lines), frame_len)
+    if n_atoms < 1 or rem or rem_frames:
+        raise IrregularLayoutError("Frames do not share a regular layout")
+
+    frames = np.array(lines, dtype=object).reshape(n_frames, frame_len)
+
+    time = np.array(b" ".join(frames[:, 0]).split())
+    try:
+        if time.size != n_frames:
+            raise ValueError
+        parsed = {"time": time.astype(float)}
+    except ValueError as err:
+        raise IrregularLayoutError("Invalid time lines") from err
+
+    start = 1
+    for tag, n_labels, n_values, n_lines in FRAME_LAYOUT:
+        n_lines = n_lines or n_atoms
+        lines = frames[:, start:start+n_lines]
+        start += n_lines
+
+        if tags is not None and tag not in tags:
+            if tag == "R":
+                tokens = _columns(lines[:1], tag, n_labels, n_values)
+                parsed["species"] = [spec.decode() for spec in tokens[:, 0]]
+            continue
+
+        tokens = _columns(lines, tag, n_labels, n_values)
+
+        try:
+            values = tokens[:, n_labels:n_labels+n_values].astype(float)
+        except ValueError as err:
+            raise IrregularLayoutError(f"Invalid values in {tag} lines") from err
+
+        if n_labels or n_lines > 1:
+            parsed[tag] = values.reshape(n_frames, n_lines, n_values)
+        elif n_values > 1:
+            parsed[tag] = values.reshape(n_frames, n_values)
+        else:
+            parsed[tag] = values.reshape(n_frames)
+
+        if tag == "R":
+            species = tokens[:, 0].reshape(n_frames, n_atoms)
+            if not (species == species[0]).all():
+                raise IrregularLayoutError("Species change between frames")
+            parsed["species"] = [spec.decode() for spec in species[0]]
+
+    return parsed
@@ -0,0 +1,461 @@
+"""
+Read CASTEP .md files as a stream of blocks of parsed frames.
+
+This is the pipeline shared by the converters and readers of .md files:
+raw frames are read (through the frame index where a file can be
+seeked), parsed by :mod:`castep_outputs_tools.md_parser`, in parallel
+processes if requested, and gathered into blocks of arrays keyed by .md
+tag. It depends only on NumPy; castep_outputs is imported only for
+frames which do not follow the regular layout.
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import queue
+import threading
+from collections import deque
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, TextIO
+
+import numpy as np
+
+from castep_outputs_tools.md_parser import (
+    IrregularLayoutError,
+    detect_compression,
+    frame_offsets,
+    frame_times,
+    iter_chunks,
+    iter_indexed_chunks,
+    parse_frames,
+    read_header,
+)
+
+if TYPE_CHECKING:
+    from castep_outputs_tools.profiling import ConversionStats
+
+#: Default number of frames buffered before writing.
+DEFAULT_BLOCK_FRAMES = 64
+
+#: Picoseconds per atomic unit of time.
+AU_TIME_PS = 2.4188843265857e-5
+
+#: Shape of a single frame of data for each .md tag, where ``None`` is the number of atoms.
+TAG_SHAPES = {
+    "h": (3, 3),
+    "R": (None, 3),
+    "V": (None, 3),
+    "F": (None, 3),
+    "E": (),
+    "P": (),
+    "T": (),
+    "hv": (3, 3),
+    "S": (3, 3),
+}
+
+
+def _allocate_block(n_frames: int, n_atoms: int) -> dict[str, np.ndarray]:
+    """
+    Allocate buffers to hold a block of frames.
+
+    Parameters
+    ----------
+    n_frames : int
+        Number of frames in block.
+    n_atoms : int
+        Number of atoms per frame.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Empty arrays keyed by .md tag.
+    """
+    return {
+        "time": np.empty(n_frames),
+        "E": np.empty((n_frames, 3)),
+        "T": np.empty(n_frames),
+        "P": np.empty(n_frames),
+        "h": np.empty((n_frames, 3, 3)),
+        "hv": np.empty((n_frames, 3, 3)),
+        "S": np.empty((n_frames, 3, 3)),
+        "R": np.empty((n_frames, n_atoms, 3)),
+        "V": np.empty((n_frames, n_atoms, 3)),
+        "F": np.empty((n_frames, n_atoms, 3)),
+    }
+
+
+def _ions(frame: dict) -> dict[tuple[str, int], dict]:
+    """
+    Get the per-atom data of a frame parsed by castep_outputs.
+
+    Recent castep_outputs hold atoms under ``"ions"``, older versions at
+    the top level of the frame.
+
+    Parameters
+    ----------
+    frame : dict
+        Frame parsed by castep_outputs.
+
+    Returns
+    -------
+    dict[tuple[str, int], dict]
+        Data of each atom keyed by species and index.
+    """
+    return {key: val for key, val in frame.get("ions", frame).items() if isinstance(key, tuple)}
+
+
+def _convert_frame(block: dict[str, np.ndarray], frame: dict, index: int):
+    """
+    Convert a single frame and fill the data blocks.
+
+    Parameters
+    ----------
+    block : dict[str, np.ndarray]
+        Buffers to fill.
+    frame : dict
+        Incoming read frame.
+    index : int
+        Index of current frame within block.
+    """
+    block["time"][index] = frame["time"]
+    block["E"][index] = np.reshape(frame["E"], 3)
+    block["T"][index] = np.reshape(frame["T"], ())
+    block["P"][index] = np.reshape(frame["P"], ())
+    block["h"][index] = frame["h"]
+    block["hv"][index] = frame["hv"]
+    block["S"][index] = frame["S"]
+
+    atom_props = _ions(frame).values()
+
+    for key in "RVF":
+        block[key][index] = [elem[key] for elem in atom_props]
+
+
+def _parse_chunk(header: bytes, chunk: bytes,
+                 tags: Collection[str] | None = None) -> dict[str, np.ndarray]:
+    """
+    Parse a chunk of frames.
+
+    The fast parser is used where the frames follow the regular layout,
+    otherwise the chunk is parsed by castep_outputs.
+
+    Parameters
+    ----------
+    header : bytes
+        Header of the file being parsed.
+    chunk : bytes
+        Raw data of complete frames.
+    tags : Collection[str], optional
+        .md tags required, others may be left out. Defaults to all.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Arrays of frame data keyed by .md tag with ``"species"`` holding
+        the species of each atom.
+    """
+    try:
+        return parse_frames(chunk, tags)
+    except IrregularLayoutError:
+        pass
+
+    from castep_outputs.parsers import parse_md_geom_file  # noqa: PLC0415
+
+    text = (header + b"\n" + chunk.lstrip(b"\r\n")).decode()
+    frames = parse_md_geom_file(io.StringIO(text))
+    atoms = [spec for spec, _ in _ions(frames[0])]
+
+    block = _allocate_block(len(frames), len(atoms))
+    for i, frame in enumerate(frames):
+        _convert_frame(block, frame, i)
+    block["species"] = atoms
+
+    return block
+
+
+def _parse_chunks(header: bytes, chunks: Iterable[bytes], jobs: int = 1,
+                  tags: Collection[str] | None = None) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Parse chunks of frames, optionally across several processes.
+
+    Results are returned in the order of `chunks`. At most ``2 * jobs``
+    chunks are in flight at once to bound memory use.
+
+    Parameters
+    ----------
+    header : bytes
+        Header of the file being parsed.
+    chunks : Iterable[bytes]
+        Raw data of complete frames.
+    jobs : int
+        Number of processes to parse with.
+    tags : Collection[str], optional
+        .md tags required, others may be left out. Defaults to all.
+
+    Yields
+    ------
+    dict[str, np.ndarray]
+        Parsed chunk.
+    """
+    if jobs <= 1:
+        for chunk in chunks:
+            yield _parse_chunk(header, chunk, tags)
+        return
+
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_parse_chunk, header, chunk, tags))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def parse_ahead(blocks: Iterator[dict[str, np.ndarray]],
+                depth: int) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Parse blocks in a background thread while those already parsed are used.
+
+    The parsing thread hands blocks over through a queue of at most `depth`
+    blocks, so parsing overlaps with writing while memory use stays
+    bounded. Errors in parsing are re-raised in the consuming thread.
+
+    Parameters
+    ----------
+    blocks : Iterator[dict[str, np.ndarray]]
+        Blocks to parse, e.g. from :func:`iter_blocks`.
+    depth : int
+        Maximum number of parsed blocks waiting to be used. ``0`` parses in
+        the consuming thread.
+
+    Yields
+    ------
+    dict[str, np.ndarray]
+        Each block.
+    """
+    if depth <= 0:
+        yield from blocks
+        return
+
+    parsed = queue.Queue(depth)
+    stop = threading.Event()
+
+    def fill():
+        try:
+            for block in blocks:
+                parsed.put(block)
+                if stop.is_set():
+                    break
+        except Exception as err:  # Re-raised in the consuming thread
+            parsed.put(err)
+        finally:
+            if hasattr(blocks, "close"):
+                blocks.close()
+            parsed.put(StopIteration)
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while (block := parsed.get()) is not StopIteration:
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stop.set()
+        while thread.is_alive():
+            with contextlib.suppress(queue.Empty):
+                parsed.get_nowait()
+            thread.join(0.01)
+
+
+def iter_blocks(md_geom_file: TextIO | BinaryIO,
+                block_frames: int = DEFAULT_BLOCK_FRAMES,
+                jobs: int = 1,
+                *,
+                offsets: np.ndarray | None = None,
+                start: int = 0,
+                stop: int | None = None,
+                stride: int = 1,
+                tags: Collection[str] | None = None,
+                block_bytes: int | None = None,
+                stats: ConversionStats | None = None,
+                **read_opts) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Read an MD file in blocks of frames.
+
+    Parameters
+    ----------
+    md_geom_file : TextIO or BinaryIO
+        File to parse.
+    block_frames : int
+        Maximum number of frames per block.
+    jobs : int
+        Number of processes to parse with.
+    offsets : np.ndarray, optional
+        Frame index of `md_geom_file` used to seek directly to selected frames.
+    start : int
+        First frame to read.
+    stop : int, optional
+        Frame to stop before.
+    stride : int
+        Interval between frames read.
+    tags : Collection[str], optional
+        .md tags required, others may be left out. Defaults to all.
+    block_bytes : int, optional
+        Approximate maximum size in bytes of the raw data of a block.
+    stats : ConversionStats, optional
+        Stats to count bytes read in.
+    **read_opts : dict
+        Options passed to :func:`~castep_outputs_tools.md_parser.iter_chunks`.
+
+    Yields
+    ------
+    dict[str, np.ndarray]
+        Arrays of frame data keyed by .md tag with ``"species"`` holding
+        the species of each atom and ``"step"`` the original step numbers.
+    """
+    header = read_header(md_geom_file)
+
+    if offsets is None:
+        chunks = iter_chunks(md_geom_file, block_frames, start=start, stop=stop,
+                             stride=stride, block_bytes=block_bytes, **read_opts)
+    else:
+        chunks = iter_indexed_chunks(md_geom_file, offsets, block_frames, start=start,
+                                     stop=stop, stride=stride, block_bytes=block_bytes)
+
+    if stats is not None:
+        chunks = stats.count_bytes(chunks)
+
+    step = start + 1
+    for block in _parse_chunks(header, chunks, jobs, tags):
+        n_block = len(block["time"])
+        block["step"] = step + stride * np.arange(n_block)
+        step += stride * n_block
+        yield block
+
+
+def frame_index(md_geom_file: TextIO | BinaryIO, *, cache: bool = True) -> np.ndarray | None:
+    """
+    Get the frame index of a file if it can be used to seek to frames.
+
+    Parameters
+    ----------
+    md_geom_file : TextIO or BinaryIO
+        File to index.
+    cache : bool
+        Whether to read and write the sidecar index
+        (see :func:`~castep_outputs_tools.md_parser.frame_offsets`).
+
+    Returns
+    -------
+    np.ndarray or None
+        Frame offsets if `md_geom_file` is an uncompressed binary file on disk,
+        else ``None``.
+    """
+    name = getattr(md_geom_file, "name", None)
+    mode = getattr(md_geom_file, "mode", "")
+    if (not isinstance(name, str) or not isinstance(mode, str) or "b" not in mode
+            or not Path(name).is_file() or detect_compression(name)):
+        return None
+    return frame_offsets(name, cache=cache)
+
+
+def resolve_selection(
+        md_geom_file: TextIO | BinaryIO,
+        offsets: np.ndarray | None,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        *,
+        start_time: float | None = None,
+        stop_time: float | None = None,
+        time_stride: float | None = None,
+) -> tuple[int, int | None, int]:
+    """
+    Convert a selection of frames by index or time to a frame range.
+
+    Parameters
+    ----------
+    md_geom_file : TextIO or BinaryIO
+        File frames are selected from.
+    offsets : np.ndarray or None
+        Frame index of `md_geom_file` if available.
+    start, stop : int, optional
+        Frame range, negative values count from the end.
+    stride : int
+        Interval between frames.
+    start_time, stop_time : float, optional
+        Time range in ps, negative values count back from the last frame.
+    time_stride : float, optional
+        Interval between frames in ps.
+
+    Returns
+    -------
+    start : int
+        First frame.
+    stop : int or None
+        Frame to stop before or ``None`` for the end of the file.
+    stride : int
+        Interval between frames.
+
+    Raises
+    ------
+    ValueError
+        Selection is inconsistent, has a stride which is not positive or
+        requires an index which is not available.
+    """
+    if stride < 1:
+        raise ValueError(f"Stride must be positive, got {stride}")
+    if time_stride is not None and time_stride <= 0:
+        raise ValueError(f"Time stride must be positive, got {time_stride}")
+
+    if any(val is not None for val in (start_time, stop_time, time_stride)):
+        if start is not None or stop is not None or stride != 1:
+            raise ValueError("Cannot select frames by both index and time")
+        if offsets is None:
+            raise ValueError("Selecting frames by time requires a seekable .md file")
+
+        times = frame_times(md_geom_file, offsets) * AU_TIME_PS
+        md_geom_file.seek(0)
+
+        if start_time is not None:
+            start_time += times[-1] if start_time < 0 else 0.
+            start = int(np.searchsorted(times, start_time, side="left"))
+        if stop_time is not None:
+            stop_time += times[-1] if stop_time < 0 else 0.
+            stop = int(np.searchsorted(times, stop_time, side="right"))
+        if time_stride is not None and len(times) > 1:
+            stride = max(1, round(time_stride / np.median(np.diff(times))))
+
+    if offsets is not None:
+        frames = range(len(offsets))[start:stop:stride]
+        return frames.start, frames.stop, frames.step
+
+    if (start or 0) < 0 or (stop or 0) < 0:
+        raise ValueError("Negative frame selection requires a seekable .md file")
+
+    return start or 0, stop, stride
+
+
+def select_frames(block: dict[str, np.ndarray],
+                  index: np.ndarray | slice) -> dict[str, np.ndarray]:
+    """
+    Select a subset of the frames in a block.
+
+    Parameters
+    ----------
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    index : np.ndarray or slice
+        Index or mask of frames to keep.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Selected frame data.
+    """
+    return {key: val if key == "species" else val[index] for key, val in block.items()}
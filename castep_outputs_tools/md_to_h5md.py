@@ -8,150 +8,1031 @@ References
 from __future__ import annotations
 
 import argparse
+import contextlib
+import os
+import posixpath
+import re
+import sys
+import time
+from collections.abc import Collection, Iterable
+from concurrent.futures import ProcessPoolExecutor
 from functools import singledispatch
+from itertools import repeat
 from pathlib import Path
-from typing import TextIO
+from typing import Any, BinaryIO, NamedTuple, TextIO
 
 import h5py
-from castep_outputs.parsers import parse_md_geom_file as parser
+import numpy as np
 
 from castep_outputs_tools import __version__
+from castep_outputs_tools.h5md_layout import (
+    BOX,
+    MIN_CHUNK_BYTES,
+    SOURCES,
+    count_frames,
+    read_series,
+    series_groups,
+)
+from castep_outputs_tools.h5md_writers import WRITERS, ZARR_SUFFIX, H5MDWriter, open_writer
+from castep_outputs_tools.md_parser import (
+    COMPRESSED_SUFFIXES,
+    detect_compression,
+    frame_offsets,
+    frame_times,
+    open_md,
+)
+from castep_outputs_tools.md_pipeline import (
+    DEFAULT_BLOCK_FRAMES,
+    TAG_SHAPES,
+    frame_index,
+    iter_blocks,
+    parse_ahead,
+    resolve_selection,
+    select_frames,
+)
+from castep_outputs_tools.profiling import (
+    ConversionStats,
+    ProfiledWriter,
+    current_rss,
+    profile,
+    trace_memory,
+)
 
+#: Default number of parsed blocks queued for writing.
+DEFAULT_QUEUE_BLOCKS = 2
 
-def _convert_frame(out_file: h5py.File, frame: dict, frame_id: int):
+#: Default minimum number of frames per HDF5 chunk.
+DEFAULT_CHUNK_FRAMES = 1
+
+#: Relative tolerance within which frame times are taken as the same frame.
+_OVERLAP_RTOL = 1e-9
+
+#: Relative tolerance within which times are taken to fall at fixed intervals,
+#: a few units in the last place to allow for rounding of the times written.
+_FIXED_TIME_RTOL = 8 * np.finfo(float).eps
+
+#: Patterns of .md files converted from directories.
+MD_PATTERNS = ("*.md", *(f"*.md{suffix}" for suffix in COMPRESSED_SUFFIXES))
+
+#: Estimated peak memory of parsing a chunk relative to its size, including
+#: the chunk itself, the read buffer and the parsed arrays.
+_PARSE_MEMORY_FACTOR = 12
+
+#: Estimated memory per parallel job relative to chunk size, for the chunks
+#: and results in flight and the chunk being parsed in each process.
+_JOB_MEMORY_FACTOR = 16
+
+#: Estimated memory of a parsed block queued for writing relative to the size
+#: of its raw data.
+_QUEUED_MEMORY_FACTOR = 1
+
+#: Estimated memory of each parsing process before it parses any frames.
+_WORKER_MEMORY = 64 << 20
+
+#: Estimated memory of output buffers and caches.
+_WRITER_MEMORY = 16 << 20
+
+#: Binary multipliers of memory size suffixes.
+_SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+#: Characters marking a source as a glob pattern.
+_GLOB_CHARS = re.compile(r"[*?[]")
+
+#: Data groups whose storage precision may be set.
+PRECISION_GROUPS = ("position", "velocity", "force", "box", "observables")
+
+#: Fields which may be selected for conversion and the .md tag holding each.
+FIELDS = {
+    "box": "h",
+    "position": "R",
+    "velocity": "V",
+    "force": "F",
+    "energies": "E",
+    "pressure": "P",
+    "temperature": "T",
+    "lattice_velocity": "hv",
+    "stress": "S",
+}
+
+def _parse_size(size: str) -> int:
     """
-    Convert a single frame and fill the data blocks.
+    Get a memory size in bytes.
 
     Parameters
     ----------
-    frame : dict
-        Incoming read frame.
-    frame_id : int
-        Index of current frame.
-    out_file : h5py.File
+    size : str
+        Size as a number of bytes with an optional binary ``K``, ``M``,
+        ``G`` or ``T`` suffix.
+
+    Returns
+    -------
+    int
+        Size in bytes.
+
+    Raises
+    ------
+    ValueError
+        Invalid size.
+
+    Examples
+    --------
+    >>> _parse_size("1.5G")
+    1610612736
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([kmgt]?)(?:i?b)?\s*", size, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid memory size {size!r}")
+    return int(float(match[1]) * _SIZE_UNITS[match[2].lower()])
+
+
+def _memory_budget(max_memory: int, jobs: int = 1, queue_blocks: int = 0) -> tuple[int, int]:
+    """
+    Size blocks and the number of parsing processes to fit a memory budget.
+
+    Memory use is estimated from the memory already in use by the process
+    and the peak memory of parsing relative to the size of raw data.
+
+    Parameters
+    ----------
+    max_memory : int
+        Memory budget of conversion in bytes.
+    jobs : int
+        Maximum number of processes to parse with.
+    queue_blocks : int
+        Number of parsed blocks queued for writing.
+
+    Returns
+    -------
+    block_bytes : int
+        Maximum size in bytes of the raw data of a block.
+    jobs : int
+        Number of processes to parse with.
+
+    Raises
+    ------
+    ValueError
+        Budget is too small to convert any frames.
+    """
+    in_use = (current_rss() or 0) + _WRITER_MEMORY
+    available = max_memory - in_use
+    if available <= 0:
+        raise ValueError(f"Memory budget of {max_memory / 1e6:.1f} MB is below the "
+                         f"{in_use / 1e6:.1f} MB needed before parsing")
+
+    queued = queue_blocks * _QUEUED_MEMORY_FACTOR
+    jobs = max(1, min(jobs, available // (2 * _WORKER_MEMORY)))
+    if jobs == 1:
+        return available // (_PARSE_MEMORY_FACTOR + queued), 1
+    return (available - jobs * _WORKER_MEMORY) // (jobs * _JOB_MEMORY_FACTOR + queued), jobs
+
+
+def _fixed_clock(out_file: H5MDWriter, block: dict[str, np.ndarray],
+                 start: int) -> tuple[tuple[Any, Any], ...] | None:
+    """
+    Get fixed intervals of step and time continuing those held, if any.
+
+    The first frame sets the offsets and the frames up to the end of the
+    first block containing a second frame set the intervals. Frames fit
+    where ``offset + index * interval`` reproduces their steps exactly and
+    their times to within :data:`_FIXED_TIME_RTOL`.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write, holding steps and times at fixed intervals, or none.
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    start : int
+        Index of first frame in block.
+
+    Returns
+    -------
+    tuple[tuple[Any, Any], ...] or None
+        Offset and interval of step and time, or ``None`` if frames do not
+        fall at fixed intervals.
+    """
+    clock = series_groups(out_file)[0]
+    index = start + np.arange(len(block["time"]))
+    fixed = []
+    for key in ("step", "time"):
+        values = block[key]
+        if start == 0 or f"{clock}/{key}" not in out_file:
+            offset = values[0]
+        else:
+            dset = out_file[f"{clock}/{key}"]
+            offset, interval = dset.attrs.get("offset", 0), dset[()]
+
+        if start <= 1:
+            interval = (values[-1] - offset) / index[-1] if index[-1] else 0
+            if key == "step":
+                interval = round(interval)
+
+        fit = offset + index * interval
+        if not (np.array_equal(fit, values) if key == "step" else
+                np.allclose(fit, values, rtol=_FIXED_TIME_RTOL, atol=0)):
+            return None
+        fixed.append((offset, interval))
+
+    return tuple(fixed)
+
+
+def _create_clock(out_file: H5MDWriter, n_steps: int = 0, *,
+                  fixed: tuple[tuple[Any, Any], ...] | None = None, **opts):
+    """
+    Create the step and time datasets shared by all time-dependent groups.
+
+    Any existing step and time datasets are replaced.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    n_steps : int
+        Number of steps to preallocate.
+    fixed : tuple[tuple[Any, Any], ...], optional
+        Offset and interval of step and time (see :func:`_fixed_clock`) to
+        store in h5md's fixed form, rather than per frame.
+    **opts : dict
+        Chunking and filter options passed to :func:`_create_series`.
+    """
+    series = series_groups(out_file)
+    for path in series:
+        for key in ("step", "time"):
+            if f"{path}/{key}" in out_file:
+                out_file.delete(f"{path}/{key}")
+
+    clock = series[0]
+    if fixed is None:
+        _create_series(out_file, f"{clock}/step", n_steps, (), int, **opts)
+        _create_series(out_file, f"{clock}/time", n_steps, (), float, **opts)
+    else:
+        for key, dtype, (offset, interval) in zip(("step", "time"), (np.int64, np.float64), fixed):
+            out_file.create_dataset(f"{clock}/{key}", dtype(interval), attrs={"offset": offset})
+
+    for path in series[1:]:
+        out_file.link(f"{clock}/step", f"{path}/step")
+        out_file.link(f"{clock}/time", f"{path}/time")
+
+
+def _expand_clock(out_file: H5MDWriter, **opts):
+    """
+    Store steps and times per frame rather than at fixed intervals.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    **opts : dict
+        Chunking and filter options passed to :func:`_create_series`.
+    """
+    clock = series_groups(out_file)[0]
+    n_frames = count_frames(out_file)
+    values = {key: read_series(out_file, f"{clock}/{key}")[:] for key in ("step", "time")
+              if f"{clock}/{key}" in out_file}
+
+    _create_clock(out_file, n_frames, **opts)
+    for key, val in values.items():
+        out_file.write(f"{clock}/{key}", 0, val)
+
+
+def _expand_box(out_file: H5MDWriter, **opts):
+    """
+    Store the box per frame rather than as a single frame.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    **opts : dict
+        Chunking and filter options passed to :func:`_create_series`.
+    """
+    box = out_file[BOX]
+    value, spec = box[()], box.attrs["precision"]
+    clock = series_groups(out_file)[0]
+    n_frames = count_frames(out_file)
+
+    out_file.delete(BOX)
+    out_file.create_group(BOX)
+    if f"{clock}/step" in out_file:
+        out_file.link(f"{clock}/step", f"{BOX}/step")
+        out_file.link(f"{clock}/time", f"{BOX}/time")
+    _create_value(out_file, BOX, n_frames, value.shape, spec, **opts)
+    out_file.write(f"{BOX}/value", 0, np.broadcast_to(value, (n_frames, *value.shape)))
+
+
+def _expand_fixed(out_file: H5MDWriter, **opts):
+    """
+    Store all time-dependent data per frame.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    **opts : dict
+        Chunking and filter options passed to :func:`_create_series`.
+    """
+    if BOX in out_file and f"{BOX}/value" not in out_file:
+        _expand_box(out_file, **opts)
+    if not out_file[f"{series_groups(out_file)[0]}/step"].shape:
+        _expand_clock(out_file, **opts)
+
+
+def _resize(out_file: H5MDWriter, n_steps: int):
+    """
+    Resize all time-dependent datasets to hold `n_steps` frames.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to resize.
+    n_steps : int
+        New number of frames.
+    """
+    series = series_groups(out_file)
+    step = f"{series[0]}/step"
+    if step in out_file and out_file[step].shape:
+        out_file.resize(step, n_steps)
+        out_file.resize(f"{series[0]}/time", n_steps)
+    for path in series:
+        out_file.resize(f"{path}/value", n_steps)
+
+
+def _write_clock(out_file: H5MDWriter, block: dict[str, np.ndarray], start: int, **opts):
+    """
+    Write the steps and times of a block.
+
+    Steps and times are kept in fixed form while frames fall at fixed
+    intervals, and stored per frame from the first frame which does not.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
         File to write.
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    start : int
+        Index of first frame in block.
+    **opts : dict
+        Chunking and filter options for steps and times stored per frame.
     """
-    part = out_file["particles"]
-    obs = out_file["observables"]
+    step = f"{series_groups(out_file)[0]}/step"
+    if step not in out_file or not out_file[step].shape:
+        fixed = _fixed_clock(out_file, block, start)
+        if fixed is not None:
+            if start <= 1:
+                _create_clock(out_file, fixed=fixed)
+            return
+        _expand_clock(out_file, **opts)
 
-    part["box/edges/time"][frame_id] = frame["time"]
-    part["box/edges/value"][frame_id] = frame["h"]
+    out_file.write(step, start, block["step"])
+    out_file.write(step.replace("/step", "/time"), start, block["time"])
 
-    atom_props = [val for key, val in frame.items() if isinstance(key, tuple)]
 
-    for i, elem in enumerate(atom_props):
-        part["position/value"][frame_id, i] = elem["R"]
-        part["velocity/value"][frame_id, i] = elem["V"]
-        part["force/value"][frame_id, i] = elem["F"]
+def _write_block(out_file: H5MDWriter, block: dict[str, np.ndarray], start: int, **opts):
+    """
+    Write a block of frames with a single slab write per dataset.
 
-    for i, prop in enumerate(("hamiltonian_energy", "potential_energy", "kinetic_energy")):
-        obs[f"{prop}/value"][frame_id] = frame["E"][0][i]
+    Data held in fixed form is expanded to a series when the block does
+    not fit it.
 
-    obs["temperature/value"][frame_id] = frame["T"]
-    obs["pressure/value"][frame_id] = frame["P"]
-    obs["stress/value"][frame_id] = frame["S"]
-    obs["lattice_velocity/value"][frame_id] = frame["hv"]
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    start : int
+        Index of first frame in block.
+    **opts : dict
+        Chunking and filter options of data expanded to a series.
+    """
+    if BOX in out_file and f"{BOX}/value" not in out_file:
+        box = out_file[BOX]
+        if not (_fixed_value(block["h"], box.attrs["precision"]) == box[()]).all():
+            _expand_box(out_file, **opts)
+
+    series = series_groups(out_file)
+    stop = start + len(block["time"])
+
+    if stop > count_frames(out_file):
+        _resize(out_file, stop)
+
+    _write_clock(out_file, block, start, **opts)
+
+    for path in series:
+        tag, col = SOURCES[path]
+        data = block[tag] if col is None else block[tag][:, col]
+        out_file.write(f"{path}/value", start, data)
 
-def _create_header_info(out_file: h5py.File, **metadata):
+
+def _create_header_info(out_file: H5MDWriter, **metadata):
     """
     Create metadata block from provided information.
 
     Parameters
     ----------
-    out_file : h5py.File
+    out_file : H5MDWriter
         File to write.
     **metadata : dict
         Metadata ("name" and "email")
     """
-    grp = out_file.create_group("h5md")
-    grp.attrs["version"] = (1, 1)
-    auth = grp.create_group("author")
-    auth.attrs["name"] = metadata.get("author", "Unknown")
-    auth.attrs["email"] = metadata.get("email", "Unknown")
-    crea = grp.create_group("creator")
-    crea.attrs["name"] = "castep outputs"
-    crea.attrs["version"] = __version__
+    out_file.create_group("h5md", {"version": (1, 1)})
+    out_file.create_group("h5md/author", {"name": metadata.get("author", "Unknown"),
+                                          "email": metadata.get("email", "Unknown")})
+    out_file.create_group("h5md/creator", {"name": "castep outputs", "version": __version__})
 
-def _create_groups(out_file: h5py.File, n_steps: int, species: set[str], atoms: list[str]):
+def _parse_fields(fields: str | Iterable[str] | None) -> tuple[str, ...]:
     """
-    Create empty groups for filling with data.
+    Get the fields selected for conversion.
 
     Parameters
     ----------
-    out_file : h5py.File
+    fields : str or Iterable[str] or None
+        Fields as keys of :data:`FIELDS`, either as an iterable or a
+        comma-separated string. ``None`` selects all fields.
+
+    Returns
+    -------
+    tuple[str, ...]
+        Selected fields.
+
+    Raises
+    ------
+    ValueError
+        Unknown field.
+    """
+    if fields is None:
+        return tuple(FIELDS)
+    if isinstance(fields, str):
+        fields = fields.split(",")
+
+    fields = tuple(field.strip() for field in fields)
+    if not fields:
+        raise ValueError("No fields selected")
+    if unknown := set(fields) - set(FIELDS):
+        raise ValueError(f"Unknown fields {', '.join(sorted(unknown))} "
+                         f"(valid: {', '.join(FIELDS)})")
+
+    return fields
+
+
+def _parse_precision(precision: str | dict[str, str]) -> dict[str, str]:
+    """
+    Get the storage precision of each data group.
+
+    Parameters
+    ----------
+    precision : str or dict[str, str]
+        Either a single precision for all groups, a comma-separated list of
+        ``group=precision`` pairs, or a dict of the same. Precisions are
+        ``"float64"``, ``"float32"`` or ``"quantised:<decimals>"``. Groups
+        not given are stored as float64.
+
+    Returns
+    -------
+    dict[str, str]
+        Precision of each group in :data:`PRECISION_GROUPS`.
+
+    Raises
+    ------
+    ValueError
+        Unknown group or precision.
+
+    Examples
+    --------
+    >>> _parse_precision("position=quantised:3,velocity=float32")["velocity"]
+    'float32'
+    """
+    if isinstance(precision, str):
+        if "=" in precision:
+            precision = dict(pair.split("=", 1) for pair in precision.split(","))
+        else:
+            precision = dict.fromkeys(PRECISION_GROUPS, precision)
+
+    if unknown := set(precision) - set(PRECISION_GROUPS):
+        raise ValueError(f"Unknown data groups {', '.join(sorted(unknown))} "
+                         f"(valid: {', '.join(PRECISION_GROUPS)})")
+
+    for spec in precision.values():
+        _precision_options(spec)
+
+    return {grp: precision.get(grp, "float64") for grp in PRECISION_GROUPS}
+
+
+def _check_checksums(precision: dict[str, str], *, fletcher32: bool):
+    """
+    Check that checksums may be stored with the storage precisions.
+
+    Parameters
+    ----------
+    precision : dict[str, str]
+        Precision of each group (see :func:`_parse_precision`).
+    fletcher32 : bool
+        Whether to store fletcher32 checksums.
+
+    Raises
+    ------
+    ValueError
+        Checksums requested for quantised groups, whose lossy scale-offset
+        filter HDF5 cannot checksum.
+    """
+    quantised = [grp for grp, spec in precision.items() if spec.startswith("quantised")]
+    if fletcher32 and quantised:
+        raise ValueError("fletcher32 checksums cannot be stored with quantised precision "
+                         f"(quantised groups: {', '.join(quantised)})")
+
+
+def _precision_options(spec: str) -> tuple[type, dict, dict]:
+    """
+    Get the dataset options for a storage precision.
+
+    Parameters
+    ----------
+    spec : str
+        Precision as ``"float64"``, ``"float32"`` or ``"quantised:<decimals>"``.
+
+    Returns
+    -------
+    dtype : type
+        Type to store data as.
+    filters : dict
+        Additional filter options (see :meth:`.H5MDWriter.create_series`).
+    attrs : dict
+        Attributes recording the precision and its error bound.
+
+    Raises
+    ------
+    ValueError
+        Unknown precision.
+    """
+    if spec in ("float64", "float32"):
+        dtype = np.dtype(spec).type
+        return dtype, {}, {"precision": spec, "relative_error": np.finfo(dtype).eps / 2}
+
+    kind, _, decimals = spec.partition(":")
+    if kind == "quantised" and decimals.isdigit():
+        return (np.float64, {"scaleoffset": int(decimals)},
+                {"precision": spec, "absolute_error": 0.5 * 10.**-int(decimals)})
+
+    raise ValueError(f"Unknown precision {spec!r} "
+                     "(valid: float64, float32, quantised:<decimals>)")
+
+
+def _fixed_value(value: np.ndarray, spec: str) -> np.ndarray:
+    """
+    Get data as stored in a fixed dataset at a given precision.
+
+    Fixed datasets are not chunked, so cannot be filtered. Quantised data
+    is rounded to its decimals instead.
+
+    Parameters
+    ----------
+    value : np.ndarray
+        Data to store.
+    spec : str
+        Storage precision (see :func:`_precision_options`).
+
+    Returns
+    -------
+    np.ndarray
+        Data at the given precision.
+    """
+    dtype, filters, _ = _precision_options(spec)
+    value = np.asarray(value, dtype=dtype)
+    if "scaleoffset" in filters:
+        value = value.round(filters["scaleoffset"])
+    return value
+
+
+def _create_series(
+        out_file: H5MDWriter,
+        path: str,
+        n_steps: int,
+        shape: tuple[int, ...],
+        dtype: type,
+        *,
+        chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+        attrs: dict | None = None,
+        **filters,
+):
+    """
+    Create a resizable, chunked time-dependent dataset.
+
+    Chunks hold whole frames; small frames are grouped so that each
+    chunk holds at least ``MIN_CHUNK_BYTES``.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
         File to write.
+    path : str
+        Dataset to create.
     n_steps : int
-        Number of steps in md file.
-    species : set[str]
-        Species in file.
+        Number of steps to preallocate.
+    shape : tuple[int, ...]
+        Shape of a single frame.
+    dtype : type
+        Type of data.
+    chunk_frames : int
+        Minimum number of frames per chunk.
+    attrs : dict, optional
+        Attributes of dataset.
+    **filters : dict
+        Compression and filter options (see :meth:`.H5MDWriter.create_series`).
+    """
+    frame_bytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+    frames = max(chunk_frames, -(-MIN_CHUNK_BYTES // frame_bytes))
+
+    out_file.create_series(path, (n_steps, *shape), dtype, (frames, *shape), attrs, **filters)
+
+
+def _create_value(out_file: H5MDWriter, path: str, n_steps: int, shape: tuple[int, ...],
+                  spec: str, **opts):
+    """
+    Create the value dataset of a time-dependent group at a given precision.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    path : str
+        Group to create dataset in.
+    n_steps : int
+        Number of steps to preallocate.
+    shape : tuple[int, ...]
+        Shape of a single frame.
+    spec : str
+        Storage precision (see :func:`_precision_options`).
+    **opts : dict
+        Chunking and filter options passed to :func:`_create_series`.
+    """
+    dtype, filters, attrs = _precision_options(spec)
+    _create_series(out_file, f"{path}/value", n_steps, shape, dtype, attrs=attrs,
+                   **opts, **filters)
+
+
+def _constant_box(block: dict[str, np.ndarray], fields: Collection[str]) -> np.ndarray | None:
+    """
+    Get the box of a block if it is the same in every frame.
+
+    Parameters
+    ----------
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    fields : Collection[str]
+        Fields converted. The box is only stored as a single frame alongside
+        another field, which records the number of frames.
+
+    Returns
+    -------
+    np.ndarray or None
+        Box, or ``None`` if it changes or is not stored alone.
+    """
+    if "box" not in fields or len(fields) == 1:
+        return None
+    box = block["h"]
+    return box[0] if (box == box[0]).all() else None
+
+
+def _create_groups(
+        out_file: H5MDWriter,
+        species: Collection[str],
+        atoms: list[str],
+        n_steps: int = 0,
+        *,
+        fields: Collection[str] = tuple(FIELDS),
+        precision: dict[str, str] | None = None,
+        chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+        box: np.ndarray | None = None,
+        fixed_clock: bool = False,
+        **filters,
+):
+    """
+    Create empty groups for filling with data.
+
+    Time-dependent datasets are chunked and resizable along the frame
+    axis so that frames may be appended as they are read.
+
+    Parameters
+    ----------
+    out_file : H5MDWriter
+        File to write.
+    species : Collection[str]
+        Species in file, numbered in the order given.
     atoms : list[str]
         Complete list of atoms in file.
+    n_steps : int
+        Number of steps to preallocate.
+    fields : Collection[str]
+        Fields (keys of :data:`FIELDS`) to create groups for.
+    precision : dict[str, str], optional
+        Storage precision of each data group (see :func:`_parse_precision`).
+    chunk_frames : int
+        Minimum number of frames per chunk.
+    box : np.ndarray, optional
+        Box of every frame, stored in h5md's time-independent form if given,
+        rounded to its precision when quantised.
+    fixed_clock : bool
+        Whether to leave step and time datasets to be created at fixed
+        intervals as frames are written (see :func:`_write_clock`).
+    **filters : dict
+        Compression and filter options (see :meth:`.H5MDWriter.create_series`).
     """
+    if precision is None:
+        precision = _parse_precision("float64")
+
     n_atoms = len(atoms)
     n_species = len(species)
+    opts = {"chunk_frames": chunk_frames, **filters}
 
-    part = out_file.create_group("particles")
-    obs = out_file.create_group("observables")
+    out_file.create_group("particles")
+    out_file.create_group("observables")
 
     atom_dict = dict(zip(species, range(n_species)))
-    spec_enum = h5py.enum_dtype(atom_dict)
-    atom_ind = [atom_dict[atm] for atm in atoms]
+    atom_ind = np.array([atom_dict[atm] for atm in atoms], dtype=np.int32)
+
+    out_file.create_dataset("particles/species", atom_ind, enum=atom_dict)
+    out_file.create_group("particles/box", {"dimension": 3, "boundary": "periodic"})
 
-    part.create_dataset("species", (n_atoms,), dtype=spec_enum, data=atom_ind)
+    tags = {FIELDS[field] for field in fields}
 
-    box = part.create_group("box")
-    box.attrs["dimension"] = 3
-    box.attrs["boundary"] = "periodic"
-    edge = box.create_group("edges")
-    edge["step"] = list(range(1, n_steps+1))
-    edge.create_dataset("time", (n_steps,), dtype=float)
-    edge.create_dataset("value", (n_steps, 3, 3), dtype=float)
+    for path, (tag, _) in SOURCES.items():
+        if tag not in tags:
+            continue
 
-    for prop in ("position", "velocity", "force"):
-        grp = part.create_group(prop)
-        grp["step"] = edge["step"]
-        grp["time"] = edge["time"]
-        grp.create_dataset("value", (n_steps, n_atoms, 3), dtype=float)
+        prec = "observables" if path.startswith("observables") else path.split("/")[1]
+        if path == BOX and box is not None:
+            _, _, attrs = _precision_options(precision[prec])
+            out_file.create_dataset(path, _fixed_value(box, precision[prec]), attrs=attrs)
+            continue
 
-    for prop in ("hamiltonian_energy", "potential_energy",
-                 "kinetic_energy", "pressure", "temperature"):
-        grp = obs.create_group(prop)
-        grp["step"] = edge["step"]
-        grp["time"] = edge["time"]
-        grp.create_dataset("value", (n_steps,), dtype=float)
+        out_file.create_group(path)
+        shape = tuple(n_atoms if dim is None else dim for dim in TAG_SHAPES[tag])
+        _create_value(out_file, path, n_steps, shape, precision[prec], **opts)
 
-    for prop in ("lattice_velocity", "stress"):
-        grp = obs.create_group(prop)
-        grp["step"] = edge["step"]
-        grp["time"] = edge["time"]
-        grp.create_dataset("value", (n_steps, 3, 3), dtype=float)
+    if not fixed_clock:
+        _create_clock(out_file, n_steps, **opts)
 
 
-def md_to_h5md(md_geom_file: TextIO, out_path: Path | str, **metadata) -> None:
+def md_to_h5md(
+        md_geom_file: TextIO | BinaryIO,
+        out_path: Path | str,
+        *,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        jobs: int = 1,
+        queue_blocks: int = DEFAULT_QUEUE_BLOCKS,
+        chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+        compression: str | None = None,
+        compression_opts: int | None = None,
+        shuffle: bool = False,
+        fletcher32: bool = False,
+        precision: str | dict[str, str] = "float64",
+        follow: bool = False,
+        poll_interval: float = 1.,
+        timeout: float | None = None,
+        append: bool = False,
+        continuation: bool = False,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        start_time: float | None = None,
+        stop_time: float | None = None,
+        time_stride: float | None = None,
+        fields: str | Iterable[str] | None = None,
+        backend: str = "auto",
+        max_memory: int | str | None = None,
+        track_memory: bool = False,
+        profile_path: Path | str | None = None,
+        compact: bool = True,
+        **metadata,
+) -> ConversionStats:
     """
     Convert an MD file to h5md format [1]_.
 
+    Frames are streamed from the input and appended to the output
+    in blocks as they are read, so memory use is bounded by the block
+    size rather than the trajectory length. Blocks following the regular
+    .md layout are read by the fast parser in
+    :mod:`castep_outputs_tools.md_parser`, others by castep_outputs.
+
+    Frames outside a selected range are skipped without parsing. Where
+    `md_geom_file` is a binary file on disk, a frame index is used to seek
+    directly to selected frames and the output is sized to the selection.
+    Selecting by time or counting from the end requires the index. The
+    ``step`` datasets record the original step of each frame.
+
+    Steps and times at fixed intervals are stored as h5md's scalar
+    ``step`` and ``time`` intervals with an ``offset`` attribute, and a
+    box which never changes as a single time-independent ``edges``
+    dataset, unless `compact` is false. Either is expanded to a series from
+    the first frame which does not fit it
+    (see :class:`~castep_outputs_tools.h5md_layout.FixedSeries`).
+
     Parameters
     ----------
-    md_geom_file : TextIO
+    md_geom_file : TextIO or BinaryIO
         File to parse.
     out_path : Path or str
         File to write.
+    block_frames : int
+        Number of frames to buffer between writes.
+    jobs : int
+        Number of processes to parse with. Blocks are parsed in parallel
+        and written in order by the calling process.
+    queue_blocks : int
+        Number of parsed blocks which may wait to be written. Blocks are
+        parsed in a background thread while earlier blocks are written by
+        the calling thread, which alone holds the output. ``0`` parses and
+        writes in turn, as does following a file.
+    chunk_frames : int
+        Minimum number of frames per HDF5 chunk.
+    compression : {"gzip", "lzf"}, optional
+        Compression filter for time-dependent datasets.
+    compression_opts : int, optional
+        Compression level for gzip (0-9).
+    shuffle : bool
+        Whether to apply the shuffle filter.
+    fletcher32 : bool
+        Whether to store fletcher32 checksums. Cannot be combined with
+        quantised precision.
+    precision : str or dict[str, str]
+        Storage precision of position, velocity, force, box and observables
+        data (see :func:`_parse_precision`). The precision used and its error
+        bound are recorded in the attributes of each value dataset.
+    follow : bool
+        Whether to keep converting new frames as they are written to
+        `md_geom_file`. HDF5 output is opened in SWMR mode and flushed after
+        each block, so it may be read while conversion continues. Parsing
+        is done in-process when following.
+    poll_interval : float
+        Time in seconds between polls for new frames when following.
+    timeout : float, optional
+        Time in seconds without new frames after which to stop following.
+        By default follow until interrupted.
+    append : bool
+        Whether to extend an existing h5md output. Frames already held in
+        `out_path` are skipped without parsing and only later frames are
+        converted. Chunking, compression and precision options are taken
+        from the existing output.
+    continuation : bool
+        Whether `md_geom_file` continues the trajectory held in `out_path`
+        from a restart, rather than being a longer copy of the file it was
+        converted from. Frames at or before the last time already held are
+        skipped, using the frame index to seek past them without parsing
+        where available, and steps continue from the last held step.
+    start, stop : int, optional
+        Range of frames to convert, negative values count from the end.
+    stride : int
+        Interval between converted frames.
+    start_time, stop_time : float, optional
+        Range of times to convert in ps, negative values count back from
+        the last frame.
+    time_stride : float, optional
+        Interval between converted frames in ps.
+    fields : str or Iterable[str], optional
+        Fields to convert (keys of :data:`FIELDS`), by default all. Lines
+        of other fields are not parsed and their groups are not created.
+    backend : str
+        Storage backend of output (see :func:`.open_writer`), by default
+        Zarr for paths ending ``.zarr`` and HDF5 otherwise.
+    max_memory : int or str, optional
+        Memory budget of the process in bytes, or as a size with a ``K``,
+        ``M``, ``G`` or ``T`` suffix. Blocks are shrunk below `block_frames`
+        and fewer than `jobs` processes used where needed to stay within
+        the budget, which is estimated from the memory in use and the size
+        of the frames read. Parsing processes count against the budget.
+        Blocks which fall back to castep_outputs use more memory.
+    track_memory : bool
+        Whether to trace the peak memory allocated by Python in each stage
+        with :mod:`tracemalloc`, which slows conversion.
+    profile_path : Path or str, optional
+        File to dump :mod:`cProfile` stats of the conversion to.
+    compact : bool
+        Whether to store steps and times at fixed intervals, and a box which
+        never changes, in h5md's fixed forms. Output which is followed is
+        always stored per frame, as datasets cannot be replaced while it is
+        being read.
     **metadata : dict
         Username and email of author.
+
+    Returns
+    -------
+    ConversionStats
+        Wall time of each stage (``index``, ``parse``, ``create``, ``write``
+        and ``total``) and the peak RSS at its end, with frames and bytes
+        read and written and the number of calls of each output method.
+        With parallel or background parsing, ``parse`` is the time spent
+        waiting for parsed blocks and memory is that of the calling process.
     """
-    parsed = parser(md_geom_file)
-    atoms = [x[0] for x in parsed[0] if isinstance(x, tuple)]
-    species = set(atoms)
-    n_steps = len(parsed)
+    precision = _parse_precision(precision)
+    _check_checksums(precision, fletcher32=fletcher32)
+    fields = _parse_fields(fields)
+    stats = ConversionStats()
+    compact = compact and not follow
+    opts = {"chunk_frames": chunk_frames, "compression": compression,
+            "compression_opts": compression_opts, "shuffle": shuffle, "fletcher32": fletcher32}
+
+    block_bytes = None
+    if follow:
+        jobs = 1
+        queue_blocks = 0
+    if max_memory is not None:
+        if isinstance(max_memory, str):
+            max_memory = _parse_size(max_memory)
+        block_bytes, jobs = _memory_budget(max_memory, jobs, queue_blocks)
+
+    with trace_memory(enabled=track_memory), profile(profile_path), stats.stage("total"), \
+         ProfiledWriter(open_writer(out_path, backend, append=append, follow=follow),
+                        stats) as out_file:
+
+        if "h5md" not in out_file:
+            _create_header_info(out_file, **metadata)
+
+        n_frames = 0
+        last_time = -np.inf
+        last_step = 0
+        n_atoms = None
+        if "particles" in out_file:
+            n_frames = count_frames(out_file)
+            n_atoms = out_file["particles/species"].shape[0]
+            if follow:
+                _expand_fixed(out_file, **opts)
+            if n_frames:
+                clock = series_groups(out_file)[0]
+                last_time = float(read_series(out_file, f"{clock}/time")[-1])
+                last_step = int(read_series(out_file, f"{clock}/step")[-1])
+                last_time += abs(last_time) * _OVERLAP_RTOL
+
+        selection = {"start": start, "stop": stop, "stride": stride, "start_time": start_time,
+                     "stop_time": stop_time, "time_stride": time_stride}
+        selected = stride != 1 or any(val is not None for key, val in selection.items()
+                                      if key != "stride")
+
+        with stats.stage("index"):
+            offsets = None
+            if (selected or n_frames) and not follow:
+                offsets = frame_index(md_geom_file)
 
-    with h5py.File(out_path, "w") as out_file:
+            start, stop, stride = resolve_selection(md_geom_file, offsets, **selection)
+            if not continuation:
+                start += n_frames * stride
+            elif n_frames and offsets is not None:
+                first = int(np.searchsorted(frame_times(md_geom_file, offsets), last_time,
+                                            side="right"))
+                md_geom_file.seek(0)
+                start += max(0, -(-(first - start) // stride)) * stride
 
-        _create_header_info(out_file, **metadata)
-        _create_groups(out_file, n_steps, species, atoms)
+        n_steps = 0
+        if offsets is not None:
+            n_steps = len(range(start, len(offsets) if stop is None else stop, stride))
 
-        for i, frame in enumerate(parsed):
-            _convert_frame(out_file, frame, i)
+        blocks = iter_blocks(md_geom_file, block_frames, jobs,
+                             offsets=offsets, start=start, stop=stop, stride=stride,
+                             tags={FIELDS[field] for field in fields},
+                             block_bytes=block_bytes, stats=stats, follow=follow,
+                             poll_interval=poll_interval, timeout=timeout)
+        blocks = parse_ahead(blocks, queue_blocks)
+
+        step_offset = None
+        for block in stats.timed("parse", blocks):
+            block = select_frames(block, block["time"] > last_time)
+            if not len(block["time"]):
+                continue
+
+            if continuation:
+                if step_offset is None:
+                    step_offset = last_step + stride - block["step"][0] if n_frames else 0
+                block["step"] += step_offset
+
+            atoms = block["species"]
+            if n_atoms is None:
+                with stats.stage("create"):
+                    _create_groups(out_file, list(dict.fromkeys(atoms)), atoms, n_steps,
+                                   fields=fields,
+                                   precision=precision,
+                                   box=_constant_box(block, fields) if compact else None,
+                                   fixed_clock=compact,
+                                   **opts)
+                n_atoms = len(atoms)
+            elif len(atoms) != n_atoms:
+                raise ValueError(f"Cannot append frames of {len(atoms)} atoms "
+                                 f"to {out_path} with {n_atoms} atoms")
+
+            if follow:
+                out_file.enable_concurrent_reads()
+
+            with stats.stage("write"):
+                _write_block(out_file, block, n_frames, **opts)
+                if follow:
+                    out_file.flush()
+
+            n_frames += len(block["time"])
+            stats.frames += len(block["time"])
+
+        if n_atoms is not None and count_frames(out_file) > n_frames:
+            _resize(out_file, n_frames)
+
+    return stats
 
 @singledispatch
 def main(source, output, **metadata):
@@ -160,10 +1041,15 @@ def main(source, output, **metadata):
 
     Parameters
     ----------
-    source : str or Path or TextIO
-        File to parse.
+    source : str or Path or TextIO or list
+        File to parse, or list of sources to convert with :func:`convert_batch`.
     output : str or Path
-        File to write.
+        File to write, or output path template for a list of sources.
+
+    Returns
+    -------
+    ConversionStats or list[BatchResult]
+        Stats of conversion, or outcome of each conversion for a list of sources.
 
     Raises
     ------
@@ -174,16 +1060,448 @@ def main(source, output, **metadata):
 
 @main.register(str)
 def _(source, output: Path | str, **metadata):
-    main(Path(source), output, **metadata)
+    return main(Path(source), output, **metadata)
 
 @main.register(Path)
 def _(source, output: Path | str, **metadata):
-    with source.open("r") as in_file:
-        md_to_h5md(in_file, output, **metadata)
+    with open_md(source) as in_file:
+        return md_to_h5md(in_file, output, **metadata)
 
 @main.register(TextIO)
 def _(source, output: Path | str, **metadata):
-    md_to_h5md(source, output, **metadata)
+    return md_to_h5md(source, output, **metadata)
+
+@main.register(list)
+@main.register(tuple)
+def _(source, output: Path | str, **metadata):
+    return convert_batch(source, output, **metadata)
+
+
+def concatenate(
+        sources: Iterable[str | Path],
+        out_path: str | Path,
+        *,
+        append: bool = False,
+        follow: bool = False,
+        **kwargs,
+) -> None:
+    """
+    Convert a series of restarted MD runs to a single h5md trajectory.
+
+    Each source continues the trajectory from the previous ones (see the
+    `continuation` option of :func:`md_to_h5md`). Frames repeated at the
+    restart points are dropped by time without re-reading earlier sources.
+
+    Parameters
+    ----------
+    sources : Iterable[str or Path]
+        Files, directories or glob patterns (see :func:`expand_sources`),
+        in the order the runs were performed.
+    out_path : str or Path
+        File to write.
+    append : bool
+        Whether to continue a trajectory already held in `out_path`.
+    follow : bool
+        Whether to follow the last source as it is written.
+    **kwargs : dict
+        Options passed to :func:`md_to_h5md`.
+    """
+    paths = expand_sources(sources)
+    for i, path in enumerate(paths):
+        main(path, out_path, append=append or i > 0, continuation=True,
+             follow=follow and i == len(paths) - 1, **kwargs)
+
+
+class BatchResult(NamedTuple):
+    """Outcome of converting one file in a batch."""
+
+    #: File converted.
+    source: Path
+    #: File written.
+    output: Path
+    #: Error raised during conversion, ``None`` on success.
+    error: str | None
+    #: Wall time of conversion in seconds.
+    time: float
+
+
+def expand_sources(sources: Iterable[str | Path]) -> list[Path]:
+    """
+    Expand a list of sources to the .md files they refer to.
+
+    Parameters
+    ----------
+    sources : Iterable[str or Path]
+        Files, directories (all files within matching :data:`MD_PATTERNS`)
+        or glob patterns.
+
+    Returns
+    -------
+    list[Path]
+        Files to convert.
+
+    Raises
+    ------
+    FileNotFoundError
+        Source matches no files.
+    """
+    paths = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            matches = sorted(match for pattern in MD_PATTERNS for match in path.glob(pattern))
+        elif not path.exists() and _GLOB_CHARS.search(str(source)):
+            root = Path(path.anchor or ".")
+            matches = sorted(root.glob(str(path.relative_to(path.anchor))
+                                       if path.anchor else str(path)))
+        else:
+            matches = [path]
+
+        if not matches:
+            raise FileNotFoundError(f"No .md files found matching {source}")
+        paths.extend(matches)
+
+    return paths
+
+
+def output_path(template: str | Path, source: Path) -> Path:
+    """
+    Get the output path for a source from a template.
+
+    Parameters
+    ----------
+    template : str or Path
+        Output path which may contain the fields ``{stem}``, ``{name}``
+        and ``{parent}`` of the source path. ``{stem}`` excludes any
+        compression suffix as well as the final suffix.
+    source : Path
+        Source file.
+
+    Returns
+    -------
+    Path
+        Output path.
+
+    Examples
+    --------
+    >>> output_path("out/{stem}.h5md", Path("runs/nvt.md"))
+    PosixPath('out/nvt.h5md')
+    >>> output_path("out/{stem}.h5md", Path("runs/nvt.md.gz"))
+    PosixPath('out/nvt.h5md')
+    """
+    stem = source.stem if source.suffix in COMPRESSED_SUFFIXES else source.name
+    return Path(str(template).format(stem=Path(stem).stem, name=source.name,
+                                     parent=source.parent))
+
+
+def _convert_one(source: Path, output: Path, kwargs: dict) -> BatchResult:
+    """
+    Convert a single file of a batch, capturing any error.
+
+    Parameters
+    ----------
+    source : Path
+        File to convert.
+    output : Path
+        File to write.
+    kwargs : dict
+        Options passed to :func:`md_to_h5md`.
+
+    Returns
+    -------
+    BatchResult
+        Outcome of conversion.
+    """
+    start = time.perf_counter()
+    try:
+        main(source, output, **kwargs)
+    except Exception as err:
+        return BatchResult(source, output, f"{type(err).__name__}: {err}",
+                           time.perf_counter() - start)
+    return BatchResult(source, output, None, time.perf_counter() - start)
+
+
+def convert_batch(
+        sources: Iterable[str | Path],
+        output: str | Path,
+        *,
+        workers: int = 1,
+        **kwargs,
+) -> list[BatchResult]:
+    """
+    Convert many MD files to h5md format.
+
+    A failure converting one file does not stop the others.
+
+    Parameters
+    ----------
+    sources : Iterable[str or Path]
+        Files, directories or glob patterns (see :func:`expand_sources`).
+    output : str or Path
+        Output path template (see :func:`output_path`).
+    workers : int
+        Number of files to convert at once in separate processes.
+    **kwargs : dict
+        Options passed to :func:`md_to_h5md`.
+
+    Returns
+    -------
+    list[BatchResult]
+        Outcome of each conversion.
+
+    Raises
+    ------
+    ValueError
+        Several sources would be written to the same output.
+    """
+    paths = expand_sources(sources)
+    outputs = [output_path(output, path) for path in paths]
+    if len(set(outputs)) < len(outputs):
+        raise ValueError(f"Output template {output} maps several sources to the same file, "
+                         "use fields such as {stem} to distinguish them")
+
+    if workers <= 1:
+        return [_convert_one(path, out, kwargs) for path, out in zip(paths, outputs)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_convert_one, paths, outputs, repeat(kwargs)))
+
+
+def shard_path(out_path: Path | str, index: int) -> Path:
+    """
+    Get the path of a shard of a sharded conversion.
+
+    Parameters
+    ----------
+    out_path : Path or str
+        File joining the shards.
+    index : int
+        Number of shard.
+
+    Returns
+    -------
+    Path
+        Shard file, alongside `out_path`.
+
+    Examples
+    --------
+    >>> shard_path("out/run.h5md", 2)
+    PosixPath('out/run.shard002.h5md')
+    """
+    out_path = Path(out_path)
+    return out_path.with_name(f"{out_path.stem}.shard{index:03d}{out_path.suffix}")
+
+
+def convert_sharded(
+        source: Path | str,
+        out_path: Path | str,
+        shards: int,
+        *,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        start_time: float | None = None,
+        stop_time: float | None = None,
+        time_stride: float | None = None,
+        backend: str = "auto",
+        **kwargs,
+) -> list[ConversionStats]:
+    """
+    Convert an MD file in parallel as shards joined by HDF5 virtual datasets.
+
+    The selected frames are split into `shards` consecutive ranges, each
+    converted by a separate process to its own file (see
+    :func:`shard_path`). `out_path` then presents the shards as a single
+    trajectory (see :func:`stitch_shards`), without copying their data.
+
+    Parameters
+    ----------
+    source : Path or str
+        Uncompressed file to convert, which is indexed to split it.
+    out_path : Path or str
+        HDF5 file to write.
+    shards : int
+        Number of shards to convert at once.
+    start, stop : int, optional
+        Range of frames to convert, negative values count from the end.
+    stride : int
+        Interval between frames converted.
+    start_time, stop_time : float, optional
+        Range of times to convert in ps, negative values count back from
+        the last frame.
+    time_stride : float, optional
+        Interval between frames converted in ps.
+    backend : str
+        Storage backend of output, which must be HDF5.
+    **kwargs : dict
+        Options passed to :func:`md_to_h5md` for each shard. Shards are
+        always stored per frame (``compact`` is ignored), as their steps
+        and times are joined, and cannot be followed or appended to.
+
+    Returns
+    -------
+    list[ConversionStats]
+        Stats of the conversion of each shard.
+
+    Raises
+    ------
+    ValueError
+        Fewer than one shard is requested, output is not HDF5, source is
+        compressed, no frames are selected or options cannot be applied to
+        shards.
+    """
+    source, out_path = Path(source), Path(out_path)
+    if shards < 1:
+        raise ValueError(f"Number of shards must be positive, got {shards}")
+    if backend == "zarr" or (backend == "auto" and out_path.suffix == ZARR_SUFFIX):
+        raise ValueError("Sharded output requires the hdf5 backend for virtual datasets")
+    if detect_compression(source) is not None:
+        raise ValueError(f"Cannot split compressed {source} into shards")
+    if kwargs.get("follow") or kwargs.get("append"):
+        raise ValueError("Sharded output cannot be followed or appended to")
+    kwargs.update(compact=False, follow=False, append=False)
+
+    offsets = frame_offsets(source)
+    with open_md(source) as md_file:
+        start, stop, stride = resolve_selection(md_file, offsets, start, stop, stride,
+                                                start_time=start_time, stop_time=stop_time,
+                                                time_stride=time_stride)
+    frames = range(start, len(offsets) if stop is None else stop, stride)
+    if not frames:
+        raise ValueError(f"No frames of {source} selected")
+
+    shards = min(shards, len(frames))
+    bounds = [len(frames) * i // shards for i in range(shards + 1)]
+    paths = [shard_path(out_path, i) for i in range(shards)]
+    with ProcessPoolExecutor(shards) as pool:
+        futures = [pool.submit(main, source, path, start=frames[first],
+                               stop=frames[last - 1] + 1, stride=stride, backend="hdf5",
+                               **kwargs)
+                   for path, first, last in zip(paths, bounds, bounds[1:])]
+        stats = [future.result() for future in futures]
+
+    stitch_shards(paths, out_path)
+    return stats
+
+
+def _stitch_group(shards: list[h5py.File], names: list[str], out_file: h5py.File,
+                  path: str, written: dict):
+    """
+    Join a group of each shard into the output.
+
+    Parameters
+    ----------
+    shards : list[h5py.File]
+        Shards in order.
+    names : list[str]
+        Paths of shards relative to the output.
+    out_file : h5py.File
+        File to write.
+    path : str
+        Group to join.
+    written : dict
+        Path written for each dataset, so that datasets linked in the shards
+        are linked in the output.
+
+    Raises
+    ------
+    ValueError
+        Datasets of shards do not match.
+    """
+    out_file.require_group(path).attrs.update(shards[0][path].attrs)
+
+    for name, dset in shards[0][path].items():
+        sub = posixpath.join(path, name)
+        if isinstance(dset, h5py.Group):
+            _stitch_group(shards, names, out_file, sub, written)
+            continue
+
+        if dset.id in written:
+            out_file[sub] = out_file[written[dset.id]]
+            continue
+        written[dset.id] = sub
+
+        parts = [shard[sub] for shard in shards]
+        if dset.maxshape[:1] != (None,):
+            if not all(np.array_equal(part[()], dset[()]) and
+                       part.attrs.keys() == dset.attrs.keys() and
+                       all(np.array_equal(part.attrs[key], val)
+                           for key, val in dset.attrs.items()) for part in parts):
+                raise ValueError(f"Time-independent {sub} differs between shards")
+            out_file.copy(dset, sub)
+            continue
+
+        if any(part.shape[1:] != dset.shape[1:] or part.dtype != dset.dtype for part in parts):
+            raise ValueError(f"Frames of {sub} differ in shape or type between shards")
+
+        layout = h5py.VirtualLayout((sum(part.shape[0] for part in parts), *dset.shape[1:]),
+                                    dset.dtype)
+        n_frames = 0
+        for part, shard in zip(parts, names):
+            if part.shape[0]:
+                layout[n_frames:n_frames + part.shape[0]] = h5py.VirtualSource(
+                    shard, sub, shape=part.shape)
+            n_frames += part.shape[0]
+        out_file.create_virtual_dataset(sub, layout).attrs.update(dset.attrs)
+
+
+def stitch_shards(shards: Iterable[Path | str], out_path: Path | str):
+    """
+    Join h5md files holding consecutive frames into one trajectory.
+
+    Time-dependent datasets of `out_path` are HDF5 virtual datasets mapping
+    the frames of each shard in turn, so no frame data is copied and the
+    shards must be kept. They are referred to relative to `out_path`, so
+    may be moved along with it. Time-independent datasets are copied from
+    the first shard.
+
+    Parameters
+    ----------
+    shards : Iterable[Path or str]
+        HDF5 h5md files in order of their frames, with the same groups and
+        atoms, storing step and time per frame.
+    out_path : Path or str
+        File to write.
+
+    Raises
+    ------
+    ValueError
+        Shards do not match.
+    """
+    out_path = Path(out_path)
+    shards = [Path(shard) for shard in shards]
+    names = [os.path.relpath(shard, out_path.parent) for shard in shards]
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(h5py.File(shard, "r")) for shard in shards]
+        out_file = stack.enter_context(h5py.File(out_path, "w"))
+        _stitch_group(files, names, out_file, "/", {})
+
+
+def _format_summary(results: list[BatchResult]) -> str:
+    """
+    Summarise the outcome of a batch conversion.
+
+    Parameters
+    ----------
+    results : list[BatchResult]
+        Outcome of each conversion.
+
+    Returns
+    -------
+    str
+        Summary table with a line per file.
+    """
+    lines = []
+    for result in results:
+        if result.error is None:
+            lines.append(f"OK     {result.time:8.2f} s  {result.source} -> {result.output}")
+        else:
+            lines.append(f"FAILED {result.time:8.2f} s  {result.source}: {result.error}")
+
+    n_failed = sum(result.error is not None for result in results)
+    lines.append(f"{len(results) - n_failed} converted, {n_failed} failed "
+                 f"in {sum(result.time for result in results):.2f} s")
+    return "\n".join(lines)
 
 
 def cli():
@@ -196,22 +1514,154 @@ def cli():
 
        md_to_h5md -o my_file.h5md my_input.md
        md_to_h5md --author "Jacob Wilkins" --email "e.mail@email.org" -o my_file.h5md my_input.md
+       md_to_h5md --jobs 8 -o my_file.h5md my_input.md
+       md_to_h5md --compression gzip --compression-level 6 --shuffle -o my_file.h5md my_input.md
+       md_to_h5md --precision position=quantised:4,velocity=float32 -o my_file.h5md my_input.md
+       md_to_h5md --follow --timeout 3600 -o my_file.h5md running_job.md
+       md_to_h5md --append -o my_file.h5md restarted_job.md
+       md_to_h5md --stride 10 -o my_file.h5md my_input.md
+       md_to_h5md --start-time -5 -o last_5ps.h5md my_input.md
+       md_to_h5md --fields energies,temperature,pressure,stress -o thermo.h5md my_input.md
+       md_to_h5md --workers 16 -o "h5md/{stem}.h5md" runs/ "old_runs/*.md"
+       md_to_h5md --concatenate -o full.h5md run.md run_restart1.md run_restart2.md
+       md_to_h5md -o my_output.zarr my_input.md
+       md_to_h5md --profile convert.pstats -o my_file.h5md my_input.md
+       md_to_h5md --max-memory 2G --memory-report -o my_file.h5md my_input.md
     """
     arg_parser = argparse.ArgumentParser(
         prog="md_to_h5md",
         description="Convert a castep .md file to .h5md format.",
         epilog="See https://www.nongnu.org/h5md/ for more info on h5md.",
     )
-    arg_parser.add_argument("source", type=Path, help=".md file to parse")
-    arg_parser.add_argument("-o", "--output", help="File to write output.", required=True)
+    arg_parser.add_argument("source", nargs="+",
+                            help=".md files, directories of .md files or glob patterns to parse")
+    arg_parser.add_argument("-o", "--output", required=True,
+                            help="File to write output. For several sources, a template "
+                            "using {stem}, {name} or {parent} of each source.")
+    arg_parser.add_argument("-w", "--workers", type=int, default=1,
+                            help="Number of files to convert at once.")
+    arg_parser.add_argument("-b", "--backend", choices=("auto", *WRITERS), default="auto",
+                            help="Storage backend of output (default: zarr for outputs "
+                            "ending .zarr, else hdf5).")
+    arg_parser.add_argument("--concatenate", action="store_true",
+                            help="Join sources as restarts of one run into a single output, "
+                            "dropping repeated frames.")
+    arg_parser.add_argument("--shards", type=int, metavar="N",
+                            help="Convert a single source as N frame ranges at once, each to "
+                            "its own file, joined in OUTPUT by HDF5 virtual datasets.")
     arg_parser.add_argument("-a", "--author", type=str,
                             help="Author for metadata.", default="Unknown")
     arg_parser.add_argument("-e", "--email", type=str,
                             help="Email for metadata.", default="Unknown")
+    arg_parser.add_argument("-j", "--jobs", type=int,
+                            help="Number of processes to parse with.", default=1)
+    arg_parser.add_argument("--queue-blocks", type=int, default=DEFAULT_QUEUE_BLOCKS,
+                            help="Number of parsed blocks which may wait to be written "
+                            "(0 to parse and write in turn).")
+    arg_parser.add_argument("--chunk-frames", type=int, default=DEFAULT_CHUNK_FRAMES,
+                            help="Minimum number of frames per HDF5 chunk.")
+    arg_parser.add_argument("-c", "--compression", choices=("gzip", "lzf"),
+                            help="Compression filter for datasets.")
+    arg_parser.add_argument("--compression-level", type=int,
+                            help="Compression level for gzip (0-9).")
+    arg_parser.add_argument("--shuffle", action="store_true",
+                            help="Apply shuffle filter to improve compression.")
+    arg_parser.add_argument("--fletcher32", action="store_true",
+                            help="Store fletcher32 checksums of chunks.")
+    arg_parser.add_argument("-p", "--precision", type=_parse_precision, default="float64",
+                            help="Storage precision (float64, float32 or quantised:<decimals>) "
+                            "for all data, or as comma-separated group=precision pairs "
+                            f"for groups in {', '.join(PRECISION_GROUPS)}.")
+    arg_parser.add_argument("-f", "--follow", action="store_true",
+                            help="Keep converting frames as they are written to source.")
+    arg_parser.add_argument("--poll-interval", type=float, default=1.,
+                            help="Seconds between polls for new frames when following.")
+    arg_parser.add_argument("--timeout", type=float,
+                            help="Seconds without new frames after which to stop following.")
+    arg_parser.add_argument("--append", action="store_true",
+                            help="Convert only frames not already in an existing output.")
+    arg_parser.add_argument("--start", type=int,
+                            help="First frame to convert, negative counts from the end.")
+    arg_parser.add_argument("--stop", type=int,
+                            help="Frame to stop before, negative counts from the end.")
+    arg_parser.add_argument("--stride", type=int, default=1,
+                            help="Interval between converted frames.")
+    arg_parser.add_argument("--start-time", type=float,
+                            help="Time (ps) to start converting, negative counts from the end.")
+    arg_parser.add_argument("--stop-time", type=float,
+                            help="Time (ps) to stop converting, negative counts from the end.")
+    arg_parser.add_argument("--time-stride", type=float,
+                            help="Interval (ps) between converted frames.")
+    arg_parser.add_argument("--no-compact", action="store_false", dest="compact",
+                            help="Store steps, times and the box of every frame, even where "
+                            "they are at fixed intervals or constant.")
+    arg_parser.add_argument("--fields", type=_parse_fields,
+                            help="Comma-separated fields to convert from "
+                            f"{', '.join(FIELDS)} (default: all).")
+    arg_parser.add_argument("--max-memory", type=_parse_size, metavar="SIZE",
+                            help="Memory budget of each conversion in bytes, or with a "
+                            "K, M, G or T suffix (e.g. 2G).")
+    arg_parser.add_argument("--memory-report", action="store_true",
+                            help="Report peak memory of each stage of conversion.")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="Report time spent in each stage of conversion.")
+    arg_parser.add_argument("--profile-out", metavar="PSTATS",
+                            help="Dump cProfile stats of conversion to PSTATS "
+                            "(implies --profile).")
     arg_parser.add_argument("-V", "--version", action="version", version=f"%(prog)s v{__version__}")
     args = arg_parser.parse_args()
 
-    main(args.source, args.output, author=args.author, email=args.email)
+    try:
+        _check_checksums(args.precision, fletcher32=args.fletcher32)
+    except ValueError as err:
+        arg_parser.error(str(err))
+    if args.stride < 1:
+        arg_parser.error("--stride must be positive")
+    if args.time_stride is not None and args.time_stride <= 0:
+        arg_parser.error("--time-stride must be positive")
+
+    single = len(args.source) == 1 and Path(args.source[0]).is_file()
+    reports = args.profile or args.profile_out or args.memory_report
+    if reports and (args.concatenate or args.shards is not None or not single):
+        arg_parser.error("--profile, --profile-out and --memory-report require converting "
+                         "a single source file without --concatenate or --shards")
+
+    opts = {
+        "author": args.author, "email": args.email, "jobs": args.jobs,
+        "queue_blocks": args.queue_blocks,
+        "chunk_frames": args.chunk_frames, "compression": args.compression,
+        "compression_opts": args.compression_level, "shuffle": args.shuffle,
+        "fletcher32": args.fletcher32, "precision": args.precision, "follow": args.follow,
+        "poll_interval": args.poll_interval, "timeout": args.timeout, "append": args.append,
+        "start": args.start, "stop": args.stop, "stride": args.stride,
+        "start_time": args.start_time, "stop_time": args.stop_time,
+        "time_stride": args.time_stride, "fields": args.fields, "backend": args.backend,
+        "max_memory": args.max_memory, "compact": args.compact,
+    }
+
+    if args.concatenate:
+        concatenate(args.source, args.output, **opts)
+        return
+
+    if args.shards is not None:
+        if args.shards < 1:
+            arg_parser.error("--shards must be positive")
+        if len(args.source) != 1 or not Path(args.source[0]).is_file():
+            arg_parser.error("--shards requires a single source file")
+        convert_sharded(args.source[0], args.output, args.shards, **opts)
+        return
+
+    if single:
+        stats = main(Path(args.source[0]), args.output, track_memory=args.memory_report,
+                     profile_path=args.profile_out, **opts)
+        if reports:
+            print(stats.report(), file=sys.stderr)
+        return
+
+    results = main(args.source, args.output, workers=args.workers, **opts)
+    print(_format_summary(results))
+    if any(result.error is not None for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
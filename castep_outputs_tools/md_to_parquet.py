@@ -0,0 +1,332 @@
+"""
+Export observables of CASTEP .md files to Apache Parquet or Arrow.
+
+Each frame becomes one row holding the time and the scalar observables,
+with the 3x3 tensors flattened to one column per component, e.g.
+``stress_xy``. Only the observable lines of each frame are parsed.
+
+References
+----------
+.. [1] https://parquet.apache.org/
+.. [2] https://arrow.apache.org/
+"""
+from __future__ import annotations
+
+import argparse
+from functools import singledispatch
+from itertools import product
+from pathlib import Path
+from typing import BinaryIO, TextIO
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from castep_outputs_tools import __version__
+from castep_outputs_tools.md_parser import open_md
+from castep_outputs_tools.md_pipeline import (
+    AU_TIME_PS,
+    DEFAULT_BLOCK_FRAMES,
+    frame_index,
+    iter_blocks,
+    resolve_selection,
+)
+
+#: Default number of frames per Parquet row group or Arrow record batch.
+DEFAULT_ROW_GROUP_FRAMES = 16384
+
+#: Exported observables and the .md tag (and column) holding each.
+OBSERVABLES = {
+    "hamiltonian_energy": ("E", 0),
+    "potential_energy": ("E", 1),
+    "kinetic_energy": ("E", 2),
+    "temperature": ("T", None),
+    "pressure": ("P", None),
+    "stress": ("S", None),
+    "lattice_velocity": ("hv", None),
+}
+
+#: Output formats and the file name suffixes which select them.
+FORMATS = {
+    "parquet": (".parquet", ".pq"),
+    "arrow": (".arrow", ".feather", ".ipc"),
+}
+
+#: Parquet compression codecs.
+COMPRESSION = ("snappy", "zstd", "gzip", "lz4", "brotli", "none")
+
+#: .md tags holding 3x3 tensors.
+_TENSOR_TAGS = {"hv", "S"}
+
+#: Labels of the components of 3x3 tensors in row-major order.
+_COMPONENTS = tuple("".join(pair) for pair in product("xyz", repeat=2))
+
+
+def schema() -> pa.Schema:
+    """
+    Get the schema of exported observables.
+
+    Returns
+    -------
+    pa.Schema
+        Columns of ``step``, ``time`` (ps) and each observable in atomic
+        units, with units recorded in the field metadata.
+    """
+    fields = [pa.field("step", pa.int64()),
+              pa.field("time", pa.float64(), metadata={"unit": "ps"})]
+    for name, (tag, _) in OBSERVABLES.items():
+        names = [f"{name}_{comp}" for comp in _COMPONENTS] if tag in _TENSOR_TAGS else [name]
+        fields.extend(pa.field(col, pa.float64(), metadata={"unit": "atomic"}) for col in names)
+
+    return pa.schema(fields, metadata={"creator": "castep outputs", "version": __version__})
+
+
+def _block_table(block: dict[str, np.ndarray], table_schema: pa.Schema) -> pa.Table:
+    """
+    Convert a block of frames to a table of observables.
+
+    Parameters
+    ----------
+    block : dict[str, np.ndarray]
+        Frame data keyed by .md tag.
+    table_schema : pa.Schema
+        Schema of table (see :func:`schema`).
+
+    Returns
+    -------
+    pa.Table
+        One row per frame.
+    """
+    columns = [block["step"], block["time"] * AU_TIME_PS]
+    for tag, col in OBSERVABLES.values():
+        data = block[tag]
+        if col is not None:
+            columns.append(data[:, col])
+        elif data.ndim == 1:
+            columns.append(data)
+        else:
+            columns.extend(data.reshape(len(data), -1).T)
+
+    return pa.Table.from_arrays([pa.array(column) for column in columns], schema=table_schema)
+
+
+def _output_format(out_path: Path | str, fmt: str) -> str:
+    """
+    Get the format to write an output in.
+
+    Parameters
+    ----------
+    out_path : Path or str
+        File to write.
+    fmt : str
+        Key of :data:`FORMATS` or ``"auto"`` to choose by suffix.
+
+    Returns
+    -------
+    str
+        Key of :data:`FORMATS`.
+
+    Raises
+    ------
+    ValueError
+        Unknown format, or format cannot be chosen from suffix.
+    """
+    if fmt == "auto":
+        suffix = Path(out_path).suffix
+        fmt = next((key for key, suffixes in FORMATS.items() if suffix in suffixes), None)
+        if fmt is None:
+            raise ValueError(f"Cannot choose output format from suffix of {out_path} "
+                             f"(valid: {', '.join(sum(FORMATS.values(), ()))})")
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (valid: auto, {', '.join(FORMATS)})")
+    return fmt
+
+
+def md_to_parquet(
+        md_geom_file: TextIO | BinaryIO,
+        out_path: Path | str,
+        *,
+        fmt: str = "auto",
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        row_group_frames: int = DEFAULT_ROW_GROUP_FRAMES,
+        jobs: int = 1,
+        compression: str = "zstd",
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        start_time: float | None = None,
+        stop_time: float | None = None,
+        time_stride: float | None = None,
+) -> None:
+    """
+    Export the observables of an MD file to Parquet [1]_ or Arrow [2]_.
+
+    Frames are streamed from the input and row groups are written as soon
+    as they fill, so memory use is bounded by the row group size rather
+    than the trajectory length. Parquet row groups carry column statistics,
+    so readers can skip row groups which cannot match a filter.
+
+    Parameters
+    ----------
+    md_geom_file : TextIO or BinaryIO
+        File to parse.
+    out_path : Path or str
+        File to write.
+    fmt : str
+        Output format (key of :data:`FORMATS`), or ``"auto"`` to choose by
+        the suffix of `out_path`.
+    block_frames : int
+        Number of frames parsed at once.
+    row_group_frames : int
+        Number of frames per Parquet row group or Arrow record batch.
+    jobs : int
+        Number of processes to parse with.
+    compression : str
+        Compression codec (one of :data:`COMPRESSION`). Arrow output
+        supports only ``zstd``, ``lz4`` and ``none``.
+    start : int, optional
+        First frame to export, negative values count from the end.
+    stop : int, optional
+        Frame to stop before, defaults to the end of the file, negative
+        values count from the end.
+    stride : int
+        Interval between exported frames.
+    start_time, stop_time : float, optional
+        Time range (ps) to export, negative values count back from the last
+        frame. Cannot be combined with `start`, `stop` or `stride`.
+    time_stride : float, optional
+        Interval (ps) between exported frames.
+
+    Raises
+    ------
+    ValueError
+        Output format is invalid or the frame selection cannot be resolved
+        (see :func:`~castep_outputs_tools.md_pipeline.resolve_selection`).
+    """
+    fmt = _output_format(out_path, fmt)
+    table_schema = schema()
+    codec = None if compression == "none" else compression
+    tags = {tag for tag, _ in OBSERVABLES.values()}
+
+    selection = {"start": start, "stop": stop, "stride": stride, "start_time": start_time,
+                 "stop_time": stop_time, "time_stride": time_stride}
+    selected = stride != 1 or any(val is not None for key, val in selection.items()
+                                  if key != "stride")
+    offsets = frame_index(md_geom_file) if selected else None
+    start, stop, stride = resolve_selection(md_geom_file, offsets, **selection)
+
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(out_path, table_schema, compression=codec or "none")
+    else:
+        writer = pa.ipc.new_file(str(out_path), table_schema,
+                                 options=pa.ipc.IpcWriteOptions(compression=codec))
+
+    pending = []
+    n_pending = 0
+    with writer:
+        for block in iter_blocks(md_geom_file, block_frames, jobs,
+                                 start=start, stop=stop, stride=stride, tags=tags):
+            pending.append(_block_table(block, table_schema))
+            n_pending += len(block["time"])
+
+            while n_pending >= row_group_frames:
+                table = pa.concat_tables(pending)
+                writer.write_table(table.slice(0, row_group_frames), row_group_frames)
+                pending = [table.slice(row_group_frames)]
+                n_pending -= row_group_frames
+
+        if n_pending:
+            writer.write_table(pa.concat_tables(pending), row_group_frames)
+
+
+@singledispatch
+def main(source, output, **opts):
+    """
+    Export the observables of an MD file to Parquet or Arrow.
+
+    Parameters
+    ----------
+    source : str or Path or TextIO
+        File to parse.
+    output : str or Path
+        File to write.
+    **opts : dict
+        Options passed to :func:`md_to_parquet`.
+
+    Raises
+    ------
+    NotImplementedError
+        Invalid types passed.
+    """
+    raise NotImplementedError(f"Unable to export {type(source).__name__} to parquet")
+
+@main.register(str)
+def _(source, output: Path | str, **opts):
+    main(Path(source), output, **opts)
+
+@main.register(Path)
+def _(source, output: Path | str, **opts):
+    with open_md(source) as in_file:
+        md_to_parquet(in_file, output, **opts)
+
+@main.register(TextIO)
+def _(source, output: Path | str, **opts):
+    md_to_parquet(source, output, **opts)
+
+
+def cli():
+    """
+    Run md_to_parquet through command line.
+
+    Examples
+    --------
+    .. code-block:: sh
+
+       md_to_parquet -o thermo.parquet my_input.md
+       md_to_parquet --jobs 8 --row-group-frames 65536 -o thermo.parquet my_input.md.gz
+       md_to_parquet --compression lz4 -o thermo.arrow my_input.md
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog="md_to_parquet",
+        description="Export observables of a castep .md file to Parquet or Arrow format.",
+    )
+    arg_parser.add_argument("source", type=Path, help=".md file to parse")
+    arg_parser.add_argument("-o", "--output", required=True,
+                            help="File to write output (.parquet or .arrow).")
+    arg_parser.add_argument("-f", "--format", dest="fmt", choices=("auto", *FORMATS),
+                            default="auto", help="Output format (default: from suffix).")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="Number of processes to parse with.")
+    arg_parser.add_argument("--row-group-frames", type=int, default=DEFAULT_ROW_GROUP_FRAMES,
+                            help="Frames per Parquet row group or Arrow record batch.")
+    arg_parser.add_argument("-c", "--compression", choices=COMPRESSION, default="zstd",
+                            help="Compression codec.")
+    arg_parser.add_argument("--start", type=int,
+                            help="First frame to export, negative counts from the end.")
+    arg_parser.add_argument("--stop", type=int,
+                            help="Frame to stop before, negative counts from the end.")
+    arg_parser.add_argument("--stride", type=int, default=1,
+                            help="Interval between exported frames.")
+    arg_parser.add_argument("--start-time", type=float,
+                            help="Time (ps) to start exporting, negative counts from the end.")
+    arg_parser.add_argument("--stop-time", type=float,
+                            help="Time (ps) to stop exporting, negative counts from the end.")
+    arg_parser.add_argument("--time-stride", type=float,
+                            help="Interval (ps) between exported frames.")
+    arg_parser.add_argument("-V", "--version", action="version", version=f"%(prog)s v{__version__}")
+
+    args = arg_parser.parse_args()
+    if args.stride < 1:
+        arg_parser.error("--stride must be positive")
+    if args.time_stride is not None and args.time_stride <= 0:
+        arg_parser.error("--time-stride must be positive")
+
+    main(args.source, args.output, fmt=args.fmt, jobs=args.jobs,
+         row_group_frames=args.row_group_frames, compression=args.compression,
+         start=args.start, stop=args.stop, stride=args.stride, start_time=args.start_time,
+         stop_time=args.stop_time, time_stride=args.time_stride)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,360 @@
+"""
+Instrumentation of conversion pipelines.
+
+Conversions record the wall time and peak memory of each stage, the data
+read and written and the calls made to their output in a
+:class:`ConversionStats`.
+"""
+from __future__ import annotations
+
+import cProfile
+import mmap
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TypeVar
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from castep_outputs_tools.h5md_writers import H5MDWriter
+
+T = TypeVar("T")
+
+#: Bytes per unit of ``ru_maxrss``, which is reported in kB except on macOS.
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss() -> int | None:
+    """
+    Get the high-water mark of the resident set size of this process.
+
+    Returns
+    -------
+    int or None
+        Peak RSS in bytes, or ``None`` where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def current_rss() -> int | None:
+    """
+    Get the resident set size of this process.
+
+    Returns
+    -------
+    int or None
+        RSS in bytes, or the peak RSS where the current RSS cannot be
+        measured.
+    """
+    try:
+        return int(Path("/proc/self/statm").read_text().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+@dataclass
+class ConversionStats:
+    """
+    Timings and counts of a conversion.
+
+    Parameters
+    ----------
+    stages : dict[str, float]
+        Wall time in seconds spent in each stage.
+    frames : int
+        Number of frames written.
+    bytes_read : int
+        Number of bytes of .md data read.
+    bytes_written : int
+        Number of bytes of (uncompressed) data written.
+    calls : Counter
+        Number of calls of each output method.
+    traced_peak : dict[str, int]
+        Peak memory in bytes allocated by Python while in each stage,
+        recorded while :mod:`tracemalloc` is tracing.
+    rss_peak : dict[str, int]
+        High-water mark of the resident set size of the process in bytes
+        at the end of each stage.
+    """
+
+    stages: dict[str, float] = field(default_factory=dict)
+    frames: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    calls: Counter = field(default_factory=Counter)
+    traced_peak: dict[str, int] = field(default_factory=dict)
+    rss_peak: dict[str, int] = field(default_factory=dict)
+    _open: list[str] = field(default_factory=list, repr=False)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a stage, adding to any previous time spent in it.
+
+        Memory peaks are recorded alongside, and stages may be nested.
+
+        Parameters
+        ----------
+        name : str
+            Name of stage.
+        """
+        self._update_peaks()
+        self._open.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.) + time.perf_counter() - start
+            self._update_peaks()
+            self._open.pop()
+            rss = peak_rss()
+            if rss is not None:
+                self.rss_peak[name] = rss
+
+    def _update_peaks(self):
+        """Fold the traced peak since the last update into each open stage."""
+        if not tracemalloc.is_tracing():
+            return
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for name in self._open:
+            self.traced_peak[name] = max(self.traced_peak.get(name, 0), peak)
+        if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+            tracemalloc.reset_peak()
+
+    def timed(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """
+        Time a stage producing items, excluding time spent consuming them.
+
+        Parameters
+        ----------
+        name : str
+            Name of stage.
+        items : Iterable
+            Items produced by stage.
+
+        Yields
+        ------
+        Any
+            Each item.
+        """
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                item = next(items, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def count_bytes(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Count the bytes read as chunks are produced.
+
+        Parameters
+        ----------
+        chunks : Iterable[bytes]
+            Raw data read.
+
+        Yields
+        ------
+        bytes
+            Each chunk.
+        """
+        for chunk in chunks:
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    @property
+    def total(self) -> float:
+        """Total wall time in seconds."""
+        return self.stages.get("total", sum(self.stages.values()))
+
+    @property
+    def frames_per_s(self) -> float:
+        """Frames converted per second of total time."""
+        return self.frames / self.total if self.total else 0.
+
+    @property
+    def read_mb_per_s(self) -> float:
+        """MB of .md data read per second of total time."""
+        return self.bytes_read / 1e6 / self.total if self.total else 0.
+
+    def report(self) -> str:
+        """
+        Summarise the stats.
+
+        Returns
+        -------
+        str
+            Table of stage times and memory peaks followed by throughput
+            and call counts.
+        """
+        def memory(name: str) -> str:
+            return "".join(f"{peaks[name] / 1e6:>14.1f}" if name in peaks else f"{'-':>14}"
+                           for peaks in (self.traced_peak, self.rss_peak) if peaks)
+
+        heads = [head for head, peaks in (("Traced (MB)", self.traced_peak),
+                                          ("RSS peak (MB)", self.rss_peak)) if peaks]
+        lines = [f"{'Stage':<12}{'Time (s)':>10}{'Share':>8}" + "".join(f"{head:>14}"
+                                                                      for head in heads)]
+        lines += [f"{name:<12}{wall:>10.3f}{wall / self.total:>8.1%}{memory(name)}"
+                  for name, wall in self.stages.items() if name != "total" and self.total]
+        lines += [f"{'total':<12}{self.total:>10.3f}{'':>8}{memory('total')}",
+                  f"Frames:  {self.frames} ({self.frames_per_s:.1f} frames/s)",
+                  f"Read:    {self.bytes_read / 1e6:.2f} MB ({self.read_mb_per_s:.2f} MB/s)",
+                  f"Written: {self.bytes_written / 1e6:.2f} MB"]
+        if self.calls:
+            lines.append("Output calls: " + ", ".join(f"{name} {count}" for name, count
+                                                      in self.calls.most_common()))
+        return "\n".join(lines)
+
+
+class ProfiledWriter(H5MDWriter):
+    """
+    Writer counting the calls made to another and the data written.
+
+    Parameters
+    ----------
+    writer : H5MDWriter
+        Writer to wrap.
+    stats : ConversionStats
+        Stats to record to.
+    """
+
+    def __init__(self, writer: H5MDWriter, stats: ConversionStats):
+        self._writer = writer
+        self._stats = stats
+
+    def __getattr__(self, name: str) -> Any:
+        """Get attributes of the wrapped writer."""
+        return getattr(self._writer, name)
+
+    def _call(self, name: str, *args, **kwargs) -> Any:
+        """
+        Call a method of the wrapped writer, counting the call.
+
+        Parameters
+        ----------
+        name : str
+            Method to call.
+        *args, **kwargs
+            Arguments of method.
+
+        Returns
+        -------
+        Any
+            Result of call.
+        """
+        self._stats.calls[name] += 1
+        return getattr(self._writer, name)(*args, **kwargs)
+
+    def __contains__(self, path: str) -> bool:
+        """Whether a group or dataset exists."""
+        return self._call("__contains__", path)
+
+    def __getitem__(self, path: str) -> Any:
+        """Get a dataset for reading."""
+        return self._call("__getitem__", path)
+
+    def create_group(self, path: str, attrs: dict | None = None):
+        """Create a group, and any missing parents."""
+        self._call("create_group", path, attrs)
+
+    def create_dataset(self, path: str, data: np.ndarray, *, enum: dict[str, int] | None = None,
+                       attrs: dict | None = None):
+        """Create a fixed dataset."""
+        self._stats.bytes_written += np.asarray(data).nbytes
+        self._call("create_dataset", path, data, enum=enum, attrs=attrs)
+
+    def create_series(self, path: str, shape: tuple[int, ...], dtype: type,
+                      chunks: tuple[int, ...], attrs: dict | None = None, **filters):
+        """Create a dataset resizable along its first axis."""
+        self._call("create_series", path, shape, dtype, chunks, attrs, **filters)
+
+    def link(self, source: str, path: str):
+        """Make `path` refer to the existing dataset `source`."""
+        self._call("link", source, path)
+
+    def delete(self, path: str):
+        """Remove a dataset, or one name of a linked dataset."""
+        self._call("delete", path)
+
+    def resize(self, path: str, length: int):
+        """Resize a series along its first axis."""
+        self._call("resize", path, length)
+
+    def write(self, path: str, start: int, data: np.ndarray):
+        """Write consecutive entries of a series."""
+        self._stats.bytes_written += np.asarray(data).nbytes
+        self._call("write", path, start, data)
+
+    def enable_concurrent_reads(self):
+        """Allow the output to be read while writing continues."""
+        self._call("enable_concurrent_reads")
+
+    def flush(self):
+        """Make written data visible to readers."""
+        self._call("flush")
+
+    def close(self):
+        """Close the output."""
+        self._call("close")
+
+
+@contextmanager
+def trace_memory(*, enabled: bool = True) -> Iterator[None]:
+    """
+    Trace memory allocated by Python with :mod:`tracemalloc` in a block of code.
+
+    Tracing slows allocation down, so is off unless requested. If tracing
+    is already on, it is left on.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether to trace.
+    """
+    if not enabled or tracemalloc.is_tracing():
+        yield
+        return
+
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def profile(path: Path | str | None = None) -> Iterator[None]:
+    """
+    Profile a block of code with :mod:`cProfile`.
+
+    Parameters
+    ----------
+    path : Path or str, optional
+        File to dump :mod:`pstats` data to. If not given, nothing is profiled.
+    """
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,266 @@
+"""
+Read CASTEP .md files into NumPy arrays.
+
+Frames are parsed by the same fast path as
+:func:`~castep_outputs_tools.md_to_h5md.md_to_h5md` and gathered into
+contiguous arrays with a leading frame axis, without writing to disk or
+building the per-atom dicts of ``parse_md_geom_file``. All values are in
+the atomic units of the .md file.
+
+Examples
+--------
+>>> traj = read_md_arrays("my_input.md", fields=["positions", "temperature"])
+>>> traj.positions.shape
+(1000, 64, 3)
+"""
+from __future__ import annotations
+
+import dataclasses
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, TextIO
+
+import numpy as np
+
+from castep_outputs_tools.md_parser import open_md
+from castep_outputs_tools.md_pipeline import (
+    AU_TIME_PS,
+    DEFAULT_BLOCK_FRAMES,
+    TAG_SHAPES,
+    frame_index,
+    iter_blocks,
+    resolve_selection,
+)
+
+#: Per-frame arrays of a trajectory and the .md tag (and column) holding each.
+ARRAYS = {
+    "positions": ("R", None),
+    "velocities": ("V", None),
+    "forces": ("F", None),
+    "cells": ("h", None),
+    "cell_velocities": ("hv", None),
+    "stress": ("S", None),
+    "hamiltonian_energy": ("E", 0),
+    "potential_energy": ("E", 1),
+    "kinetic_energy": ("E", 2),
+    "temperature": ("T", None),
+    "pressure": ("P", None),
+}
+
+
+@dataclass
+class Trajectory:
+    """
+    Frames of an MD trajectory as arrays with a leading frame axis.
+
+    Arrays which were not read are ``None``.
+
+    Parameters
+    ----------
+    species : np.ndarray
+        Species of each atom, shape ``(n_atoms,)``.
+    step : np.ndarray
+        Step of each frame (counting from 1).
+    time : np.ndarray
+        Time of each frame.
+    positions, velocities, forces : np.ndarray, optional
+        Per-atom vectors, shape ``(n_frames, n_atoms, 3)``.
+    cells, cell_velocities, stress : np.ndarray, optional
+        Lattice vectors (as rows), their velocities and the stress tensor,
+        shape ``(n_frames, 3, 3)``.
+    hamiltonian_energy, potential_energy, kinetic_energy : np.ndarray, optional
+        Energies, shape ``(n_frames,)``.
+    temperature, pressure : np.ndarray, optional
+        Observables, shape ``(n_frames,)``.
+    """
+
+    species: np.ndarray
+    step: np.ndarray
+    time: np.ndarray
+    positions: np.ndarray | None = None
+    velocities: np.ndarray | None = None
+    forces: np.ndarray | None = None
+    cells: np.ndarray | None = None
+    cell_velocities: np.ndarray | None = None
+    stress: np.ndarray | None = None
+    hamiltonian_energy: np.ndarray | None = None
+    potential_energy: np.ndarray | None = None
+    kinetic_energy: np.ndarray | None = None
+    temperature: np.ndarray | None = None
+    pressure: np.ndarray | None = None
+
+    @property
+    def n_frames(self) -> int:
+        """Number of frames."""
+        return len(self.time)
+
+    @property
+    def n_atoms(self) -> int:
+        """Number of atoms."""
+        return len(self.species)
+
+    @property
+    def time_ps(self) -> np.ndarray:
+        """Time of each frame in ps."""
+        return self.time * AU_TIME_PS
+
+    def __len__(self) -> int:
+        """Get the number of frames."""
+        return self.n_frames
+
+    def __getitem__(self, index: int | slice | np.ndarray) -> Trajectory:
+        """
+        Select frames.
+
+        Parameters
+        ----------
+        index : int or slice or np.ndarray
+            Index, slice or mask of frames.
+
+        Returns
+        -------
+        Trajectory
+            Selected frames, sharing memory with this trajectory for slices.
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+
+        return dataclasses.replace(self, **{
+            field.name: val[index] for field in dataclasses.fields(self)
+            if field.name != "species" and (val := getattr(self, field.name)) is not None
+        })
+
+
+def _parse_arrays(fields: Iterable[str] | None) -> tuple[str, ...]:
+    """
+    Get the arrays selected for reading.
+
+    Parameters
+    ----------
+    fields : Iterable[str] or None
+        Keys of :data:`ARRAYS`, ``None`` selects all arrays.
+
+    Returns
+    -------
+    tuple[str, ...]
+        Selected arrays.
+
+    Raises
+    ------
+    ValueError
+        Unknown array.
+    """
+    if fields is None:
+        return tuple(ARRAYS)
+
+    fields = tuple(fields)
+    if unknown := set(fields) - set(ARRAYS):
+        raise ValueError(f"Unknown arrays {', '.join(sorted(unknown))} "
+                         f"(valid: {', '.join(ARRAYS)})")
+    return fields
+
+
+def read_md_arrays(
+        source: Path | str | TextIO | BinaryIO,
+        *,
+        fields: Iterable[str] | None = None,
+        start: int | None = None,
+        stop: int | None = None,
+        stride: int = 1,
+        start_time: float | None = None,
+        stop_time: float | None = None,
+        time_stride: float | None = None,
+        block_frames: int = DEFAULT_BLOCK_FRAMES,
+        jobs: int = 1,
+        cache_index: bool = False,
+) -> Trajectory:
+    """
+    Read an MD file into a :class:`Trajectory`.
+
+    Where `source` can be indexed (an uncompressed file on disk), each array
+    is allocated once at its final size and filled in place as blocks are
+    parsed. Otherwise blocks are joined once all have been read.
+
+    Parameters
+    ----------
+    source : Path or str or TextIO or BinaryIO
+        File to read, which may be compressed if given as a path.
+    fields : Iterable[str], optional
+        Arrays to read (keys of :data:`ARRAYS`), by default all. Lines of
+        other arrays are not parsed.
+    start, stop : int, optional
+        Range of frames to read, negative values count from the end.
+    stride : int
+        Interval between frames read.
+    start_time, stop_time : float, optional
+        Range of times to read in ps, negative values count back from the
+        last frame.
+    time_stride : float, optional
+        Interval between frames read in ps.
+    block_frames : int
+        Number of frames parsed at once.
+    jobs : int
+        Number of processes to parse with.
+    cache_index : bool
+        Whether to reuse and save the frame index in a sidecar next to
+        `source` (see :func:`~castep_outputs_tools.md_parser.frame_offsets`).
+        By default the index is rebuilt and nothing is written alongside
+        `source`.
+
+    Returns
+    -------
+    Trajectory
+        Selected frames.
+    """
+    if isinstance(source, (str, Path)):
+        with open_md(source) as md_file:
+            return read_md_arrays(md_file, fields=fields, start=start, stop=stop, stride=stride,
+                                  start_time=start_time, stop_time=stop_time,
+                                  time_stride=time_stride, block_frames=block_frames, jobs=jobs,
+                                  cache_index=cache_index)
+
+    fields = _parse_arrays(fields)
+
+    offsets = frame_index(source, cache=cache_index)
+    start, stop, stride = resolve_selection(source, offsets, start, stop, stride,
+                                            start_time=start_time, stop_time=stop_time,
+                                            time_stride=time_stride)
+    n_frames = None
+    if offsets is not None:
+        n_frames = len(range(start, len(offsets) if stop is None else stop, stride))
+
+    species = np.array([], dtype=str)
+    arrays = {}
+    n_read = 0
+    for block in iter_blocks(source, block_frames, jobs, offsets=offsets, start=start,
+                             stop=stop, stride=stride,
+                             tags={ARRAYS[field][0] for field in fields}):
+        species = np.array(block["species"])
+        data = {"step": block["step"], "time": block["time"]}
+        for field in fields:
+            tag, col = ARRAYS[field]
+            data[field] = block[tag] if col is None else block[tag][:, col]
+
+        n_block = len(block["time"])
+        if n_frames is None:
+            for key, val in data.items():
+                arrays.setdefault(key, []).append(val)
+        else:
+            for key, val in data.items():
+                if key not in arrays:
+                    arrays[key] = np.empty((n_frames, *val.shape[1:]), dtype=val.dtype)
+                arrays[key][n_read:n_read + n_block] = val
+        n_read += n_block
+
+    if n_frames is None:
+        arrays = {key: np.concatenate(val) for key, val in arrays.items()}
+    else:
+        arrays = {key: val[:n_read] for key, val in arrays.items()}
+
+    if not n_read:
+        arrays = {"step": np.empty(0, dtype=int), "time": np.empty(0)}
+        arrays.update((field, np.empty((0, *(dim or 0 for dim in TAG_SHAPES[ARRAYS[field][0]]))))
+                      for field in fields)
+
+    return Trajectory(species=species, **arrays)
@@ -0,0 +1,77 @@
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+import numpy as np
+
+from castep_outputs_tools.h5md_to_md import format_values, h5md_to_md
+from castep_outputs_tools.md_to_h5md import main as conv
+
+
+class test_h5md_to_md(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_round_trip(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.h5md"
+            conv(self.FILE, out_path)
+
+            md_file = BytesIO()
+            self.assertEqual(h5md_to_md(out_path, md_file), 2)
+            self.assertEqual(md_file.getvalue(), self.FILE.read_bytes())
+
+            md_file = BytesIO()
+            self.assertEqual(h5md_to_md(out_path, md_file, start=-1), 1)
+            self.assertEqual(md_file.getvalue().count(b"<-- T"), 1)
+
+            with self.assertRaises(ValueError):
+                h5md_to_md(out_path, BytesIO(), stride=0)
+
+    def test_species_round_trip(self):
+        text = self.FILE.read_text()
+        for index in range(5, 9):
+            text = text.replace(f" Si              {index}  ", f" O               {index - 4}  ")
+
+        with TemporaryDirectory() as tmp:
+            md_path = Path(tmp) / "sio.md"
+            md_path.write_text(text)
+            out_path = Path(tmp) / "sio.h5md"
+            conv(md_path, out_path)
+
+            md_file = BytesIO()
+            h5md_to_md(out_path, md_file)
+            self.assertEqual(md_file.getvalue(), md_path.read_bytes())
+
+    def test_missing_fields(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.h5md"
+            conv(self.FILE, out_path, fields=["position", "energies", "temperature"])
+
+            md_file = BytesIO()
+            h5md_to_md(out_path, md_file)
+        expected = [line for line in self.FILE.read_bytes().splitlines(keepends=True)
+                    if not line.rstrip().endswith((b"<-- P", b"<-- h", b"<-- hv", b"<-- S",
+                                                   b"<-- V", b"<-- F"))]
+        self.assertEqual(md_file.getvalue(), b"".join(expected))
+
+    def test_format_values(self):
+        values = np.array([0., -0., 1e-5, -31.438056609022318, 9.9999999999999999e22,
+                           1e-300, np.nan, -np.inf])
+        expected = [b"0.0000000000000000E+000", b"-0.0000000000000000E+000",
+                    b"1.0000000000000001E-005", b"-3.1438056609022318E+001",
+                    b"9.9999999999999992E+022", b"1.0000000000000000E-300",
+                    b"NaN", b"-Infinity"]
+
+        formatted = format_values(values).view("S27").ravel()
+        self.assertEqual([num.strip() for num in formatted], expected)
+        self.assertTrue(all(len(num) == 27 for num in formatted))
+
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=1000) * 10. ** rng.integers(-20, 20, 1000)
+        formatted = format_values(values).view("S27").ravel()
+        np.testing.assert_array_equal(formatted.astype(float), values)
+
+
+if __name__ == "main":
+    main()
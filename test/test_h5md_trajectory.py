@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+import numpy as np
+
+from castep_outputs_tools import H5MDTrajectory, read_md_arrays
+from castep_outputs_tools.md_to_h5md import main as conv
+
+
+class test_h5md_trajectory(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_read(self):
+        expected = read_md_arrays(self.FILE)
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.h5md"
+            conv(self.FILE, out_path)
+
+            with H5MDTrajectory(out_path) as traj:
+                self.assertEqual((len(traj), traj.n_atoms), (2, 8))
+                self.assertEqual(list(traj.species), ["Si"] * 8)
+
+                frame = traj[-1]
+                self.assertEqual(frame["step"], 2)
+                np.testing.assert_array_equal(frame["positions"], expected.positions[1])
+
+                sliced = traj[::-1]
+                np.testing.assert_array_equal(sliced.forces, expected.forces[::-1])
+                np.testing.assert_array_equal(sliced.temperature, expected.temperature[::-1])
+
+                steps = [frame["step"] for frame in traj]
+                self.assertEqual(steps, [1, 2])
+
+                with self.assertRaises(IndexError):
+                    traj[2]
+
+    def test_cache(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.h5md"
+            conv(self.FILE, out_path)
+            with H5MDTrajectory(out_path, fields=["temperature"], cache_bytes=0) as traj:
+                self.assertAlmostEqual(traj[1]["temperature"], 2.0043929124486039E-003)
+                self.assertIsNone(traj[0:2].positions)
+                traj[0]
+                info = traj.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 2)
+        self.assertEqual(info.max_blocks, 2)
+
+    def test_concurrent_reads(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.h5md"
+            conv(self.FILE, out_path)
+            with H5MDTrajectory(out_path) as traj:
+                read_block = traj._read_block
+                calls = []
+
+                def slow_read(block):
+                    calls.append(block)
+                    time.sleep(0.05)
+                    return read_block(block)
+
+                traj._read_block = slow_read
+                with ThreadPoolExecutor(4) as pool:
+                    steps = list(pool.map(lambda _: traj[1]["step"], range(4)))
+                info = traj.cache_info()
+        self.assertEqual(steps, [2] * 4)
+        self.assertEqual(calls, [0])
+        self.assertEqual((info.misses, info.hits), (1, 3))
+
+if __name__ == "main":
+    main()
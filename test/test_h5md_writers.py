@@ -0,0 +1,57 @@
+import importlib.util
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipUnless
+
+import h5py
+import numpy as np
+
+from castep_outputs_tools.h5md_layout import read_series
+from castep_outputs_tools.h5md_writers import HDF5Writer, ZarrWriter, open_writer
+from castep_outputs_tools.md_to_h5md import main as conv
+
+HAS_ZARR = importlib.util.find_spec("zarr") is not None
+
+
+class test_h5md_writers(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_backend_choice(self):
+        with TemporaryDirectory() as tmp:
+            with open_writer(Path(tmp) / "out.h5md") as out_file:
+                self.assertIsInstance(out_file, HDF5Writer)
+            with self.assertRaises(ValueError):
+                open_writer(Path(tmp) / "out.h5md", "netcdf")
+
+    def test_link(self):
+        with TemporaryDirectory() as tmp, open_writer(Path(tmp) / "out.h5md") as out_file:
+            out_file.create_series("a/step", (0,), int, (4,))
+            out_file.link("a/step", "b/step")
+            out_file.resize("a/step", 3)
+            out_file.write("a/step", 0, np.arange(3))
+            self.assertEqual(list(out_file["b/step"][:]), [0, 1, 2])
+
+    @skipUnless(HAS_ZARR, "zarr not installed")
+    def test_zarr(self):
+        import zarr
+
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            conv(self.FILE, tmp / "out.h5md")
+            conv(self.FILE, tmp / "out.zarr", precision="position=quantised:3")
+
+            with open_writer(tmp / "out.zarr", append=True) as out_file:
+                self.assertIsInstance(out_file, ZarrWriter)
+
+            store = zarr.open_group(tmp / "out.zarr", mode="r")
+            with h5py.File(tmp / "out.h5md") as out_file:
+                self.assertEqual(list(read_series(store, "observables/pressure/step")[:]), [1, 2])
+                np.testing.assert_allclose(store["particles/velocity/value"][:],
+                                           out_file["particles/velocity/value"][:])
+                np.testing.assert_allclose(store["particles/position/value"][:],
+                                           out_file["particles/position/value"][:], atol=5e-4)
+            self.assertEqual(store["h5md"].attrs["version"], [1, 1])
+            self.assertEqual(store["particles/species"].attrs["enum"], {"Si": 0})
+
+if __name__ == "main":
+    main()
@@ -0,0 +1,148 @@
+import bz2
+import gzip
+import io
+import lzma
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+import numpy as np
+
+from castep_outputs_tools.md_parser import (
+    IrregularLayoutError,
+    detect_compression,
+    frame_offsets,
+    frame_times,
+    index_path,
+    iter_chunks,
+    iter_indexed_chunks,
+    open_md,
+    parse_frames,
+    read_header,
+)
+
+
+class test_md_parser(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_chunks(self):
+        with self.FILE.open("rb") as in_file:
+            self.assertIn(b"END header", read_header(in_file))
+            chunks = list(iter_chunks(in_file, 1))
+        self.assertEqual(len(chunks), 2)
+
+    def test_follow_chunks(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            chunks = list(iter_chunks(in_file, 5, follow=True, poll_interval=0.01, timeout=0.))
+        self.assertEqual(len(parse_frames(b"".join(chunks))["time"]), 2)
+
+    def test_skip(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            chunk, = iter_chunks(in_file, 5, start=1, stride=2)
+        self.assertAlmostEqual(parse_frames(chunk)["time"][0], 8.2682746688379041E+001)
+
+    def test_block_bytes(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            chunks = list(iter_chunks(in_file, 5, block_bytes=1))
+        self.assertEqual(len(chunks), 2)
+
+    def test_parse(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            parsed = parse_frames(in_file.read())
+
+        self.assertEqual(parsed["species"], ["Si"] * 8)
+        self.assertEqual(parsed["R"].shape, (2, 8, 3))
+        self.assertEqual(parsed["E"].shape, (2, 3))
+        self.assertEqual(parsed["T"].shape, (2,))
+        self.assertEqual(parsed["h"].shape, (2, 3, 3))
+        self.assertAlmostEqual(parsed["time"][1], 8.2682746688379041E+001)
+        self.assertAlmostEqual(parsed["E"][0, 2], 2.5277616819407205E-002)
+        self.assertAlmostEqual(parsed["F"][1, 7, 2], 7.0266151009685572E-003)
+
+    def test_parse_tags(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            parsed = parse_frames(in_file.read(), tags={"T"})
+
+        self.assertEqual(set(parsed), {"time", "T", "species"})
+        self.assertEqual(parsed["species"], ["Si"] * 8)
+
+    def test_irregular(self):
+        with self.FILE.open("rb") as in_file:
+            read_header(in_file)
+            data = in_file.read().replace(b"<-- hv", b"<-- h ")
+
+        with self.assertRaises(IrregularLayoutError):
+            parse_frames(data)
+
+    def test_frame_offsets(self):
+        with TemporaryDirectory() as tmp_dir:
+            md_path = Path(tmp_dir) / "test.md"
+            shutil.copy(self.FILE, md_path)
+
+            offsets = frame_offsets(md_path)
+            self.assertEqual(len(offsets), 2)
+            self.assertTrue(index_path(md_path).is_file())
+            self.assertEqual(list(frame_offsets(md_path)), list(offsets))
+
+            sidecar = index_path(md_path)
+            full = sidecar.read_bytes()
+            for damaged in (full[:len(full) // 2], b""):
+                sidecar.write_bytes(damaged)
+                self.assertEqual(list(frame_offsets(md_path)), list(offsets))
+                with np.load(sidecar) as index:
+                    self.assertEqual(list(index["offsets"]), list(offsets))
+            self.assertEqual(sorted(path.name for path in Path(tmp_dir).iterdir()),
+                             ["test.md", sidecar.name])
+
+            with md_path.open("rb") as in_file:
+                chunk, = iter_indexed_chunks(in_file, offsets, 1, start=1)
+                times = frame_times(in_file, offsets)
+
+        parsed = parse_frames(chunk)
+        self.assertAlmostEqual(parsed["time"][0], 8.2682746688379041E+001)
+        self.assertEqual(list(times), [0., parsed["time"][0]])
+
+    def test_compressed(self):
+        data = self.FILE.read_bytes()
+        self.assertIsNone(detect_compression(self.FILE))
+        with TemporaryDirectory() as tmp:
+            for codec in (gzip, lzma, bz2):
+                path = Path(tmp) / f"test.md.{codec.__name__}"
+                path.write_bytes(codec.compress(data))
+                self.assertEqual(detect_compression(path), codec.__name__)
+
+                for read_ahead in (0, 2):
+                    with open_md(path, read_ahead=read_ahead) as in_file:
+                        self.assertIn(b"END header", read_header(in_file))
+                        chunks = list(iter_chunks(in_file, 1))
+                    self.assertEqual(len(chunks), 2)
+                    self.assertEqual(len(parse_frames(b"".join(chunks))["time"]), 2)
+    def test_strided_reads(self):
+        header, _, frames = self.FILE.read_bytes().partition(b"END header")
+        header += b"END header"
+        data = header + frames * 500
+
+        class Recorder(io.BytesIO):
+            def read(self, size=-1):
+                sizes.append(size)
+                return super().read(size)
+
+        max_reads = []
+        for stride in (1, 100):
+            sizes = []
+            in_file = Recorder(data)
+            read_header(in_file)
+            chunks = list(iter_chunks(in_file, 4, stride=stride))
+            max_reads.append(max(sizes))
+            self.assertEqual(len(parse_frames(b"".join(chunks))["time"]), 1000 // stride)
+
+        self.assertEqual(max_reads[0], max_reads[1])
+
+if __name__ == "main":
+    main()
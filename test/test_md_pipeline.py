@@ -0,0 +1,39 @@
+from pathlib import Path
+from unittest import TestCase, main
+
+import numpy as np
+
+from castep_outputs_tools.md_parser import IrregularLayoutError, parse_frames, read_header
+from castep_outputs_tools.md_pipeline import _parse_chunk
+
+
+class test_md_pipeline(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_irregular_chunk(self):
+        with self.FILE.open("rb") as in_file:
+            header = read_header(in_file)
+            frames = in_file.read()
+
+        def interleave(frame):
+            lines = frame.split(b"\n")
+            atoms = [[line for line in lines if line.rstrip().endswith(b"<-- " + tag)]
+                     for tag in (b"R", b"V", b"F")]
+            fixed = [line for line in lines if not line.rstrip().endswith((b"<-- R", b"<-- V",
+                                                                            b"<-- F"))]
+            return b"\n".join(fixed + [line for atom in zip(*atoms) for line in atom])
+
+        irregular = b"\n\n".join(map(interleave, frames.strip(b"\n").split(b"\n\n")))
+        with self.assertRaises(IrregularLayoutError):
+            parse_frames(irregular)
+
+        expected = parse_frames(frames)
+        block = _parse_chunk(header, irregular)
+        self.assertEqual(block["species"], expected["species"])
+        for key, val in expected.items():
+            if key != "species":
+                with self.subTest(key=key):
+                    self.assertTrue(np.allclose(block[key], np.reshape(val, block[key].shape)))
+
+if __name__ == "main":
+    main()
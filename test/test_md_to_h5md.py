@@ -1,7 +1,22 @@
+import gzip
+import shutil
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase, main
 
+import h5py
+import numpy as np
+
+from castep_outputs_tools.h5md_layout import read_series
+from castep_outputs_tools.md_pipeline import parse_ahead
+from castep_outputs_tools.md_to_h5md import (
+    _memory_budget,
+    _parse_size,
+    concatenate,
+    convert_sharded,
+)
 from castep_outputs_tools.md_to_h5md import main as conv
+from castep_outputs_tools.profiling import current_rss
 
 
 class test_md_to_h5md(TestCase):
@@ -10,5 +25,295 @@ class test_md_to_h5md(TestCase):
     def test_convert(self):
         conv(self.FILE, "test.out")
 
+    def test_streamed_frames(self):
+        conv(self.FILE, "test.out")
+        with h5py.File("test.out") as out_file:
+            pos = out_file["particles/position/value"]
+            self.assertEqual(pos.shape, (2, 8, 3))
+            self.assertEqual(pos.maxshape, (None, 8, 3))
+            self.assertEqual(list(read_series(out_file, "particles/position/step")[:]), [1, 2])
+            self.assertAlmostEqual(out_file["observables/temperature/value"][1],
+                                   2.0043929124486039E-003)
+
+    def test_block_writes(self):
+        conv(self.FILE, "test.out", block_frames=1)
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/force/value"].shape, (2, 8, 3))
+            self.assertAlmostEqual(out_file["particles/position/value"][1, 2, 0],
+                                   5.1837220163970112E+000)
+            self.assertAlmostEqual(out_file["observables/kinetic_energy/value"][0],
+                                   2.5277616819407205E-002)
+
+    def test_parallel(self):
+        conv(self.FILE, "test.out", block_frames=1, jobs=2)
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(list(read_series(out_file, "particles/position/step")[:]), [1, 2])
+            self.assertAlmostEqual(out_file["particles/position/value"][1, 2, 0],
+                                   5.1837220163970112E+000)
+
+    def test_compression(self):
+        conv(self.FILE, "test.out", compression="gzip", compression_opts=6,
+             shuffle=True, fletcher32=True, chunk_frames=2)
+        with h5py.File("test.out") as out_file:
+            pos = out_file["particles/position/value"]
+            self.assertEqual(pos.compression, "gzip")
+            self.assertEqual(pos.compression_opts, 6)
+            self.assertTrue(pos.shuffle)
+            self.assertTrue(pos.fletcher32)
+            self.assertEqual(pos.chunks[1:], (8, 3))
+            self.assertAlmostEqual(pos[1, 2, 0], 5.1837220163970112E+000)
+
+    def test_precision(self):
+        conv(self.FILE, "test.out", precision="position=quantised:3,velocity=float32")
+        with h5py.File("test.out") as out_file:
+            pos = out_file["particles/position/value"]
+            self.assertEqual(pos.scaleoffset, 3)
+            self.assertEqual(pos.attrs["precision"], "quantised:3")
+            self.assertAlmostEqual(pos.attrs["absolute_error"], 5e-4)
+            self.assertAlmostEqual(pos[1, 2, 0], 5.1837220163970112E+000, places=3)
+            self.assertEqual(out_file["particles/velocity/value"].dtype, "float32")
+            self.assertEqual(out_file["particles/force/value"].dtype, "float64")
+
+        with self.assertRaises(ValueError):
+            conv(self.FILE, "test.out", precision="float16")
+
+        with self.assertRaisesRegex(ValueError, "position"):
+            conv(self.FILE, "test.out", precision="position=quantised:3", fletcher32=True)
+
+    def test_follow(self):
+        conv(self.FILE, "test.out", follow=True, poll_interval=0.01, timeout=0.)
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+    def test_append_follow(self):
+        conv(self.FILE, "test.out")
+        with self.assertRaises(ValueError):
+            conv(self.FILE, "test.out", append=True, follow=True, poll_interval=0.01, timeout=0.)
+
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/position/step"].shape, ())
+            self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+        conv(self.FILE, "test.out", follow=True, poll_interval=0.01, timeout=0.)
+        conv(self.FILE, "test.out", append=True, follow=True, poll_interval=0.01, timeout=0.)
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+    def test_append(self):
+        with TemporaryDirectory() as tmp_dir:
+            md_path = Path(tmp_dir) / "test.md"
+            shutil.copy(self.FILE, md_path)
+
+            conv(md_path, "test.out")
+            conv(md_path, "test.out", append=True)
+
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+            self.assertEqual(list(read_series(out_file, "particles/position/step")[:]), [1, 2])
+
+    def test_selection(self):
+        with TemporaryDirectory() as tmp_dir:
+            md_path = Path(tmp_dir) / "test.md"
+            shutil.copy(self.FILE, md_path)
+
+            for kwargs, steps in (({"stride": 2}, [1]),
+                                  ({"start": -1}, [2]),
+                                  ({"start_time": 0.001}, [2]),
+                                  ({"stop_time": -0.001}, [1])):
+                conv(md_path, "test.out", **kwargs)
+                with h5py.File("test.out") as out_file:
+                    self.assertEqual(list(read_series(out_file, "particles/position/step")[:]), steps)
+                    self.assertEqual(out_file["particles/position/value"].shape,
+                                     (len(steps), 8, 3))
+
+            (Path(tmp_dir) / "test.md.gz").write_bytes(gzip.compress(md_path.read_bytes()))
+            for path in (md_path, Path(tmp_dir) / "test.md.gz"):
+                for kwargs in ({"stride": -1}, {"stride": 0}, {"time_stride": -1.}):
+                    with self.subTest(path=path.name, **kwargs), \
+                         self.assertRaisesRegex(ValueError, "positive"):
+                        conv(path, "test.out", **kwargs)
+
+    def test_fields(self):
+        conv(self.FILE, "test.out", fields="energies,temperature")
+        with h5py.File("test.out") as out_file:
+            self.assertNotIn("particles/position", out_file)
+            self.assertNotIn("particles/box/edges", out_file)
+            self.assertNotIn("observables/pressure", out_file)
+            self.assertEqual(list(read_series(out_file, "observables/temperature/step")[:]), [1, 2])
+            self.assertAlmostEqual(out_file["observables/kinetic_energy/value"][0],
+                                   2.5277616819407205E-002)
+
+    def test_batch(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            for name in ("a.md", "b.md"):
+                shutil.copy(self.FILE, tmp / name)
+            (tmp / "bad.md").write_text("BEGIN header\nEND header\n\n  1.0\n  garbage\n")
+
+            results = conv([tmp], tmp / "{stem}.h5md", workers=2)
+            self.assertEqual([res.source.name for res in results], ["a.md", "b.md", "bad.md"])
+            self.assertEqual([res.error is None for res in results], [True, True, False])
+            with h5py.File(tmp / "b.h5md") as out_file:
+                self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+            results = conv([str(tmp / "[ab].md")], tmp / "glob_{stem}.h5md")
+            self.assertEqual([res.output.name for res in results],
+                             ["glob_a.h5md", "glob_b.h5md"])
+
+            with self.assertRaises(ValueError):
+                conv([tmp], tmp / "same.h5md")
+
+    def test_concatenate(self):
+        begin, end, _, last = self.FILE.read_text().split("\n\n")
+        restart = last.replace("8.2682746688379041E+001", "1.6536549337675808E+002")
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            shutil.copy(self.FILE, tmp / "run.md")
+            (tmp / "run_restart.md").write_text(
+                "\n\n".join((begin, end, last, restart)) + "\n",
+            )
+
+            concatenate([tmp / "run.md", tmp / "run_restart.md"], tmp / "full.h5md")
+            with h5py.File(tmp / "full.h5md") as out_file:
+                self.assertEqual(out_file["particles/position/value"].shape, (3, 8, 3))
+                self.assertEqual(list(read_series(out_file, "particles/position/step")[:]), [1, 2, 3])
+                self.assertAlmostEqual(read_series(out_file, "particles/position/time")[2],
+                                       1.6536549337675808E+002)
+
+    def test_sharded(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            md_path = tmp / "test.md"
+            shutil.copy(self.FILE, md_path)
+            stats = convert_sharded(md_path, tmp / "out.h5md", 4)
+            self.assertEqual([stat.frames for stat in stats], [1, 1])
+            self.assertTrue((tmp / "out.shard001.h5md").exists())
+
+            conv(md_path, tmp / "ref.h5md", compact=False)
+            with h5py.File(tmp / "out.h5md") as out_file, h5py.File(tmp / "ref.h5md") as ref:
+                pos = out_file["particles/position/value"]
+                self.assertTrue(pos.is_virtual)
+                self.assertTrue(np.array_equal(pos[:], ref["particles/position/value"][:]))
+                self.assertEqual(list(out_file["observables/pressure/step"]), [1, 2])
+                self.assertEqual(out_file["particles/species"].attrs.keys(),
+                                 ref["particles/species"].attrs.keys())
+
+            with self.assertRaises(ValueError):
+                convert_sharded(md_path, tmp / "out.zarr", 2)
+            with self.assertRaises(ValueError):
+                convert_sharded(md_path, tmp / "out.h5md", 2, start=5)
+            with self.assertRaisesRegex(ValueError, "positive"):
+                convert_sharded(md_path, tmp / "out.h5md", 0)
+
+    def test_sharded_species(self):
+        text = self.FILE.read_text()
+        for index, label in zip(range(3, 9), "OOCCHH"):
+            text = text.replace(f" Si              {index}  ",
+                                f" {label:<15} {(index - 1) % 2 + 1}  ")
+
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            md_path = tmp / "multi.md"
+            md_path.write_text(text)
+            convert_sharded(md_path, tmp / "out.h5md", 2)
+            conv(md_path, tmp / "ref.h5md", compact=False)
+            with h5py.File(tmp / "out.h5md") as out_file, h5py.File(tmp / "ref.h5md") as ref:
+                species = out_file["particles/species"]
+                self.assertEqual(h5py.check_enum_dtype(species.dtype),
+                                 {"Si": 0, "O": 1, "C": 2, "H": 3})
+                self.assertEqual(list(species), [0, 0, 1, 1, 2, 2, 3, 3])
+                self.assertEqual(h5py.check_enum_dtype(ref["particles/species"].dtype),
+                                 h5py.check_enum_dtype(species.dtype))
+
+    def test_compressed(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / "test.md.gz").write_bytes(gzip.compress(self.FILE.read_bytes()))
+            results = conv([tmp], tmp / "{stem}.h5md")
+            self.assertEqual([res.output.name for res in results], ["test.h5md"])
+            with h5py.File(tmp / "test.h5md") as out_file:
+                self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+    def test_profile(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            stats = conv(self.FILE, tmp / "test.h5md", profile_path=tmp / "conv.pstats")
+            self.assertTrue((tmp / "conv.pstats").is_file())
+        self.assertEqual(stats.frames, 2)
+        self.assertGreater(stats.bytes_read, 0)
+        self.assertGreater(stats.calls["write"], 0)
+        self.assertLessEqual({"parse", "create", "write", "total"}, set(stats.stages))
+        self.assertIn("Frames:  2", stats.report())
+
+    def test_parse_ahead(self):
+        def blocks():
+            yield from range(5)
+            raise ValueError("bad frame")
+
+        ahead = parse_ahead(blocks(), 2)
+        self.assertEqual([next(ahead) for _ in range(5)], list(range(5)))
+        with self.assertRaises(ValueError):
+            next(ahead)
+
+        ahead = parse_ahead(iter(range(100)), 2)
+        self.assertEqual(next(ahead), 0)
+        ahead.close()
+
+        for queue_blocks in (0, 3):
+            conv(self.FILE, "test.out", block_frames=1, queue_blocks=queue_blocks)
+            with h5py.File("test.out") as out_file:
+                self.assertAlmostEqual(out_file["particles/position/value"][1, 2, 0],
+                                       5.1837220163970112E+000)
+
+    def test_memory_budget(self):
+        self.assertEqual(_parse_size("512M"), 512 << 20)
+        self.assertEqual(_parse_size("2GiB"), 2 << 30)
+        with self.assertRaises(ValueError):
+            _memory_budget(1)
+
+        stats = conv(self.FILE, "test.out", max_memory=current_rss() + (20 << 20),
+                     track_memory=True)
+        self.assertEqual(stats.frames, 2)
+        self.assertLessEqual({"parse", "write", "total"}, set(stats.traced_peak))
+        self.assertIn("Traced (MB)", stats.report())
+        with h5py.File("test.out") as out_file:
+            self.assertEqual(out_file["particles/position/value"].shape, (2, 8, 3))
+
+    def test_compact(self):
+        text = self.FILE.read_text()
+        begin, end, first, last = text.split("\n\n")
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / "nvt.md").write_text(text.replace("1.0324059500983507E+001",
+                                                     "1.0261212863294524E+001"))
+            irregular = last.replace("8.2682746688379041E+001", "1.7000000000000000E+002")
+            (tmp / "irregular.md").write_text("\n\n".join((begin, end, first, last, irregular)))
+
+            for name, kwargs in (("nvt.md", {}), ("nvt.md", {"block_frames": 1})):
+                conv(tmp / name, tmp / "out.h5md", **kwargs)
+                with h5py.File(tmp / "out.h5md") as out_file:
+                    step = out_file["particles/position/step"]
+                    self.assertEqual((step.shape, step[()], step.attrs["offset"]), ((), 1, 1))
+                    self.assertEqual(out_file["particles/box/edges"].shape, (3, 3))
+                    self.assertEqual(list(read_series(out_file, "observables/pressure/step")[:]),
+                                     [1, 2])
+
+            conv(tmp / "nvt.md", tmp / "out.h5md", precision="box=quantised:2")
+            with h5py.File(tmp / "out.h5md") as out_file:
+                box = out_file["particles/box/edges"]
+                self.assertEqual(box.attrs["precision"], "quantised:2")
+                self.assertEqual(box[0, 0], 10.26)
+
+            conv(self.FILE, tmp / "out.h5md")
+            with h5py.File(tmp / "out.h5md") as out_file:
+                self.assertEqual(out_file["particles/box/edges/value"].shape, (2, 3, 3))
+                self.assertEqual(out_file["particles/box/edges/step"].shape, ())
+
+            for kwargs in ({"block_frames": 2}, {"compact": False}):
+                conv(tmp / "irregular.md", tmp / "out.h5md", **kwargs)
+                with h5py.File(tmp / "out.h5md") as out_file:
+                    self.assertEqual(list(out_file["particles/box/edges/step"]), [1, 2, 3])
+                    self.assertEqual(out_file["observables/temperature/time"][2], 170.)
+
 if __name__ == "main":
     main()
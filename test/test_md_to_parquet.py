@@ -0,0 +1,52 @@
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from castep_outputs_tools.md_to_parquet import main as conv
+
+
+class test_md_to_parquet(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_parquet(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.parquet"
+            conv(self.FILE, out_path, row_group_frames=1)
+            self.assertEqual(pq.ParquetFile(out_path).metadata.num_row_groups, 2)
+
+            table = pq.read_table(out_path, filters=[("step", ">", 1)])
+            self.assertEqual(table.num_rows, 1)
+            self.assertAlmostEqual(table["temperature"][0].as_py(), 2.0043929124486039E-003)
+            self.assertIn("stress_xy", table.column_names)
+            self.assertNotIn("stress", table.column_names)
+
+    def test_arrow(self):
+        with TemporaryDirectory() as tmp:
+            out_path = Path(tmp) / "test.arrow"
+            conv(self.FILE, out_path, compression="lz4")
+            table = pa.ipc.open_file(out_path).read_all()
+            self.assertEqual(table["step"].to_pylist(), [1, 2])
+            self.assertAlmostEqual(table["kinetic_energy"][0].as_py(), 2.5277616819407205E-002)
+
+            with self.assertRaises(ValueError):
+                conv(self.FILE, Path(tmp) / "test.csv")
+
+    def test_selection(self):
+        with TemporaryDirectory() as tmp:
+            md_path = Path(tmp) / "test.md"
+            shutil.copy(self.FILE, md_path)
+            out_path = Path(tmp) / "test.parquet"
+            for opts, steps in (({"start": -1}, [2]),
+                                ({"stop": -1}, [1]),
+                                ({"start": -2, "stride": 2}, [1]),
+                                ({"start_time": -1e-6}, [2])):
+                with self.subTest(**opts):
+                    conv(md_path, out_path, **opts)
+                    self.assertEqual(pq.read_table(out_path)["step"].to_pylist(), steps)
+
+if __name__ == "main":
+    main()
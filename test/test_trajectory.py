@@ -0,0 +1,62 @@
+import gzip
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+import numpy as np
+
+from castep_outputs_tools import read_md_arrays
+from castep_outputs_tools.md_parser import index_path
+
+
+class test_trajectory(TestCase):
+    FILE = Path(__file__).parent / "test.md"
+
+    def test_read(self):
+        traj = read_md_arrays(self.FILE)
+        self.assertEqual((traj.n_frames, traj.n_atoms), (2, 8))
+        self.assertEqual(list(traj.species), ["Si"] * 8)
+        self.assertEqual(traj.positions.shape, (2, 8, 3))
+        self.assertTrue(traj.forces.flags.c_contiguous)
+        self.assertEqual(list(traj.step), [1, 2])
+        self.assertAlmostEqual(traj.positions[1, 2, 0], 5.1837220163970112E+000)
+        self.assertAlmostEqual(traj.kinetic_energy[0], 2.5277616819407205E-002)
+        self.assertAlmostEqual(traj.temperature[1], 2.0043929124486039E-003)
+
+    def test_select(self):
+        traj = read_md_arrays(self.FILE, fields=["temperature"], start=1)
+        self.assertIsNone(traj.positions)
+        self.assertEqual(list(traj.step), [2])
+        self.assertAlmostEqual(traj.time[0], 8.2682746688379041E+001)
+
+        traj = read_md_arrays(self.FILE)[-1]
+        self.assertEqual(traj.positions.shape, (1, 8, 3))
+        self.assertEqual(list(traj.step), [2])
+
+        with self.assertRaises(ValueError):
+            read_md_arrays(self.FILE, fields=["charge"])
+
+        for kwargs in ({"stride": -1}, {"stride": 0}, {"time_stride": 0.}):
+            with self.subTest(**kwargs), self.assertRaisesRegex(ValueError, "positive"):
+                read_md_arrays(self.FILE, **kwargs)
+
+    def test_index_cache(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "test.md"
+            path.write_bytes(self.FILE.read_bytes())
+            self.assertEqual(list(read_md_arrays(path, start=-1).step), [2])
+            self.assertFalse(index_path(path).exists())
+            read_md_arrays(path, cache_index=True)
+            self.assertTrue(index_path(path).exists())
+
+    def test_stream(self):
+        expected = read_md_arrays(self.FILE)
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "test.md.gz"
+            path.write_bytes(gzip.compress(self.FILE.read_bytes()))
+            traj = read_md_arrays(path, block_frames=1)
+        np.testing.assert_array_equal(traj.velocities, expected.velocities)
+        np.testing.assert_array_equal(traj.step, expected.step)
+
+if __name__ == "main":
+    main()